@@ -0,0 +1,53 @@
+from django.contrib import admin
+from users.admin import KeysetChangeList
+from .models import Conversation, Membership, Message
+
+# Register your models here.
+admin.site.register(Conversation)
+
+
+class KeysetAdmin(admin.ModelAdmin):
+    """
+    An admin for the large chat tables: keyset-paginated with an estimated
+    count, loading only the listed columns, and with related rows picked by
+    id instead of select lists of every user and conversation.
+    """
+
+    change_list_template = "admin/chats/keyset_change_list.html"
+    list_select_related = False
+    list_per_page = 100
+    ordering = ("-id",)
+    sortable_by = ()
+    show_full_result_count = False
+
+    def get_changelist(self, request, **kwargs):
+        """
+        Use the keyset-paginated changelist.
+        """
+        return KeysetChangeList
+
+
+@admin.register(Membership)
+class MembershipAdmin(KeysetAdmin):
+    """
+    The membership admin.
+    """
+
+    list_display = ("id", "conversation_id", "user_id", "unread_count",
+                    "last_message_at")
+    # columns loaded for the changelist
+    list_columns = list_display
+    raw_id_fields = ("conversation", "user")
+
+
+@admin.register(Message)
+class MessageAdmin(KeysetAdmin):
+    """
+    The message admin. Counting the partitioned message table exactly would
+    scan every partition.
+    """
+
+    list_display = ("id", "conversation_id", "sender_id", "created_at", "body")
+    # columns loaded for the changelist
+    list_columns = list_display
+    raw_id_fields = ("conversation", "sender")
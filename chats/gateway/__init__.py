@@ -0,0 +1,5 @@
+"""
+Routing of real-time messages between the WebSocket connections of
+several ASGI nodes. See `gateway.Gateway` for the node side and `brokers`
+for the transports between nodes.
+"""
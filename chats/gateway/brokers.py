@@ -0,0 +1,224 @@
+import queue
+import threading
+import time
+from collections import defaultdict
+import msgpack
+
+
+class Broker:
+    """
+    Moves batches of (user id, payload) pairs between gateway nodes and keeps
+    track of the nodes every user is connected to.
+    """
+
+    def register(self, user_id, node_id):
+        """
+        Records that the user has a connection on the node.
+        """
+        raise NotImplementedError
+
+    def unregister(self, user_id, node_id):
+        """
+        Records that the user has no connection left on the node.
+        """
+        raise NotImplementedError
+
+    def nodes_of(self, user_ids):
+        """
+        Maps each of the user ids to the set of nodes it is connected to.
+        """
+        raise NotImplementedError
+
+    def publish(self, node_id, batch):
+        """
+        Queues a batch of (user id, payload) pairs for the node.
+        """
+        raise NotImplementedError
+
+    def consume(self, node_id, timeout):
+        """
+        Returns the next batch queued for the node, or None after `timeout`
+        seconds without one.
+        """
+        raise NotImplementedError
+
+
+class MemoryBroker(Broker):
+    """
+    A broker for a single process, used when no broker is configured.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.registry = defaultdict(set)
+        self.queues = defaultdict(queue.Queue)
+
+    def register(self, user_id, node_id):
+        with self.lock:
+            self.registry[user_id].add(node_id)
+
+    def unregister(self, user_id, node_id):
+        with self.lock:
+            self.registry[user_id].discard(node_id)
+            if not self.registry[user_id]:
+                del self.registry[user_id]
+
+    def nodes_of(self, user_ids):
+        with self.lock:
+            return {user_id: set(self.registry.get(user_id, ()))
+                    for user_id in user_ids}
+
+    def publish(self, node_id, batch):
+        with self.lock:
+            node_queue = self.queues[node_id]
+        node_queue.put(batch)
+
+    def consume(self, node_id, timeout):
+        with self.lock:
+            node_queue = self.queues[node_id]
+        try:
+            return node_queue.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+
+class LocalBroker(Broker):
+    """
+    A stand-in for a networked broker between local processes, for tests and
+    benchmarks. Create it with the ids of all nodes before starting the
+    worker processes and pass it to them.
+    """
+
+    def __init__(self, node_ids, manager, context):
+        self.registry = manager.dict()
+        self.lock = manager.Lock()
+        self.queues = {node_id: context.Queue() for node_id in node_ids}
+
+    def register(self, user_id, node_id):
+        with self.lock:
+            self.registry[user_id] = self.registry.get(user_id, frozenset()) | {
+                node_id}
+
+    def unregister(self, user_id, node_id):
+        with self.lock:
+            nodes = self.registry.get(user_id, frozenset()) - {node_id}
+            if nodes:
+                self.registry[user_id] = nodes
+            else:
+                self.registry.pop(user_id, None)
+
+    def nodes_of(self, user_ids):
+        # one round trip to the manager process instead of one per user
+        registry = self.registry.copy()
+        return {user_id: set(registry.get(user_id, ())) for user_id in user_ids}
+
+    def publish(self, node_id, batch):
+        self.queues[node_id].put(batch)
+
+    def consume(self, node_id, timeout):
+        try:
+            return self.queues[node_id].get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+
+class RedisBroker(Broker):
+    """
+    A broker backed by Redis, or anything speaking its protocol.
+
+    The registry is one set of node ids per user, and every node has a list
+    of msgpack-encoded batches it pops from. A node proves it is alive with
+    a heartbeat key expiring after `heartbeat_ttl` seconds, refreshed while
+    it consumes. Nodes without a heartbeat are dropped from the registry
+    when looked up and get nothing published, so their lists stop being
+    refreshed and expire `queue_ttl` seconds later.
+    """
+
+    def __init__(self, client, prefix="oessenger:gateway", queue_ttl=60,
+                 heartbeat_ttl=15):
+        self.client = client
+        self.prefix = prefix
+        self.queue_ttl = queue_ttl
+        self.heartbeat_ttl = heartbeat_ttl
+        self.beaten_at = {}
+
+    @classmethod
+    def from_url(cls, url, **kwargs):
+        """
+        Connects with the `redis` package, which is only needed for this.
+        """
+        import redis
+        return cls(redis.Redis.from_url(url), **kwargs)
+
+    def user_key(self, user_id):
+        return f"{self.prefix}:user:{user_id}"
+
+    def node_key(self, node_id):
+        return f"{self.prefix}:node:{node_id}"
+
+    def heartbeat_key(self, node_id):
+        return f"{self.prefix}:alive:{node_id}"
+
+    def beat(self, node_id):
+        """
+        Refreshes the node's heartbeat, at most every third of its TTL.
+        """
+        now = time.monotonic()
+        if now - self.beaten_at.get(node_id, -self.heartbeat_ttl) \
+                >= self.heartbeat_ttl / 3:
+            self.client.set(self.heartbeat_key(node_id), 1, ex=self.heartbeat_ttl)
+            self.beaten_at[node_id] = now
+
+    def alive(self, node_ids):
+        """
+        Returns the subset of the nodes with a live heartbeat.
+        """
+        node_ids = list(node_ids)
+        pipeline = self.client.pipeline(transaction=False)
+        for node_id in node_ids:
+            pipeline.exists(self.heartbeat_key(node_id))
+        return {node_id for node_id, exists in zip(node_ids, pipeline.execute())
+                if exists}
+
+    def register(self, user_id, node_id):
+        self.beat(node_id)
+        self.client.sadd(self.user_key(user_id), node_id)
+
+    def unregister(self, user_id, node_id):
+        self.client.srem(self.user_key(user_id), node_id)
+
+    def nodes_of(self, user_ids):
+        user_ids = list(user_ids)
+        pipeline = self.client.pipeline(transaction=False)
+        for user_id in user_ids:
+            pipeline.smembers(self.user_key(user_id))
+        nodes = {user_id: {node.decode() if isinstance(node, bytes) else node
+                           for node in members}
+                 for user_id, members in zip(user_ids, pipeline.execute())}
+        registered = set().union(*nodes.values())
+        if not registered:
+            return nodes
+
+        alive = self.alive(registered)
+        if alive != registered:
+            pipeline = self.client.pipeline(transaction=False)
+            for user_id, user_nodes in nodes.items():
+                if user_nodes - alive:
+                    pipeline.srem(self.user_key(user_id), *(user_nodes - alive))
+            pipeline.execute()
+        return {user_id: user_nodes & alive for user_id, user_nodes in nodes.items()}
+
+    def publish(self, node_id, batch):
+        if not self.alive([node_id]):
+            return
+        pipeline = self.client.pipeline(transaction=False)
+        pipeline.rpush(self.node_key(node_id), msgpack.packb(batch))
+        pipeline.expire(self.node_key(node_id), self.queue_ttl)
+        pipeline.execute()
+
+    def consume(self, node_id, timeout):
+        self.beat(node_id)
+        item = self.client.blpop([self.node_key(node_id)], timeout=timeout)
+        if item is None:
+            return None
+        return [tuple(pair) for pair in msgpack.unpackb(item[1], raw=False)]
@@ -0,0 +1,212 @@
+import logging
+import os
+import socket
+import threading
+from collections import defaultdict
+from django.conf import settings
+from .brokers import MemoryBroker, RedisBroker
+
+logger = logging.getLogger(__name__)
+
+# the longest pause between retries while the broker fails, in seconds
+MAX_BACKOFF = 5
+
+
+class Gateway:
+    """
+    The node side of the gateway: holds this node's connections and routes
+    payloads to users connected anywhere.
+
+    Local connections get payloads immediately. Payloads for other nodes are
+    buffered and sent by a background thread every `flush_interval` seconds,
+    with one registry lookup for all pending users and at most `batch_size`
+    payloads per published batch, so a burst costs a few broker round trips
+    instead of one per recipient.
+
+    Broker errors do not stop the thread: it logs them, backs off and keeps
+    whatever was not published for the next attempt.
+    """
+
+    def __init__(self, node_id, broker, batch_size=100, flush_interval=0.005):
+        self.node_id = node_id
+        self.broker = broker
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.connections = defaultdict(set)
+        self.pending = []
+        self.unsent = []
+        self.lock = threading.Lock()
+        self.stopped = threading.Event()
+        self.thread = None
+
+    def connect(self, user_id, deliver):
+        """
+        Adds a connection of the user. `deliver` is called with every payload
+        for the user, possibly from the gateway thread.
+        """
+        with self.lock:
+            first = not self.connections[user_id]
+            self.connections[user_id].add(deliver)
+        if first:
+            self.broker.register(user_id, self.node_id)
+
+    def disconnect(self, user_id, deliver):
+        """
+        Removes a connection of the user.
+        """
+        with self.lock:
+            self.connections[user_id].discard(deliver)
+            last = not self.connections[user_id]
+            if last:
+                del self.connections[user_id]
+        if last:
+            self.broker.unregister(user_id, self.node_id)
+
+    def send(self, user_ids, payload):
+        """
+        Delivers the payload to every connection of the users, on any node.
+        """
+        user_ids = list(user_ids)
+        for user_id in user_ids:
+            self.deliver(user_id, payload)
+        with self.lock:
+            self.pending.append((user_ids, payload))
+
+    def deliver(self, user_id, payload):
+        """
+        Hands the payload to the user's connections on this node.
+        """
+        with self.lock:
+            connections = list(self.connections.get(user_id, ()))
+        for deliver in connections:
+            deliver(payload)
+
+    def send_now(self, messages):
+        """
+        Delivers (user_ids, payload) pairs like `send`, but publishes them to
+        the other nodes before returning, with one registry lookup for all.
+        Broker errors are raised, so the caller knows nothing was confirmed.
+        """
+        for user_ids, payload in messages:
+            for user_id in user_ids:
+                self.deliver(user_id, payload)
+        for node_id, batch in self.route(messages):
+            self.broker.publish(node_id, batch)
+
+    def route(self, pending):
+        """
+        Splits (user_ids, payload) pairs into batches of (user, payload) per
+        other node holding a connection of the user.
+        """
+        nodes = self.broker.nodes_of(
+            {user_id for user_ids, _ in pending for user_id in user_ids})
+        batches = defaultdict(list)
+        for user_ids, payload in pending:
+            for user_id in user_ids:
+                for node_id in nodes.get(user_id, ()):
+                    if node_id != self.node_id:
+                        batches[node_id].append((user_id, payload))
+        return [(node_id, batch[start:start + self.batch_size])
+                for node_id, batch in batches.items()
+                for start in range(0, len(batch), self.batch_size)]
+
+    def flush(self):
+        """
+        Publishes the pending payloads to the other nodes. Returns the number
+        of (user, payload) pairs sent.
+
+        If the broker fails, the payloads not published yet are kept, either
+        as pending or as routed batches, and the error is raised.
+        """
+        with self.lock:
+            pending, self.pending = self.pending, []
+            unsent, self.unsent = self.unsent, []
+        if not pending and not unsent:
+            return 0
+
+        try:
+            unsent += self.route(pending) if pending else []
+        except Exception:
+            with self.lock:
+                self.pending[:0] = pending
+                self.unsent[:0] = unsent
+            raise
+
+        sent = 0
+        for position, (node_id, batch) in enumerate(unsent):
+            try:
+                self.broker.publish(node_id, batch)
+            except Exception:
+                with self.lock:
+                    self.unsent[:0] = unsent[position:]
+                raise
+            sent += len(batch)
+        return sent
+
+    def poll(self, timeout):
+        """
+        Delivers the next batch other nodes sent to this one, waiting up to
+        `timeout` seconds for it. Returns the number of payloads delivered.
+        """
+        batch = self.broker.consume(self.node_id, timeout)
+        for user_id, payload in batch or ():
+            self.deliver(user_id, payload)
+        return len(batch or ())
+
+    def run(self):
+        """
+        Polls and flushes until `stop` is called, backing off exponentially
+        while the broker fails.
+        """
+        backoff = 0
+        while not self.stopped.is_set():
+            try:
+                self.poll(self.flush_interval)
+                self.flush()
+            except Exception:
+                backoff = min(max(2 * backoff, self.flush_interval), MAX_BACKOFF)
+                logger.exception("Gateway %s: broker error, retrying in %.3fs",
+                                 self.node_id, backoff)
+                self.stopped.wait(backoff)
+            else:
+                backoff = 0
+
+    def start(self):
+        """
+        Runs the gateway in a daemon thread.
+        """
+        self.thread = threading.Thread(target=self.run, daemon=True,
+                                       name=f"gateway-{self.node_id}")
+        self.thread.start()
+
+    def stop(self):
+        """
+        Stops the gateway thread after a last flush.
+        """
+        self.stopped.set()
+        if self.thread is not None:
+            self.thread.join()
+        self.flush()
+
+
+gateway = None
+gateway_lock = threading.Lock()
+
+
+def get_gateway():
+    """
+    Returns this process's gateway, starting it on first use with the broker
+    configured in settings.GATEWAY.
+    """
+    global gateway
+    with gateway_lock:
+        if gateway is None:
+            options = getattr(settings, "GATEWAY", {})
+            broker_url = options.get("BROKER_URL")
+            gateway = Gateway(
+                options.get("NODE_ID") or f"{socket.gethostname()}:{os.getpid()}",
+                RedisBroker.from_url(broker_url) if broker_url else MemoryBroker(),
+                batch_size=options.get("BATCH_SIZE", 100),
+                flush_interval=options.get("FLUSH_INTERVAL", 0.005))
+            gateway.start()
+        return gateway
@@ -0,0 +1,35 @@
+from collections import defaultdict
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from ..models import Membership
+from .gateway import get_gateway
+
+
+class ProfileChangeSubscriber:
+    """
+    Pushes profile changes from the outbox to the connected sessions of the
+    changed user and of everyone sharing a conversation with them.
+
+    The relay runs in its own process, without connections, so the events
+    can only reach users through the broker; one has to be configured.
+    """
+
+    def __init__(self):
+        if not getattr(settings, "GATEWAY", {}).get("BROKER_URL"):
+            raise ImproperlyConfigured(
+                "ProfileChangeSubscriber needs GATEWAY['BROKER_URL'].")
+
+    def publish(self, events):
+        """
+        Sends each event to its recipients, looked up with one query for the
+        whole batch. Returns once the broker accepted every event and raises
+        if it failed, so the relay only moves past delivered events.
+        """
+        contacts = defaultdict(set)
+        for user_id, contact_id in Membership.objects.filter(
+                user_id__in={event["user"] for event in events}).values_list(
+                "user_id", "conversation__memberships__user_id").distinct():
+            contacts[user_id].add(contact_id)
+
+        get_gateway().send_now([(contacts[event["user"]] | {event["user"]}, event)
+                                for event in events])
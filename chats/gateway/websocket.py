@@ -0,0 +1,111 @@
+import asyncio
+from urllib.parse import parse_qs
+from asgiref.sync import sync_to_async
+from django.contrib.auth import get_user_model
+from rest_framework_simplejwt.exceptions import TokenError
+from rest_framework_simplejwt.settings import api_settings
+from rest_framework_simplejwt.tokens import AccessToken
+from oessenger import wire
+from ..models import Conversation
+from ..serializers import SocketMessageSerializer
+from .. import services
+from .gateway import get_gateway
+
+UNAUTHORIZED = 4401
+
+
+def authenticate(scope):
+    """
+    Returns the user id of the access token in the `token` query parameter,
+    or None if it is missing or invalid.
+    """
+    query = parse_qs(scope.get("query_string", b"").decode())
+    try:
+        token = AccessToken(query["token"][0])
+    except (KeyError, TokenError):
+        return None
+    return token[api_settings.USER_ID_CLAIM]
+
+
+def post_message(user_id, data):
+    """
+    Saves a message sent over the socket and publishes it. Returns an error
+    payload if it cannot be posted.
+    """
+    if not isinstance(data, dict):
+        return {"type": "error", "detail": "Expected an object."}
+    serializer = SocketMessageSerializer(data=data)
+    if not serializer.is_valid():
+        return {"type": "error", "detail": serializer.errors}
+    conversation = Conversation.objects.filter(
+        pk=serializer.validated_data["conversation"],
+        memberships__user_id=user_id).first()
+    if conversation is None:
+        return {"type": "error", "detail": "Not found."}
+    message = services.send_message(conversation, get_user_model()(pk=user_id),
+                                    serializer.validated_data["body"])
+    services.publish_message(message)
+    return None
+
+
+def frame(data, wire_format):
+    """
+    Builds the ASGI event sending data in the connection's wire format.
+    """
+    encoded = wire.encode(data, wire_format)
+    if isinstance(encoded, bytes):
+        return {"type": "websocket.send", "bytes": encoded}
+    return {"type": "websocket.send", "text": encoded}
+
+
+async def websocket_application(scope, receive, send):
+    """
+    Serves a chat WebSocket: messages sent by the client are posted to their
+    conversation, and messages for the user arrive from the gateway.
+    """
+    event = await receive()
+    if event["type"] != "websocket.connect":
+        return
+    user_id = authenticate(scope)
+    if user_id is None:
+        await send({"type": "websocket.close", "code": UNAUTHORIZED})
+        return
+    subprotocol, wire_format = wire.negotiate_subprotocol(
+        scope.get("subprotocols", []))
+    await send({"type": "websocket.accept", "subprotocol": subprotocol})
+
+    loop = asyncio.get_running_loop()
+    outgoing = asyncio.Queue()
+
+    def deliver(payload):
+        loop.call_soon_threadsafe(outgoing.put_nowait, payload)
+
+    gateway = get_gateway()
+    await sync_to_async(gateway.connect, thread_sensitive=False)(user_id, deliver)
+    receiving = asyncio.ensure_future(receive())
+    sending = asyncio.ensure_future(outgoing.get())
+    try:
+        while True:
+            done, _ = await asyncio.wait(
+                {receiving, sending}, return_when=asyncio.FIRST_COMPLETED)
+            if sending in done:
+                await send(frame(sending.result(), wire_format))
+                sending = asyncio.ensure_future(outgoing.get())
+            if receiving in done:
+                event = receiving.result()
+                if event["type"] == "websocket.disconnect":
+                    break
+                try:
+                    data = wire.decode(event.get("bytes") or event.get("text"),
+                                       wire_format)
+                except (TypeError, ValueError):  # e.g. text on a msgpack socket
+                    data = None
+                error = await sync_to_async(post_message)(user_id, data)
+                if error is not None:
+                    await send(frame(error, wire_format))
+                receiving = asyncio.ensure_future(receive())
+    finally:
+        receiving.cancel()
+        sending.cancel()
+        await sync_to_async(gateway.disconnect, thread_sensitive=False)(
+            user_id, deliver)
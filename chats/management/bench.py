@@ -0,0 +1,23 @@
+import statistics
+import time
+
+
+def measure(func, runs):
+    """
+    Runs `func` several times and returns the timings in milliseconds.
+    """
+    timings = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        func()
+        timings.append((time.perf_counter() - start) * 1000)
+    return timings
+
+
+def summarize(timings):
+    """
+    Returns the median and p95 of the timings as text.
+    """
+    timings = sorted(timings)
+    p95 = timings[min(len(timings) - 1, int(len(timings) * 0.95))]
+    return f"p50 {statistics.median(timings):.2f} ms, p95 {p95:.2f} ms"
@@ -0,0 +1,93 @@
+import multiprocessing
+import random
+import time
+from collections import Counter
+from django.core.management.base import BaseCommand
+from chats.gateway.brokers import LocalBroker
+from chats.gateway.gateway import Gateway
+
+
+def run_node(node_id, broker, user_ids, expected, ready, results):
+    """
+    A worker process: one gateway node with a connection per user, polling
+    until it has delivered `expected` payloads.
+    """
+    gateway = Gateway(node_id, broker)
+    delivered = 0
+
+    def count(payload):
+        nonlocal delivered
+        delivered += 1
+
+    for user_id in user_ids:
+        gateway.connect(user_id, count)
+    ready.set()
+    while delivered < expected:
+        gateway.poll(0.1)
+    results.put((node_id, delivered, time.perf_counter()))
+
+
+class Command(BaseCommand):
+    """
+    Starts several gateway nodes as local processes joined by the local
+    broker, fans messages out to users spread over them from another node,
+    and measures how many deliveries per second get through.
+    """
+
+    help = "Benchmark cross-node fan-out through the gateway."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--workers", type=int, default=4)
+        parser.add_argument("--users", type=int, default=2000,
+                            help="connected users per worker")
+        parser.add_argument("--messages", type=int, default=5000)
+        parser.add_argument("--recipients", type=int, default=20,
+                            help="users each message is sent to")
+        parser.add_argument("--batch-size", type=int, default=100)
+
+    def handle(self, *args, **options):
+        rng = random.Random(0)
+        workers = [f"worker-{i}" for i in range(options["workers"])]
+        users = {node_id: range(i * options["users"], (i + 1) * options["users"])
+                 for i, node_id in enumerate(workers)}
+        node_of = {user_id: node_id for node_id, user_ids in users.items()
+                   for user_id in user_ids}
+        sends = [rng.sample(range(len(node_of)), options["recipients"])
+                 for _ in range(options["messages"])]
+        expected = Counter(node_of[user_id] for send in sends for user_id in send)
+
+        context = multiprocessing.get_context()
+        with multiprocessing.Manager() as manager:
+            broker = LocalBroker(workers + ["producer"], manager, context)
+            results = context.Queue()
+            processes = []
+            for node_id in workers:
+                ready = context.Event()
+                process = context.Process(target=run_node, args=(
+                    node_id, broker, users[node_id], expected[node_id], ready,
+                    results))
+                process.start()
+                ready.wait()
+                processes.append(process)
+
+            producer = Gateway("producer", broker,
+                               batch_size=options["batch_size"])
+            payload = {"type": "message", "message": {"body": "x" * 64}}
+            start = time.perf_counter()
+            for user_ids in sends:
+                producer.send(user_ids, payload)
+                if len(producer.pending) >= options["batch_size"]:
+                    producer.flush()
+            producer.flush()
+
+            finished = [results.get() for _ in processes]
+            for process in processes:
+                process.join()
+
+        elapsed = max(end for _, _, end in finished) - start
+        total = sum(count for _, count, _ in finished)
+        self.stdout.write(
+            f"{options['workers']} nodes, {options['messages']} messages x "
+            f"{options['recipients']} recipients, batch size "
+            f"{options['batch_size']}: {total} deliveries in {elapsed:.2f} s, "
+            f"{total / elapsed:,.0f} deliveries/s")
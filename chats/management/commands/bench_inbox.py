@@ -0,0 +1,91 @@
+import random
+import uuid
+from datetime import timedelta
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.db.models import Count, F, Q
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from chats.models import Conversation, Membership, Message
+from chats import services
+from chats.management import bench
+
+User = get_user_model()
+
+
+class Command(BaseCommand):
+    """
+    Seeds a user with many conversations inside a rolled back transaction and
+    compares the denormalized inbox query with a COUNT(*) based one.
+    """
+
+    help = "Benchmark the inbox query at a large number of conversations."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--conversations", type=int, default=10_000)
+        parser.add_argument("--messages", type=int, default=3,
+                            help="messages per conversation")
+        parser.add_argument("--limit", type=int, default=50)
+        parser.add_argument("--runs", type=int, default=20)
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            user = self.seed(options["conversations"], options["messages"])
+
+            with CaptureQueriesContext(connection) as queries:
+                services.inbox(user, limit=options["limit"])
+            self.report("denormalized inbox", len(queries), bench.measure(
+                lambda: services.inbox(user, limit=options["limit"]),
+                options["runs"]))
+
+            def naive():
+                unread = Count("conversation__messages", filter=Q(
+                    conversation__messages__id__gt=F("last_read_message_id")))
+                return list(Membership.objects.filter(user=user)
+                            .select_related("conversation")
+                            .annotate(unread=unread)
+                            .order_by("-last_message_at", "-id")
+                            [:options["limit"]])
+            self.report("COUNT(*) inbox", 1, bench.measure(naive, options["runs"]))
+
+            transaction.set_rollback(True)
+
+    def seed(self, conversations, messages):
+        """
+        Creates the benchmark user, a peer and the conversations between them.
+        """
+        rng = random.Random(0)
+        suffix = uuid.uuid4().hex[:12]
+        user, peer = User.objects.bulk_create([
+            User(username=f"bench-{name}-{suffix}",
+                 email=f"bench-{name}-{suffix}@example.com", first_name=name)
+            for name in ("user", "peer")
+        ])
+        now = timezone.now()
+        created = Conversation.objects.bulk_create(
+            [Conversation(created_at=now) for _ in range(conversations)],
+            batch_size=1000)
+
+        memberships = []
+        for conversation in created:
+            at = now - timedelta(seconds=rng.randrange(30 * 24 * 3600))
+            for member in (user, peer):
+                memberships.append(Membership(
+                    conversation=conversation, user=member, last_message_at=at,
+                    unread_count=rng.randrange(messages + 1)))
+        Membership.objects.bulk_create(memberships, batch_size=1000)
+
+        Message.objects.bulk_create(
+            (Message(conversation=conversation, sender=peer, body="hello")
+             for conversation in created for _ in range(messages)),
+            batch_size=1000)
+        self.stdout.write(f"seeded {conversations} conversations, "
+                          f"{conversations * messages} messages")
+        return user
+
+    def report(self, label, queries, timings):
+        """
+        Prints the query count and the median and p95 of the timings.
+        """
+        self.stdout.write(f"{label}: {queries} query, {bench.summarize(timings)}")
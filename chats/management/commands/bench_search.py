@@ -0,0 +1,143 @@
+import random
+import time
+import uuid
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.utils import timezone
+from chats.models import Conversation, Membership, Message
+from chats import search
+from chats.management import bench
+
+User = get_user_model()
+
+VOCABULARY = 5000
+WORDS_PER_MESSAGE = 8
+
+
+def word(position):
+    """
+    Returns the word at a position of the synthetic vocabulary. Words have
+    the same length, so a substring match is a word match.
+    """
+    return f"w{position:04d}"
+
+
+class Command(BaseCommand):
+    """
+    Seeds messages with a skewed vocabulary inside a rolled back transaction
+    and compares the full-text search with a LIKE scan, for common and rare
+    words. On PostgreSQL the messages are generated by the server, which is
+    what makes the 50M message run practical.
+    """
+
+    help = "Benchmark message search at a large number of messages."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--messages", type=int, default=200_000,
+                            help="the full-size run on PostgreSQL uses 50000000")
+        parser.add_argument("--conversations", type=int, default=10_000)
+        parser.add_argument("--member-of", type=int, default=200,
+                            help="conversations the searching user is in")
+        parser.add_argument("--limit", type=int, default=50)
+        parser.add_argument("--runs", type=int, default=20)
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            user = self.seed(options)
+            limit = options["limit"]
+
+            start = time.perf_counter()
+            search.search(user, word(0), limit=limit)
+            self.stdout.write(f"first search {(time.perf_counter() - start) * 1000:.0f}"
+                              " ms (builds the in-process index off PostgreSQL)")
+
+            for label, query in (("common word", word(1)),
+                                 ("medium word", word(200)),
+                                 ("rare word", word(VOCABULARY - 1)),
+                                 ("two words", f"{word(2)} {word(50)}")):
+                self.report(f"search, {label}", bench.measure(
+                    lambda: search.search(user, query, limit=limit),
+                    options["runs"]))
+
+                def like():
+                    # ranking needs every match, not only the first page
+                    matches = Message.objects.filter(
+                        conversation__memberships__user=user)
+                    for term in query.split():
+                        matches = matches.filter(body__contains=term)
+                    return list(matches.values_list("id", "body"))
+                self.report(f"LIKE scan, {label}",
+                            bench.measure(like, max(1, options["runs"] // 4)))
+
+            transaction.set_rollback(True)
+
+    def seed(self, options):
+        """
+        Creates the searching user, the conversations and the messages.
+        """
+        suffix = uuid.uuid4().hex[:12]
+        user, peer = User.objects.bulk_create([
+            User(username=f"bench-{name}-{suffix}",
+                 email=f"bench-{name}-{suffix}@example.com", first_name=name)
+            for name in ("user", "peer")
+        ])
+        now = timezone.now()
+        conversations = Conversation.objects.bulk_create(
+            [Conversation(created_at=now) for _ in range(options["conversations"])],
+            batch_size=1000)
+        Membership.objects.bulk_create(
+            [Membership(conversation=conversation, user=member, last_message_at=now)
+             for i, conversation in enumerate(conversations)
+             for member in ((user, peer) if i < options["member_of"] else (peer,))],
+            batch_size=1000)
+
+        start = time.perf_counter()
+        conversation_ids = [conversation.pk for conversation in conversations]
+        if connection.vendor == "postgresql":
+            self.seed_postgresql(options, conversation_ids, peer.pk)
+        else:
+            self.seed_bulk(options, conversation_ids, peer.pk)
+        self.stdout.write(
+            f"seeded {options['messages']} messages in "
+            f"{options['conversations']} conversations in "
+            f"{time.perf_counter() - start:.1f} s, the user is in "
+            f"{options['member_of']}")
+        return user
+
+    def seed_postgresql(self, options, conversation_ids, sender_id):
+        """
+        Generates the messages server-side. Word positions are skewed by
+        cubing a uniform number, so a few words are very common.
+        """
+        with connection.cursor() as cursor:
+            cursor.execute(f"""
+                INSERT INTO {Message._meta.db_table}
+                    (body, created_at, conversation_id, sender_id)
+                SELECT (SELECT string_agg(
+                            'w' || lpad(floor(%s * random() ^ 3)::text, 4, '0'),
+                            ' ')
+                        FROM generate_series(1, %s) WHERE g > 0),
+                       now(), (%s::bigint[])[1 + g %% %s], %s
+                FROM generate_series(1, %s) AS g
+            """, [VOCABULARY, WORDS_PER_MESSAGE, conversation_ids,
+                  len(conversation_ids), sender_id, options["messages"]])
+
+    def seed_bulk(self, options, conversation_ids, sender_id):
+        """
+        Inserts the messages in batches from Python.
+        """
+        rng = random.Random(0)
+        now = timezone.now()
+        Message.objects.bulk_create((
+            Message(conversation_id=conversation_ids[i % len(conversation_ids)],
+                    sender_id=sender_id, created_at=now,
+                    body=" ".join(word(int(VOCABULARY * rng.random() ** 3))
+                                  for _ in range(WORDS_PER_MESSAGE)))
+            for i in range(options["messages"])), batch_size=5000)
+
+    def report(self, label, timings):
+        """
+        Prints the median and p95 of the timings.
+        """
+        self.stdout.write(f"{label}: {bench.summarize(timings)}")
@@ -0,0 +1,56 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+from chats import partitions
+
+
+class Command(BaseCommand):
+    """
+    Maintains the monthly message partitions: creates the upcoming ones,
+    gives months found in the default partition their own, and archives the
+    ones past the retention period to compressed files.
+    """
+
+    help = "Pre-create future message partitions and archive old ones."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--ahead", type=int, default=3,
+                            help="months to create ahead of the current one")
+        parser.add_argument("--retain", type=int, default=12,
+                            help="months to keep, including the current one")
+        parser.add_argument("--archive-dir", default=None,
+                            help="defaults to settings.MESSAGE_ARCHIVE_DIR")
+        parser.add_argument("--dry-run", action="store_true")
+
+    def handle(self, *args, **options):
+        if options["retain"] < 1:
+            raise CommandError("--retain must be at least 1.")
+        archive_dir = options["archive_dir"] or settings.MESSAGE_ARCHIVE_DIR
+        current = partitions.month_start(timezone.now())
+        existing = set(partitions.list_partitions())
+
+        months = [partitions.add_months(current, offset)
+                  for offset in range(options["ahead"] + 1)]
+        for month in sorted({*months, *partitions.default_months()}):
+            if month in existing or not partitions.is_partitioned():
+                continue
+            name = partitions.partition_name(month)
+            existing.add(month)
+            if options["dry_run"]:
+                self.stdout.write(f"would create {name}")
+                continue
+            moved = partitions.create_partition(month)
+            self.stdout.write(f"created {name}" + (
+                f", moved {moved} messages from the default partition"
+                if moved else ""))
+
+        oldest_kept = partitions.add_months(current, 1 - options["retain"])
+        # partitions an interrupted archive left detached are retried
+        for month in sorted(existing | set(partitions.list_detached())):
+            if month >= oldest_kept:
+                break
+            if options["dry_run"]:
+                self.stdout.write(f"would archive {partitions.partition_name(month)}")
+                continue
+            path, rows = partitions.archive_partition(month, archive_dir)
+            self.stdout.write(f"archived {rows} messages to {path}")
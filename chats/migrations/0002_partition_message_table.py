@@ -0,0 +1,129 @@
+from datetime import datetime, timezone as dt_timezone
+from django.conf import settings
+from django.db import migrations
+from django.utils import timezone
+
+# months created ahead of the current one, like `message_partitions`
+AHEAD = 3
+
+
+def month_index(value):
+    """
+    Returns a month as a number of months since year 0.
+    """
+    return value.year * 12 + value.month - 1
+
+
+def partition_message_table(apps, schema_editor):
+    """
+    Recreates chats_message as a table partitioned by month on created_at.
+
+    The primary key has to include the partition key, so it becomes
+    (id, created_at); ids still come from a single sequence and stay unique.
+    The old table keeps its constraint and index names when renamed, so its
+    primary key is renamed and its identity dropped before the new table
+    takes the names over.
+
+    Existing rows are copied into monthly partitions, created for every
+    month from the oldest message to a few months ahead, so the default
+    partition only catches rows outside those ranges.
+    """
+    if schema_editor.connection.vendor != "postgresql":
+        return
+    users_table = apps.get_model(settings.AUTH_USER_MODEL)._meta.db_table
+    schema_editor.execute("""
+        ALTER TABLE chats_message RENAME TO chats_message_unpartitioned;
+        ALTER TABLE chats_message_unpartitioned
+            RENAME CONSTRAINT chats_message_pkey
+            TO chats_message_unpartitioned_pkey;
+        ALTER TABLE chats_message_unpartitioned
+            ALTER COLUMN id DROP IDENTITY IF EXISTS;
+        CREATE TABLE chats_message (
+            id bigint NOT NULL,
+            body text NOT NULL,
+            created_at timestamp with time zone NOT NULL,
+            conversation_id bigint NOT NULL
+                REFERENCES chats_conversation (id) DEFERRABLE INITIALLY DEFERRED,
+            sender_id bigint NULL
+                REFERENCES %(users_table)s (id) DEFERRABLE INITIALLY DEFERRED,
+            PRIMARY KEY (id, created_at)
+        ) PARTITION BY RANGE (created_at);
+        CREATE TABLE chats_message_default PARTITION OF chats_message DEFAULT;
+        CREATE SEQUENCE chats_message_id_seq OWNED BY chats_message.id;
+        ALTER TABLE chats_message
+            ALTER COLUMN id SET DEFAULT nextval('chats_message_id_seq');
+    """ % {"users_table": schema_editor.quote_name(users_table)})
+
+    with schema_editor.connection.cursor() as cursor:
+        cursor.execute("SELECT MIN(created_at) FROM chats_message_unpartitioned")
+        oldest, = cursor.fetchone()
+    now = timezone.now()
+    first = month_index(min(oldest, now) if oldest else now)
+    for index in range(first, month_index(now) + AHEAD + 1):
+        start = datetime(index // 12, index % 12 + 1, 1, tzinfo=dt_timezone.utc)
+        end = datetime((index + 1) // 12, (index + 1) % 12 + 1, 1,
+                       tzinfo=dt_timezone.utc)
+        schema_editor.execute(
+            f"CREATE TABLE chats_message_p{start:%Y%m} PARTITION OF chats_message "
+            f"FOR VALUES FROM (%s) TO (%s)", [start, end])
+
+    schema_editor.execute("""
+        INSERT INTO chats_message (id, body, created_at, conversation_id, sender_id)
+            SELECT id, body, created_at, conversation_id, sender_id
+            FROM chats_message_unpartitioned;
+        -- run the deferred foreign key checks, indexes cannot be built
+        -- while they are pending
+        SET CONSTRAINTS ALL IMMEDIATE;
+        SELECT setval('chats_message_id_seq',
+                      COALESCE((SELECT MAX(id) FROM chats_message), 0) + 1, false);
+        DROP TABLE chats_message_unpartitioned;
+        CREATE INDEX chats_message_history_idx
+            ON chats_message (conversation_id, created_at DESC, id DESC);
+        CREATE INDEX chats_message_sender_id_idx ON chats_message (sender_id);
+    """)
+
+
+def unpartition_message_table(apps, schema_editor):
+    """
+    Recreates chats_message as the plain table of migration 0001 and copies
+    the rows of every partition back. The partitioned table's objects are
+    renamed out of the way first, since the new table takes their names.
+    """
+    if schema_editor.connection.vendor != "postgresql":
+        return
+    schema_editor.execute("""
+        ALTER TABLE chats_message RENAME TO chats_message_partitioned;
+        ALTER TABLE chats_message_partitioned
+            RENAME CONSTRAINT chats_message_pkey
+            TO chats_message_partitioned_pkey;
+        ALTER SEQUENCE chats_message_id_seq
+            RENAME TO chats_message_partitioned_id_seq;
+        ALTER INDEX chats_message_history_idx
+            RENAME TO chats_message_partitioned_history_idx;
+        ALTER INDEX chats_message_sender_id_idx
+            RENAME TO chats_message_partitioned_sender_id_idx;
+    """)
+    # the constraints and indexes of the new table are deferred to the end
+    # of the migration, after the copy
+    schema_editor.create_model(apps.get_model("chats", "Message"))
+    schema_editor.execute("""
+        INSERT INTO chats_message (id, body, created_at, conversation_id, sender_id)
+            SELECT id, body, created_at, conversation_id, sender_id
+            FROM chats_message_partitioned;
+        SELECT setval(pg_get_serial_sequence('chats_message', 'id'),
+                      COALESCE((SELECT MAX(id) FROM chats_message), 0) + 1, false);
+        DROP TABLE chats_message_partitioned;
+    """)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chats', '0001_initial'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.RunPython(partition_message_table, unpartition_message_table,
+                             elidable=False),
+    ]
@@ -0,0 +1,39 @@
+from django.db import migrations
+
+
+def add_search_vector(apps, schema_editor):
+    """
+    Adds a tsvector column generated from the body, so PostgreSQL keeps it
+    up to date on every insert, and a GIN index over it. Partitions created
+    later inherit both.
+    """
+    if schema_editor.connection.vendor != "postgresql":
+        return
+    schema_editor.execute("""
+        ALTER TABLE chats_message ADD COLUMN search_vector tsvector
+            GENERATED ALWAYS AS (to_tsvector('simple'::regconfig, body)) STORED;
+        CREATE INDEX chats_message_search_idx
+            ON chats_message USING GIN (search_vector);
+    """)
+
+
+def remove_search_vector(apps, schema_editor):
+    """
+    Drops the search column and its index.
+    """
+    if schema_editor.connection.vendor != "postgresql":
+        return
+    schema_editor.execute(
+        "ALTER TABLE chats_message DROP COLUMN search_vector")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chats', '0002_partition_message_table'),
+    ]
+
+    operations = [
+        migrations.RunPython(add_search_vector, remove_search_vector,
+                             elidable=False),
+    ]
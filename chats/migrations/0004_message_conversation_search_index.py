@@ -0,0 +1,50 @@
+from django.db import migrations
+
+
+def scope_search_index(apps, schema_editor):
+    """
+    Replaces the GIN index on search_vector with one on (conversation_id,
+    search_vector), so a search only reads the postings of the searched
+    conversations instead of those of the whole table. Indexing the
+    bigint column in GIN takes the btree_gin extension; where it cannot be
+    installed the whole-table index is kept.
+    """
+    if schema_editor.connection.vendor != "postgresql":
+        return
+    with schema_editor.connection.cursor() as cursor:
+        cursor.execute("SELECT 1 FROM pg_available_extensions "
+                       "WHERE name = 'btree_gin'")
+        if cursor.fetchone() is None:
+            return
+    schema_editor.execute("""
+        CREATE EXTENSION IF NOT EXISTS btree_gin;
+        CREATE INDEX chats_message_conversation_search_idx
+            ON chats_message USING GIN (conversation_id, search_vector);
+        DROP INDEX chats_message_search_idx;
+    """)
+
+
+def unscope_search_index(apps, schema_editor):
+    """
+    Brings the GIN index on search_vector alone back. The extension is left
+    installed, other objects may use it.
+    """
+    if schema_editor.connection.vendor != "postgresql":
+        return
+    schema_editor.execute("""
+        CREATE INDEX IF NOT EXISTS chats_message_search_idx
+            ON chats_message USING GIN (search_vector);
+        DROP INDEX IF EXISTS chats_message_conversation_search_idx;
+    """)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chats', '0003_message_search_vector'),
+    ]
+
+    operations = [
+        migrations.RunPython(scope_search_index, unscope_search_index,
+                             elidable=False),
+    ]
@@ -0,0 +1,83 @@
+from django.conf import settings
+from django.db import models
+from django.utils.translation import gettext_lazy as _
+from django.utils import timezone
+
+
+class Conversation(models.Model):
+    """
+    A chat conversation between one or more users.
+    """
+
+    title = models.CharField(_("title"), max_length=255, blank=True)
+    created_at = models.DateTimeField(_("created at"), default=timezone.now)
+    # plain pointer instead of a foreign key so the message table can be
+    # restructured (e.g. partitioned) without cross-table constraints
+    last_message_id = models.BigIntegerField(_("last message id"), null=True,
+                                             blank=True)
+
+    def __str__(self):
+        return f"Conversation: {self.title or self.pk}"
+
+
+class Membership(models.Model):
+    """
+    Links a user to a conversation and keeps the per-user read state.
+
+    `unread_count` and `last_message_at` are denormalized so the inbox can be
+    served by a single indexed query instead of counting messages.
+    """
+
+    conversation = models.ForeignKey(
+        Conversation, on_delete=models.CASCADE, related_name="memberships")
+    user = models.ForeignKey(
+        settings.AUTH_USER_MODEL, on_delete=models.CASCADE,
+        related_name="memberships")
+    last_read_message_id = models.BigIntegerField(
+        _("last read message id"), null=True, blank=True)
+    unread_count = models.PositiveIntegerField(_("unread count"), default=0)
+    last_message_at = models.DateTimeField(
+        _("last message at"), default=timezone.now)
+    joined_at = models.DateTimeField(_("joined at"), default=timezone.now)
+
+    class Meta:
+        """
+        Metadata options for the Membership model.
+        """
+        constraints = [
+            models.UniqueConstraint(fields=["conversation", "user"],
+                                    name="chats_membership_unique_member"),
+        ]
+        indexes = [
+            models.Index(fields=["user", "-last_message_at", "-id"],
+                         name="chats_membership_inbox_idx"),
+        ]
+
+    def __str__(self):
+        return f"Membership: {self.user_id} in {self.conversation_id}"
+
+
+class Message(models.Model):
+    """
+    A single message posted to a conversation.
+    """
+
+    conversation = models.ForeignKey(
+        Conversation, on_delete=models.CASCADE, related_name="messages")
+    sender = models.ForeignKey(
+        settings.AUTH_USER_MODEL, on_delete=models.SET_NULL, null=True,
+        related_name="messages")
+    body = models.TextField(_("body"))
+    created_at = models.DateTimeField(_("created at"), default=timezone.now)
+
+    class Meta:
+        """
+        Metadata options for the Message model.
+        """
+        indexes = [
+            models.Index(fields=["conversation", "-created_at", "-id"],
+                         name="chats_message_history_idx"),
+        ]
+
+    def __str__(self):
+        return f"Message: {self.pk} in {self.conversation_id}"
@@ -0,0 +1,241 @@
+"""
+Monthly range partitioning of the message table.
+
+On PostgreSQL `chats_message` is a partitioned table (see migration 0002)
+with one partition per month, named `chats_message_pYYYYMM`, and a default
+partition catching rows outside the created ranges until their month gets
+its own partition. Other backends keep a
+single table; there a "partition" is the logical set of rows of a month,
+which is enough to exercise archival and query routing in tests.
+"""
+import gzip
+import json
+import os
+from datetime import datetime, timezone as dt_timezone
+from django.db import connection, transaction
+from .models import Message
+
+TABLE = Message._meta.db_table
+PREFIX = f"{TABLE}_p"
+DEFAULT = f"{TABLE}_default"
+# how long a plain DETACH waits for its lock before giving up
+DETACH_LOCK_TIMEOUT = "2s"
+COLUMNS = ["id", "conversation_id", "sender_id", "body", "created_at"]
+
+
+def is_partitioned():
+    """
+    Whether the database supports native partitioning of the message table.
+    """
+    return connection.vendor == "postgresql"
+
+
+def month_start(value):
+    """
+    Returns the first instant of the month of a datetime, in UTC.
+    """
+    value = value.astimezone(dt_timezone.utc)
+    return datetime(value.year, value.month, 1, tzinfo=dt_timezone.utc)
+
+
+def add_months(month, count):
+    """
+    Moves a month start forwards (or backwards) by `count` months.
+    """
+    index = month.year * 12 + month.month - 1 + count
+    return datetime(index // 12, index % 12 + 1, 1, tzinfo=dt_timezone.utc)
+
+
+def partition_name(month):
+    """
+    Returns the table name of a month's partition.
+    """
+    return f"{PREFIX}{month:%Y%m}"
+
+
+def parse_partition_name(name):
+    """
+    Returns the month of a partition table name, or None for other tables.
+    """
+    if not name.startswith(PREFIX):
+        return None
+    try:
+        parsed = datetime.strptime(name[len(PREFIX):], "%Y%m")
+    except ValueError:
+        return None
+    return parsed.replace(tzinfo=dt_timezone.utc)
+
+
+def list_partitions():
+    """
+    Returns the months that currently have a partition, oldest first.
+    """
+    if not is_partitioned():
+        return list(Message.objects.datetimes(
+            "created_at", "month", tzinfo=dt_timezone.utc))
+    with connection.cursor() as cursor:
+        cursor.execute(
+            "SELECT child.relname FROM pg_inherits "
+            "JOIN pg_class child ON child.oid = pg_inherits.inhrelid "
+            "JOIN pg_class parent ON parent.oid = pg_inherits.inhparent "
+            "WHERE parent.relname = %s AND NOT pg_inherits.inhdetachpending",
+            [TABLE])
+        return parse_months(cursor.fetchall())
+
+
+def list_detached():
+    """
+    Returns the months whose partition table is detached, or still being
+    detached, oldest first: what an interrupted archive left behind. Always
+    empty without native partitioning.
+    """
+    if not is_partitioned():
+        return []
+    with connection.cursor() as cursor:
+        cursor.execute(
+            "SELECT child.relname FROM pg_class child "
+            "LEFT JOIN pg_inherits ON pg_inherits.inhrelid = child.oid "
+            "WHERE child.relkind = 'r' AND child.relname LIKE %s "
+            "AND pg_table_is_visible(child.oid) "
+            "AND (pg_inherits.inhrelid IS NULL OR pg_inherits.inhdetachpending)",
+            [PREFIX.replace("_", "\\_") + "%"])
+        return parse_months(cursor.fetchall())
+
+
+def parse_months(rows):
+    """
+    Returns the sorted months of (table name,) rows, ignoring other tables.
+    """
+    months = (parse_partition_name(name) for name, in rows)
+    return sorted(month for month in months if month is not None)
+
+
+def has_default():
+    """
+    Whether the message table has a default partition.
+    """
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT to_regclass(%s) IS NOT NULL", [DEFAULT])
+        return cursor.fetchone()[0]
+
+
+def default_months():
+    """
+    Returns the months with rows in the default partition, oldest first.
+    Always empty without native partitioning.
+    """
+    if not is_partitioned() or not has_default():
+        return []
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f"SELECT DISTINCT date_trunc('month', created_at AT TIME ZONE 'UTC') "
+            f"FROM {DEFAULT} ORDER BY 1")
+        return [month.replace(tzinfo=dt_timezone.utc)
+                for month, in cursor.fetchall()]
+
+
+def create_partition(month):
+    """
+    Creates the partition of a month if it does not exist yet, moving the
+    month's rows out of the default partition into it. Returns the number
+    of rows moved, or None if nothing was created. A no-op without native
+    partitioning.
+
+    PostgreSQL refuses a new partition whose range has rows in the default
+    partition, so the table is filled first and attached afterwards, in one
+    transaction.
+    """
+    if not is_partitioned() or month in list_partitions():
+        return None
+    name, bounds = partition_name(month), [month, add_months(month, 1)]
+    columns = ", ".join(COLUMNS)
+    with transaction.atomic(), connection.cursor() as cursor:
+        cursor.execute(
+            f"CREATE TABLE {name} (LIKE {TABLE} "
+            f"INCLUDING DEFAULTS INCLUDING CONSTRAINTS INCLUDING GENERATED)")
+        cursor.execute(
+            f"WITH moved AS (DELETE FROM {DEFAULT} "
+            f"WHERE created_at >= %s AND created_at < %s RETURNING {columns}) "
+            f"INSERT INTO {name} ({columns}) SELECT {columns} FROM moved", bounds)
+        moved = cursor.rowcount
+        cursor.execute(
+            f"ALTER TABLE {TABLE} ATTACH PARTITION {name} "
+            f"FOR VALUES FROM (%s) TO (%s)", bounds)
+    return moved
+
+
+def detach_partition(month):
+    """
+    Detaches the partition of a month from the message table, finishing an
+    interrupted detach, or doing nothing if it is already detached.
+
+    DETACH CONCURRENTLY never blocks reads and writes of the other months,
+    but PostgreSQL refuses it while a default partition exists and inside a
+    transaction. Otherwise a plain DETACH runs in its own transaction with
+    a short lock timeout, so it fails instead of queueing message traffic
+    behind it while it waits for its lock.
+    """
+    name = partition_name(month)
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT inhdetachpending FROM pg_inherits "
+                       "WHERE inhrelid = to_regclass(%s)", [name])
+        row = cursor.fetchone()
+        if row is None:
+            return
+        if row[0]:
+            cursor.execute(f"ALTER TABLE {TABLE} DETACH PARTITION {name} FINALIZE")
+            return
+        if not has_default() and not connection.in_atomic_block:
+            cursor.execute(
+                f"ALTER TABLE {TABLE} DETACH PARTITION {name} CONCURRENTLY")
+            return
+        with transaction.atomic():
+            cursor.execute("SET LOCAL lock_timeout = %s", [DETACH_LOCK_TIMEOUT])
+            cursor.execute(f"ALTER TABLE {TABLE} DETACH PARTITION {name}")
+
+
+def archive_partition(month, directory):
+    """
+    Exports a month of messages to a gzipped JSON lines file and removes it
+    from the live table. Returns the path of the file and the row count.
+
+    Natively the partition is detached first, so the export reads a table
+    nobody queries any more, and dropped once the file is complete. If the
+    export fails the table stays detached and `list_detached` reports it,
+    so the next run retries. Otherwise the rows are exported and deleted in
+    one transaction.
+    """
+    os.makedirs(directory, exist_ok=True)
+    path = os.path.join(directory, f"{partition_name(month)}.jsonl.gz")
+    if is_partitioned():
+        source = partition_name(month)
+        detach_partition(month)
+        with transaction.atomic(), connection.chunked_cursor() as cursor:
+            cursor.execute(
+                f"SELECT {', '.join(COLUMNS)} FROM {source} ORDER BY id")
+            rows = export_rows(iter(lambda: cursor.fetchmany(2000), []), path)
+        with connection.cursor() as cursor:
+            cursor.execute(f"DROP TABLE {source}")
+        return path, rows
+    with transaction.atomic():
+        messages = Message.objects.filter(
+            created_at__gte=month, created_at__lt=add_months(month, 1))
+        rows = export_rows(
+            [messages.order_by("id").values_list(*COLUMNS).iterator(2000)], path)
+        messages.delete()
+    return path, rows
+
+
+def export_rows(chunks, path):
+    """
+    Writes chunks of rows into a gzipped JSON lines file, atomically.
+    """
+    rows = 0
+    with gzip.open(path + ".tmp", "wt", encoding="utf-8") as output:
+        for chunk in chunks:
+            for row in chunk:
+                output.write(json.dumps(dict(zip(COLUMNS, row)), default=str))
+                output.write("\n")
+                rows += 1
+    os.replace(path + ".tmp", path)
+    return rows
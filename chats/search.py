@@ -0,0 +1,197 @@
+import math
+import re
+import threading
+from collections import Counter, defaultdict
+from django.db import connection
+from .models import Membership, Message
+
+# the text search configuration of chats_message.search_vector, fixed by
+# migration 0003: no stemming or stop words, chats mix languages
+TS_CONFIG = "simple"
+# ts_rank normalization dividing by 1 + log(document length), like `rank`
+RANK_NORMALIZATION = 1
+WORD = re.compile(r"\w+")
+
+
+def terms_of(text):
+    """
+    Splits text into lower-cased words.
+    """
+    return WORD.findall(text.lower())
+
+
+def rank(body_terms, query_terms):
+    """
+    Scores a message like ts_rank with RANK_NORMALIZATION does: how often
+    the query terms occur, dampened by the length of the message.
+    """
+    counts = Counter(body_terms)
+    hits = sum(counts[term] for term in query_terms)
+    return hits / (1 + math.log(max(len(body_terms), 1)))
+
+
+class InvertedIndex:
+    """
+    An in-process inverted index from words to message ids, standing in for
+    PostgreSQL full-text search on other databases.
+
+    It is built from the table on the first search and then kept up to date
+    as messages are committed. `search_index` checks every candidate against
+    the table and discards those of messages deleted or archived since.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.postings = defaultdict(set)
+        # the conversation id and the terms of every indexed message
+        self.documents = {}
+        self.built = False
+
+    def clear(self):
+        """
+        Drops the index, the next search rebuilds it.
+        """
+        with self.lock:
+            self.postings.clear()
+            self.documents.clear()
+            self.built = False
+
+    def add(self, messages):
+        """
+        Indexes newly inserted messages, unless the index is not built yet.
+        """
+        with self.lock:
+            if not self.built:
+                return
+            for message in messages:
+                self.index(message.pk, message.conversation_id, message.body)
+
+    def index(self, pk, conversation_id, body):
+        """
+        Adds the postings of one message. The lock must be held.
+        """
+        terms = frozenset(terms_of(body))
+        self.documents[pk] = (conversation_id, terms)
+        for term in terms:
+            self.postings[term].add(pk)
+
+    def discard(self, pks):
+        """
+        Drops the postings of messages that are no longer in the table.
+        """
+        with self.lock:
+            for pk in pks:
+                _, terms = self.documents.pop(pk, (None, ()))
+                for term in terms:
+                    self.postings[term].discard(pk)
+                    if not self.postings[term]:
+                        del self.postings[term]
+
+    def candidates(self, terms, conversation_ids):
+        """
+        Returns the ids of the messages of the given conversations containing
+        every term.
+        """
+        with self.lock:
+            if not self.built:
+                for row in Message.objects.values_list(
+                        "id", "conversation_id", "body").iterator():
+                    self.index(*row)
+                self.built = True
+            postings = sorted((self.postings.get(term, set()) for term in terms),
+                              key=len)
+            return {pk for pk in set.intersection(*postings)
+                    if self.documents[pk][0] in conversation_ids}
+
+
+index = InvertedIndex()
+
+
+def index_messages(messages):
+    """
+    Adds new messages to the search index. PostgreSQL maintains its index
+    itself, through the generated search_vector column.
+    """
+    if connection.vendor != "postgresql":
+        index.add(messages)
+
+
+def search(user, query, cursor=None, limit=50):
+    """
+    Returns messages of the user's conversations containing every word of
+    the query, best ranked first, with ties broken by newest id. Each has
+    a `rank` attribute. `cursor` is the (rank, id) of the last result of
+    the previous page.
+    """
+    terms = list(dict.fromkeys(terms_of(query)))
+    if not terms:
+        return []
+    if connection.vendor == "postgresql":
+        return search_postgresql(user, query, cursor, limit)
+    return search_index(user, terms, cursor, limit)
+
+
+def search_postgresql(user, query, cursor, limit):
+    """
+    Searches through the GIN index on (conversation_id, search_vector),
+    which only reads the postings of the user's conversations.
+    """
+    conversation_ids = list(Membership.objects.filter(user=user).values_list(
+        "conversation_id", flat=True))
+    if not conversation_ids:
+        return []
+    params = [TS_CONFIG, query, conversation_ids]
+    keyset = ""
+    if cursor is not None:
+        # ts_rank is a real, compare in that precision so ties stay ties
+        keyset = (f"AND (ts_rank(m.search_vector, q, {RANK_NORMALIZATION}), m.id)"
+                  f" < (%s::real, %s)")
+        params += list(cursor)
+    params.append(limit)
+    return list(Message.objects.raw(f"""
+        SELECT m.id, m.conversation_id, m.sender_id, m.body, m.created_at,
+               ts_rank(m.search_vector, q, {RANK_NORMALIZATION}) AS rank
+        FROM {Message._meta.db_table} m, plainto_tsquery(%s::regconfig, %s) q
+        WHERE m.conversation_id = ANY(%s) AND m.search_vector @@ q
+          {keyset}
+        ORDER BY rank DESC, m.id DESC
+        LIMIT %s
+    """, params))
+
+
+def search_index(user, terms, cursor, limit):
+    """
+    Searches through the in-process index, scoped to the user's
+    conversations.
+    """
+    conversation_ids = set(Membership.objects.filter(user=user).values_list(
+        "conversation_id", flat=True))
+    candidates = index.candidates(terms, conversation_ids)
+    messages = list(Message.objects.filter(
+        pk__in=candidates, conversation_id__in=conversation_ids))
+    index.discard(candidates - {message.pk for message in messages})
+    results = []
+    for message in messages:
+        body_terms = terms_of(message.body)
+        if not set(terms) <= set(body_terms):
+            continue
+        message.rank = rank(body_terms, terms)
+        if cursor is None or (message.rank, message.pk) < cursor:
+            results.append(message)
+    results.sort(key=lambda message: (message.rank, message.pk), reverse=True)
+    return results[:limit]
+
+
+def encode_cursor(message):
+    """
+    Encodes the keyset position of a search result as an opaque string.
+    """
+    return f"{message.rank!r}_{message.pk}"
+
+
+def decode_cursor(value):
+    """
+    Decodes a cursor made by `encode_cursor`. Raises ValueError if malformed.
+    """
+    score, pk = value.split("_")
+    return float(score), int(pk)
@@ -0,0 +1,89 @@
+from rest_framework import serializers
+from django.contrib.auth import get_user_model
+from .models import Membership, Message
+
+User = get_user_model()
+
+
+class InboxEntrySerializer(serializers.ModelSerializer):
+    """
+    Serializer class for a single inbox row: a conversation together with the
+    requesting user's read state.
+    """
+
+    title = serializers.CharField(source="conversation.title", read_only=True)
+
+    class Meta:
+        """
+        Metadata options for the InboxEntrySerializer class.
+        """
+        model = Membership
+        fields = ['conversation', 'title', 'unread_count',
+                  'last_read_message_id', 'last_message_at']
+        read_only_fields = fields
+
+
+class ConversationSerializer(serializers.Serializer):
+    """
+    Serializer class for creating a conversation with a list of members.
+    """
+
+    id = serializers.IntegerField(read_only=True)
+    title = serializers.CharField(max_length=255, allow_blank=True, default="")
+    members = serializers.ListField(
+        child=serializers.IntegerField(), write_only=True, allow_empty=False)
+
+    def validate_members(self, value):
+        """
+        Checks that every member exists, using a single query.
+        """
+        member_ids = set(value)
+        found = User.objects.filter(id__in=member_ids).count()
+        if found != len(member_ids):
+            raise serializers.ValidationError("Some members do not exist.")
+        return sorted(member_ids)
+
+
+class MessageSerializer(serializers.ModelSerializer):
+    """
+    Serializer class for reading and posting messages.
+    """
+
+    class Meta:
+        """
+        Metadata options for the MessageSerializer class.
+        """
+        model = Message
+        fields = ['id', 'conversation', 'sender', 'body', 'created_at']
+        read_only_fields = ['id', 'conversation', 'sender', 'created_at']
+
+
+class SocketMessageSerializer(MessageSerializer):
+    """
+    Serializer class for a message posted over the WebSocket, which names
+    its conversation in the payload.
+    """
+
+    # the range of a bigint primary key
+    conversation = serializers.IntegerField(min_value=1, max_value=2 ** 63 - 1)
+
+    class Meta(MessageSerializer.Meta):
+        """
+        Metadata options for the SocketMessageSerializer class.
+        """
+        fields = ['conversation', 'body']
+        read_only_fields = []
+
+
+class SearchResultSerializer(MessageSerializer):
+    """
+    Serializer class for a message found by a search, with its rank.
+    """
+
+    rank = serializers.FloatField(read_only=True)
+
+    class Meta(MessageSerializer.Meta):
+        """
+        Metadata options for the SearchResultSerializer class.
+        """
+        fields = MessageSerializer.Meta.fields + ['rank']
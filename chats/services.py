@@ -0,0 +1,163 @@
+from datetime import datetime, timedelta, timezone as dt_timezone
+from django.db import models, transaction
+from django.db.models import Case, F, OuterRef, Q, Subquery, Value, When
+from django.utils import timezone
+from .gateway.gateway import get_gateway
+from .models import Conversation, Membership, Message
+from .serializers import MessageSerializer
+from . import partitions, search
+
+EPOCH = datetime(1970, 1, 1, tzinfo=dt_timezone.utc)
+# the largest value of a bigint primary key
+MAX_ID = 2 ** 63 - 1
+
+
+def create_conversation(creator, member_ids, title=""):
+    """
+    Creates a conversation with the creator and the given users as members.
+    """
+    now = timezone.now()
+    user_ids = sorted({creator.id, *member_ids})
+    with transaction.atomic():
+        conversation = Conversation.objects.create(title=title, created_at=now)
+        Membership.objects.bulk_create([
+            Membership(conversation=conversation, user_id=user_id,
+                       last_message_at=now, joined_at=now)
+            for user_id in user_ids
+        ])
+    return conversation
+
+
+def post_messages(conversation, sender, bodies):
+    """
+    Inserts a batch of messages and bumps every member's counters with a
+    single UPDATE, whatever the number of members or messages.
+
+    The sender's own membership is treated as read up to the last message.
+    """
+    now = timezone.now()
+    with transaction.atomic():
+        messages = Message.objects.bulk_create([
+            Message(conversation=conversation, sender=sender, body=body,
+                    created_at=now)
+            for body in bodies
+        ])
+        last_id = messages[-1].pk
+        Conversation.objects.filter(pk=conversation.pk).update(
+            last_message_id=last_id)
+        Membership.objects.filter(conversation=conversation).update(
+            unread_count=Case(
+                When(user_id=sender.id, then=Value(0)),
+                default=F("unread_count") + len(messages),
+                output_field=models.PositiveIntegerField()),
+            last_read_message_id=Case(
+                When(user_id=sender.id, then=Value(last_id)),
+                default=F("last_read_message_id"),
+                output_field=models.BigIntegerField()),
+            last_message_at=now,
+        )
+    search.index_messages(messages)
+    conversation.last_message_id = last_id
+    return messages
+
+
+def send_message(conversation, sender, body):
+    """
+    Posts a single message to a conversation.
+    """
+    return post_messages(conversation, sender, [body])[0]
+
+
+def publish_message(message):
+    """
+    Pushes a new message to every connected member of its conversation,
+    whichever gateway node they are connected to.
+    """
+    member_ids = Membership.objects.filter(
+        conversation_id=message.conversation_id).values_list("user_id", flat=True)
+    get_gateway().send(member_ids, {
+        "type": "message",
+        "message": MessageSerializer(message).data,
+    })
+
+
+def mark_read(user, conversation_id):
+    """
+    Resets the user's unread counter and moves the last-read pointer to the
+    latest message, in one statement. Returns the number of updated rows.
+    """
+    latest = Conversation.objects.filter(
+        pk=OuterRef("conversation_id")).values("last_message_id")[:1]
+    return Membership.objects.filter(
+        user=user, conversation_id=conversation_id).update(
+            unread_count=0, last_read_message_id=Subquery(latest))
+
+
+def inbox(user, cursor=None, limit=50):
+    """
+    Returns the user's memberships, most recently active first, joined with
+    their conversations. Always a single query.
+    """
+    queryset = Membership.objects.filter(user=user).select_related(
+        "conversation").order_by("-last_message_at", "-id")
+    if cursor is not None:
+        last_message_at, membership_id = cursor
+        queryset = queryset.filter(
+            Q(last_message_at__lt=last_message_at)
+            | Q(last_message_at=last_message_at, id__lt=membership_id))
+    return list(queryset[:limit])
+
+
+def history(conversation, cursor=None, limit=50):
+    """
+    Returns messages of a conversation, newest first, older than the cursor.
+
+    Every query is bounded to a range of whole months of `created_at`, so
+    on the partitioned table it only touches those months' partitions. The
+    walk starts at the cursor's month, or the current one, and goes back
+    with ranges doubling in length until the page is full or the
+    conversation's creation month is reached, so a sparse conversation
+    costs a few queries rather than one per month of its age.
+    """
+    messages = []
+    upper = partitions.add_months(
+        partitions.month_start(cursor[0] if cursor else timezone.now()), 1)
+    first_month = partitions.month_start(conversation.created_at)
+    months = 1
+    while len(messages) < limit and upper > first_month:
+        lower = max(partitions.add_months(upper, -months), first_month)
+        queryset = Message.objects.filter(
+            conversation=conversation, created_at__gte=lower,
+            created_at__lt=upper)
+        if cursor is not None:
+            created_at, message_id = cursor
+            queryset = queryset.filter(
+                Q(created_at__lt=created_at)
+                | Q(created_at=created_at, id__lt=message_id))
+        messages += queryset.order_by("-created_at", "-id")[:limit - len(messages)]
+        upper, months = lower, 2 * months
+    return messages
+
+
+def encode_cursor(at, pk):
+    """
+    Encodes a keyset position (a timestamp and an id) as an opaque string.
+    """
+    micros = (at - EPOCH) // timedelta(microseconds=1)
+    return f"{micros}.{pk}"
+
+
+def decode_cursor(value):
+    """
+    Decodes a cursor made by `encode_cursor`. Raises ValueError if malformed
+    or out of range.
+    """
+    micros, pk = value.split(".")
+    try:
+        at = EPOCH + timedelta(microseconds=int(micros))
+    except OverflowError:
+        raise ValueError("cursor timestamp out of range")
+    pk = int(pk)
+    if not 0 <= pk <= MAX_ID:
+        raise ValueError("cursor id out of range")
+    return at, pk
@@ -0,0 +1,974 @@
+import gzip
+import io
+import json
+import multiprocessing
+import os
+import tempfile
+import time
+import unittest
+from datetime import timedelta
+from unittest import mock
+from asgiref.testing import ApplicationCommunicator
+from django.core.exceptions import ImproperlyConfigured
+from django.core.management import call_command
+from django.db import connection
+from django.test import TestCase, Client, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from rest_framework import status
+from rest_framework_simplejwt.tokens import RefreshToken
+from django.utils import timezone
+from users.factories import UserFactory, seed_users
+from oessenger import wire
+from .admin import MessageAdmin
+from .gateway import subscribers
+from .gateway.brokers import LocalBroker, MemoryBroker, RedisBroker
+from .gateway.gateway import Gateway
+from .gateway.websocket import UNAUTHORIZED, websocket_application
+from .management.commands.bench_gateway import run_node
+from .models import Conversation, Membership, Message
+from . import partitions, search, services
+
+
+def auth_header(user):
+    """
+    Build the authorization header for the given user.
+    """
+    return 'Bearer ' + str(RefreshToken.for_user(user).access_token)  # type: ignore
+
+
+client = Client()
+
+
+class UnreadCounterTests(TestCase):
+    """
+    Tests for the denormalized unread counters kept on memberships.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        """
+        Creates a conversation between three users.
+        """
+        cls.alice, cls.bob, cls.carol = UserFactory(), UserFactory(), UserFactory()
+        cls.conversation = services.create_conversation(
+            cls.alice, [cls.bob.id, cls.carol.id])  # type: ignore
+
+    def membership(self, user):
+        """
+        Reload the membership of the given user.
+        """
+        return Membership.objects.get(conversation=self.conversation, user=user)
+
+    def test_send_increments_other_members(self):
+        """
+        Sending a message increments everyone but the sender.
+        """
+        message = services.send_message(self.conversation, self.alice, "hi")
+        services.send_message(self.conversation, self.alice, "there")
+
+        self.assertEqual(self.membership(self.bob).unread_count, 2)
+        self.assertEqual(self.membership(self.carol).unread_count, 2)
+        sender = self.membership(self.alice)
+        self.assertEqual(sender.unread_count, 0)
+        self.assertEqual(sender.last_read_message_id, message.pk + 1)
+
+    def test_batch_uses_constant_queries(self):
+        """
+        A batch of messages costs the same number of queries as one message.
+        """
+        with self.assertNumQueries(5):  # savepoint, insert, 2 updates, release
+            services.post_messages(self.conversation, self.bob, ["a", "b", "c"])
+        self.assertEqual(self.membership(self.alice).unread_count, 3)
+
+    def test_mark_read_resets_counter(self):
+        """
+        Marking as read resets the counter and moves the pointer.
+        """
+        messages = services.post_messages(self.conversation, self.alice, ["a", "b"])
+
+        with self.assertNumQueries(1):
+            updated = services.mark_read(self.bob, self.conversation.pk)
+
+        self.assertEqual(updated, 1)
+        membership = self.membership(self.bob)
+        self.assertEqual(membership.unread_count, 0)
+        self.assertEqual(membership.last_read_message_id, messages[-1].pk)
+        self.assertEqual(self.membership(self.carol).unread_count, 2)
+
+
+class InboxViewTests(TestCase):
+    """
+    Tests for listing conversations and creating new ones.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        """
+        Creates a user with a few conversations.
+        """
+        cls.user = UserFactory()
+        cls.peers = seed_users(3)
+        cls.conversations = [
+            services.create_conversation(cls.user, [peer.id], title=str(i))
+            for i, peer in enumerate(cls.peers)
+        ]
+        services.send_message(cls.conversations[0], cls.peers[0], "hello")
+
+    def test_success(self):
+        """
+        The inbox lists the most recently active conversation first.
+        """
+        with self.assertNumQueries(2):  # user lookup + inbox
+            response = client.get(reverse("inbox"),
+                                  HTTP_AUTHORIZATION=auth_header(self.user))
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        response_data = json.loads(response.content.decode('utf-8'))
+        self.assertEqual(len(response_data["results"]), 3)
+        first = response_data["results"][0]
+        self.assertEqual(first["conversation"], self.conversations[0].pk)
+        self.assertEqual(first["unread_count"], 1)
+        self.assertIsNone(response_data["next"])
+
+    def test_cursor_pagination(self):
+        """
+        Following the cursor walks the whole inbox without repeats.
+        """
+        seen = []
+        url = reverse("inbox") + "?limit=2"
+        while url:
+            response = client.get(url, HTTP_AUTHORIZATION=auth_header(self.user))
+            response_data = json.loads(response.content.decode('utf-8'))
+            seen += [entry["conversation"] for entry in response_data["results"]]
+            url = response_data["next"] and (
+                reverse("inbox") + "?limit=2&cursor=" + response_data["next"])
+
+        self.assertCountEqual(seen, [c.pk for c in self.conversations])
+
+    def test_failure_invalid_cursor(self):
+        """
+        Tests the failure case when a malformed cursor is provided.
+        """
+        response = client.get(reverse("inbox") + "?cursor=nope",
+                              HTTP_AUTHORIZATION=auth_header(self.user))
+
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_failure_out_of_range_cursor(self):
+        """
+        Tests the failure case when a cursor overflows a timestamp or an id.
+        """
+        for cursor in ("99999999999999999999.1", "0.99999999999999999999"):
+            response = client.get(reverse("inbox") + "?cursor=" + cursor,
+                                  HTTP_AUTHORIZATION=auth_header(self.user))
+
+            self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_create_conversation(self):
+        """
+        Creating a conversation adds the creator and the members.
+        """
+        response = client.post(
+            reverse("inbox"),
+            data={"title": "group", "members": [p.id for p in self.peers]},
+            HTTP_AUTHORIZATION=auth_header(self.user),
+            content_type="application/json",
+        )
+
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        response_data = json.loads(response.content.decode('utf-8'))
+        self.assertEqual(Membership.objects.filter(
+            conversation_id=response_data["id"]).count(), 4)
+
+    def test_failure_no_token(self):
+        """
+        Tests the failure case when no token is provided.
+        """
+        response = client.get(reverse("inbox"))
+
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+
+
+class ConversationViewTests(TestCase):
+    """
+    Tests for sending messages and marking conversations as read.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        """
+        Creates a conversation between two users and an outsider.
+        """
+        cls.user, cls.peer, cls.outsider = (
+            UserFactory(), UserFactory(), UserFactory())
+        cls.conversation = services.create_conversation(cls.user, [cls.peer.id])
+
+    def test_send_and_read(self):
+        """
+        A sent message shows up as unread until the peer reads it.
+        """
+        response = client.post(
+            reverse("conversation_messages", args=[self.conversation.pk]),
+            data={"body": "hello"},
+            HTTP_AUTHORIZATION=auth_header(self.user),
+            content_type="application/json",
+        )
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        membership = Membership.objects.get(user=self.peer)
+        self.assertEqual(membership.unread_count, 1)
+
+        response = client.post(
+            reverse("conversation_read", args=[self.conversation.pk]),
+            HTTP_AUTHORIZATION=auth_header(self.peer))
+        self.assertEqual(response.status_code, status.HTTP_204_NO_CONTENT)
+        membership.refresh_from_db()
+        self.assertEqual(membership.unread_count, 0)
+
+    def test_failure_not_a_member(self):
+        """
+        Tests the failure case when the user is not a member.
+        """
+        response = client.post(
+            reverse("conversation_messages", args=[self.conversation.pk]),
+            data={"body": "hello"},
+            HTTP_AUTHORIZATION=auth_header(self.outsider),
+            content_type="application/json",
+        )
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+        response = client.post(
+            reverse("conversation_read", args=[self.conversation.pk]),
+            HTTP_AUTHORIZATION=auth_header(self.outsider))
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+
+class MessageHistoryTests(TestCase):
+    """
+    Tests for reading history in month-bounded ranges.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        """
+        Creates a conversation with two messages in each of the last 3 months.
+        """
+        cls.user = UserFactory()
+        now = timezone.now()
+        cls.months = [partitions.add_months(partitions.month_start(now), -i)
+                      for i in range(3)]
+        cls.conversation = services.create_conversation(cls.user, [])
+        Conversation.objects.filter(pk=cls.conversation.pk).update(
+            created_at=cls.months[-1])
+        cls.conversation.refresh_from_db()
+        for month in cls.months:
+            for message in services.post_messages(
+                    cls.conversation, cls.user, ["a", "b"]):
+                Message.objects.filter(pk=message.pk).update(
+                    created_at=month + timedelta(days=1))
+
+    def test_pages_walk_back_through_months(self):
+        """
+        Following the cursor returns every message, newest first.
+        """
+        seen, cursor = [], None
+        while True:
+            page = services.history(self.conversation, cursor=cursor, limit=3)
+            seen += page
+            if len(page) < 3:
+                break
+            cursor = (page[-1].created_at, page[-1].id)
+
+        self.assertEqual(len(seen), 6)
+        self.assertEqual(seen, sorted(
+            seen, key=lambda m: (m.created_at, m.id), reverse=True))
+
+    def test_month_ranges_double(self):
+        """
+        Months are read in ranges doubling in length: the current month,
+        then the two before it.
+        """
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(
+                len(services.history(self.conversation, limit=10)), 6)
+
+        self.assertEqual(len(queries), 2)
+        for query in queries:
+            self.assertIn("created_at\" <", query["sql"])
+
+    def test_sparse_conversation(self):
+        """
+        A years-old conversation with one message is read in a few queries.
+        """
+        Conversation.objects.filter(pk=self.conversation.pk).update(
+            created_at=partitions.add_months(self.months[0], -60))
+        self.conversation.refresh_from_db()
+
+        with self.assertNumQueries(6):
+            services.history(self.conversation, limit=10)
+
+    def test_full_page_stops_the_walk(self):
+        """
+        A page filled by the current month needs a single query.
+        """
+        with self.assertNumQueries(1):
+            self.assertEqual(
+                len(services.history(self.conversation, limit=2)), 2)
+
+    def test_history_view(self):
+        """
+        Members can read the history.
+        """
+        response = client.get(
+            reverse("conversation_messages", args=[self.conversation.pk]),
+            HTTP_AUTHORIZATION=auth_header(self.user))
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        response_data = json.loads(response.content.decode('utf-8'))
+        self.assertEqual(len(response_data["results"]), 6)
+        self.assertIsNone(response_data["next"])
+
+
+class MessagePartitionsCommandTests(TestCase):
+    """
+    Tests for archiving old partitions with the logical fallback.
+    """
+
+    def test_archives_months_past_retention(self):
+        """
+        Messages older than the retention period are exported and removed.
+        """
+        user = UserFactory()
+        conversation = services.create_conversation(user, [])
+        old, recent = services.post_messages(conversation, user, ["old", "new"])
+        old_month = partitions.add_months(
+            partitions.month_start(timezone.now()), -2)
+        Message.objects.filter(pk=old.pk).update(created_at=old_month)
+
+        with tempfile.TemporaryDirectory() as directory:
+            call_command("message_partitions", retain=2, archive_dir=directory,
+                         stdout=io.StringIO())
+
+            path = os.path.join(
+                directory, partitions.partition_name(old_month) + ".jsonl.gz")
+            with gzip.open(path, "rt") as archive:
+                rows = [json.loads(line) for line in archive]
+
+        self.assertEqual([row["id"] for row in rows], [old.pk])
+        self.assertEqual(rows[0]["body"], "old")
+        self.assertEqual(list(Message.objects.values_list("pk", flat=True)),
+                         [recent.pk])
+
+    def test_failed_export_is_retried(self):
+        """
+        A month whose export failed is archived by the next run.
+        """
+        user = UserFactory()
+        conversation = services.create_conversation(user, [])
+        message = services.send_message(conversation, user, "old")
+        old_month = partitions.add_months(
+            partitions.month_start(timezone.now()), -2)
+        Message.objects.filter(pk=message.pk).update(created_at=old_month)
+
+        with tempfile.TemporaryDirectory() as directory:
+            with mock.patch.object(partitions, "export_rows",
+                                   side_effect=OSError("disk full")):
+                with self.assertRaises(OSError):
+                    call_command("message_partitions", retain=2,
+                                 archive_dir=directory, stdout=io.StringIO())
+            self.assertIn(old_month, partitions.list_partitions()
+                          + partitions.list_detached())
+
+            call_command("message_partitions", retain=2, archive_dir=directory,
+                         stdout=io.StringIO())
+
+            self.assertEqual(os.listdir(directory), [
+                partitions.partition_name(old_month) + ".jsonl.gz"])
+        self.assertFalse(Message.objects.filter(pk=message.pk).exists())
+        self.assertNotIn(old_month, partitions.list_partitions()
+                         + partitions.list_detached())
+
+
+class CountingBroker(MemoryBroker):
+    """
+    A memory broker counting the batches it publishes.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self.published = []
+
+    def publish(self, node_id, batch):
+        self.published.append((node_id, len(batch)))
+        super().publish(node_id, batch)
+
+
+class GatewayTests(TestCase):
+    """
+    Tests for routing payloads between gateway nodes.
+    """
+
+    def setUp(self):
+        """
+        Creates two nodes sharing a broker, each with one connected user.
+        """
+        self.broker = CountingBroker()
+        self.first = Gateway("first", self.broker, batch_size=2)
+        self.second = Gateway("second", self.broker, batch_size=2)
+        self.received = {1: [], 2: []}
+        self.first.connect(1, self.received[1].append)
+        self.second.connect(2, self.received[2].append)
+
+    def test_local_delivery_is_immediate(self):
+        """
+        Users connected to the sending node get the payload right away.
+        """
+        self.first.send([1, 2], "hello")
+
+        self.assertEqual(self.received, {1: ["hello"], 2: []})
+
+    def test_remote_delivery_in_batches(self):
+        """
+        Payloads for other nodes are published in batches of batch_size.
+        """
+        for i in range(5):
+            self.first.send([2], i)
+
+        self.assertEqual(self.first.flush(), 5)
+        self.assertEqual(self.broker.published,
+                         [("second", 2), ("second", 2), ("second", 1)])
+        while self.second.poll(0.01):
+            pass
+        self.assertEqual(self.received[2], [0, 1, 2, 3, 4])
+        self.assertEqual(self.received[1], [])
+
+    def test_broker_failure_keeps_payloads(self):
+        """
+        Payloads a failing broker did not take are sent on the next flush.
+        """
+        for i in range(3):
+            self.first.send([2], i)
+
+        publish, calls = self.broker.publish, []
+
+        def failing_second_publish(node_id, batch):
+            calls.append(node_id)
+            if len(calls) == 2:
+                raise ConnectionError("broker down")
+            publish(node_id, batch)
+
+        with mock.patch.object(self.broker, "publish", failing_second_publish):
+            with self.assertRaises(ConnectionError):
+                self.first.flush()
+        self.assertEqual(self.first.flush(), 1)
+
+        while self.second.poll(0.01):
+            pass
+        self.assertEqual(self.received[2], [0, 1, 2])
+
+    def test_thread_survives_broker_errors(self):
+        """
+        The gateway thread logs broker errors and keeps delivering.
+        """
+        failures, consume = [ConnectionError("broker down")], self.broker.consume
+
+        def flaky_consume(node_id, timeout):
+            if failures:
+                raise failures.pop()
+            return consume(node_id, timeout)
+
+        self.first.send([2], "hello")
+        self.first.flush()
+        with mock.patch.object(self.broker, "consume", flaky_consume), \
+                self.assertLogs("chats.gateway.gateway", "ERROR"):
+            self.second.start()
+            for _ in range(200):
+                if self.received[2]:
+                    break
+                time.sleep(0.01)
+            self.second.stop()
+
+        self.assertEqual(self.received[2], ["hello"])
+
+    def test_disconnect_unregisters(self):
+        """
+        Once the last connection is gone nothing is routed to the node.
+        """
+        self.second.disconnect(2, self.received[2].append)
+        self.first.send([2], "hello")
+
+        self.assertEqual(self.first.flush(), 0)
+        self.assertEqual(self.broker.nodes_of([2]), {2: set()})
+
+
+class LocalBrokerTests(TestCase):
+    """
+    Tests for the multi-process stand-in broker.
+    """
+
+    def test_delivery_to_another_process(self):
+        """
+        A node in a worker process receives what this process sends.
+        """
+        if multiprocessing.current_process().daemon:
+            self.skipTest("workers of the parallel test runner cannot fork")
+        context = multiprocessing.get_context()
+        with multiprocessing.Manager() as manager:
+            broker = LocalBroker(["worker", "main"], manager, context)
+            ready, results = context.Event(), context.Queue()
+            process = context.Process(target=run_node, args=(
+                "worker", broker, [7, 8], 3, ready, results))
+            process.start()
+            self.assertTrue(ready.wait(10))
+
+            gateway = Gateway("main", broker)
+            gateway.send([7, 8], "hello")
+            gateway.send([8], "again")
+            gateway.flush()
+
+            node_id, delivered, _ = results.get(timeout=10)
+            process.join(10)
+
+        self.assertEqual((node_id, delivered), ("worker", 3))
+
+
+class FakeRedis:
+    """
+    The few Redis commands the broker uses, kept in dicts. Values come back
+    as bytes like from a real server, and expiry is only done by hand.
+    """
+
+    def __init__(self):
+        self.data = {}
+        self.ttls = {}
+
+    @staticmethod
+    def encode(value):
+        return value if isinstance(value, bytes) else str(value).encode()
+
+    def set(self, key, value, ex=None):
+        self.data[key] = self.encode(value)
+        self.ttls[key] = ex
+        return True
+
+    def exists(self, key):
+        return int(key in self.data)
+
+    def expire(self, key, seconds):
+        self.ttls[key] = seconds
+        return key in self.data
+
+    def sadd(self, key, *values):
+        members = self.data.setdefault(key, set())
+        added = {self.encode(value) for value in values} - members
+        members |= added
+        return len(added)
+
+    def srem(self, key, *values):
+        members = self.data.get(key, set())
+        removed = members & {self.encode(value) for value in values}
+        members -= removed
+        return len(removed)
+
+    def smembers(self, key):
+        return set(self.data.get(key, set()))
+
+    def rpush(self, key, value):
+        self.data.setdefault(key, []).append(self.encode(value))
+        return len(self.data[key])
+
+    def blpop(self, keys, timeout=0):
+        for key in keys:
+            if self.data.get(key):
+                return key.encode(), self.data[key].pop(0)
+        return None
+
+    def pipeline(self, transaction=True):
+        return FakePipeline(self)
+
+
+class FakePipeline:
+    """
+    Queues commands for a FakeRedis until executed.
+    """
+
+    def __init__(self, client):
+        self.client = client
+        self.commands = []
+
+    def __getattr__(self, name):
+        def queue(*args, **kwargs):
+            self.commands.append((getattr(self.client, name), args, kwargs))
+        return queue
+
+    def execute(self):
+        commands, self.commands = self.commands, []
+        return [command(*args, **kwargs) for command, args, kwargs in commands]
+
+
+class RedisBrokerTests(TestCase):
+    """
+    Tests for the Redis broker against an in-memory stand-in.
+    """
+
+    def setUp(self):
+        self.client = FakeRedis()
+        self.broker = RedisBroker(self.client, prefix="test")
+
+    def test_round_trip(self):
+        """
+        Batches published to a node are consumed back as (user id, payload)
+        tuples, and the registry lists the nodes of every user.
+        """
+        self.broker.register(7, "a")
+        self.broker.register(8, "a")
+        self.broker.register(8, "b")
+        self.broker.consume("b", 0)
+
+        self.assertEqual(self.broker.nodes_of([7, 8, 9]),
+                         {7: {"a"}, 8: {"a", "b"}, 9: set()})
+        self.broker.publish("a", [(7, "hello"), (8, "again")])
+        self.broker.publish("a", [(8, "more")])
+        self.assertEqual(self.client.ttls["test:node:a"], 60)
+        self.assertEqual(self.broker.consume("a", 0),
+                         [(7, "hello"), (8, "again")])
+        self.assertEqual(self.broker.consume("a", 0), [(8, "more")])
+        self.assertIsNone(self.broker.consume("a", 0))
+
+        self.broker.unregister(8, "a")
+        self.assertEqual(self.broker.nodes_of([8]), {8: {"b"}})
+
+    def test_heartbeat(self):
+        """
+        Consuming keeps a node's heartbeat alive, without a write on every
+        call.
+        """
+        self.broker.consume("a", 0)
+        self.assertEqual(self.client.ttls["test:alive:a"], 15)
+        self.client.data.pop("test:alive:a")
+        self.broker.consume("a", 0)
+        self.assertNotIn("test:alive:a", self.client.data)
+
+        self.broker.beaten_at["a"] -= 5
+        self.broker.consume("a", 0)
+        self.assertIn("test:alive:a", self.client.data)
+
+    def test_dead_node(self):
+        """
+        A node whose heartbeat expired is dropped from the registry and gets
+        nothing published, so its list is left to expire.
+        """
+        self.broker.register(7, "a")
+        self.broker.register(7, "b")
+        self.client.data.pop("test:alive:b")
+
+        self.assertEqual(self.broker.nodes_of([7]), {7: {"a"}})
+        self.assertEqual(self.client.smembers("test:user:7"), {b"a"})
+        self.broker.publish("b", [(7, "hello")])
+        self.assertNotIn("test:node:b", self.client.data)
+
+
+class WebSocketTests(TestCase):
+    """
+    Tests for the chat WebSocket served next to the HTTP application.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        """
+        Creates a conversation between two users.
+        """
+        cls.user, cls.peer = UserFactory(), UserFactory()
+        cls.conversation = services.create_conversation(cls.user, [cls.peer.id])
+
+    def connect(self, user, subprotocols=()):
+        """
+        Build a communicator for a socket of the given user.
+        """
+        token = str(RefreshToken.for_user(user).access_token)  # type: ignore
+        return ApplicationCommunicator(websocket_application, {
+            "type": "websocket",
+            "path": "/ws/",
+            "query_string": f"token={token}".encode(),
+            "subprotocols": list(subprotocols),
+        })
+
+    async def test_messages_reach_members(self):
+        """
+        A message sent on one socket is posted and pushed to the members.
+        """
+        sender = self.connect(self.user)
+        receiver = self.connect(self.peer, ["oessenger.msgpack"])
+        for communicator in (sender, receiver):
+            await communicator.send_input({"type": "websocket.connect"})
+        self.assertEqual(await receiver.receive_output(),
+                         {"type": "websocket.accept",
+                          "subprotocol": "oessenger.msgpack"})
+        await sender.receive_output()
+
+        await sender.send_input({"type": "websocket.receive", "text": json.dumps(
+            {"conversation": self.conversation.pk, "body": "hi"})})
+
+        event = await receiver.receive_output()
+        payload = wire.decode(event["bytes"], wire.MSGPACK)
+        self.assertEqual(payload["type"], "message")
+        self.assertEqual(payload["message"]["body"], "hi")
+        event = await sender.receive_output()
+        self.assertEqual(json.loads(event["text"])["message"]["body"], "hi")
+
+        for communicator in (sender, receiver):
+            await communicator.send_input({"type": "websocket.disconnect"})
+            await communicator.wait()
+
+    async def test_failure_malformed_frames(self):
+        """
+        Tests the failure case when frames cannot be posted: each gets an
+        error frame and the socket stays open.
+        """
+        communicator = self.connect(self.user, ["oessenger.msgpack"])
+        await communicator.send_input({"type": "websocket.connect"})
+        await communicator.receive_output()
+
+        for event in (
+                {"text": "not msgpack"},
+                {"bytes": wire.encode({"conversation": "abc", "body": "x"},
+                                      wire.MSGPACK)},
+                {"bytes": wire.encode({"conversation": 2 ** 64 - 1, "body": "x"},
+                                      wire.MSGPACK)}):
+            await communicator.send_input({"type": "websocket.receive", **event})
+            payload = wire.decode(
+                (await communicator.receive_output())["bytes"], wire.MSGPACK)
+            self.assertEqual(payload["type"], "error")
+
+        await communicator.send_input({"type": "websocket.disconnect"})
+        await communicator.wait()
+
+    async def test_failure_invalid_token(self):
+        """
+        Tests the failure case when the token is invalid.
+        """
+        communicator = ApplicationCommunicator(websocket_application, {
+            "type": "websocket", "path": "/ws/", "query_string": b"token=nope"})
+        await communicator.send_input({"type": "websocket.connect"})
+
+        self.assertEqual(await communicator.receive_output(),
+                         {"type": "websocket.close", "code": UNAUTHORIZED})
+
+
+@override_settings(GATEWAY={"BROKER_URL": "redis://broker"})
+class ProfileChangeSubscriberTests(TestCase):
+    """
+    Tests for pushing profile changes to connected sessions.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        """
+        Creates a user, a conversation peer and an outsider.
+        """
+        cls.user, cls.peer, cls.outsider = seed_users(3)
+        services.create_conversation(cls.user, [cls.peer.id])
+
+    def setUp(self):
+        """
+        Connects the peer to another node and the others to the relay's.
+        """
+        self.broker = MemoryBroker()
+        self.gateway = Gateway("relay", self.broker)
+        self.other = Gateway("other", self.broker)
+        self.received = {member.id: []
+                         for member in (self.user, self.peer, self.outsider)}
+        for member in (self.user, self.outsider):
+            self.gateway.connect(member.id, self.received[member.id].append)
+        self.other.connect(self.peer.id, self.received[self.peer.id].append)
+        self.event = {"seq": 1, "type": "profile.updated", "user": self.user.id,
+                      "fields": {"bio": "new"}}
+
+    def test_contacts_receive_changes(self):
+        """
+        The changed user and their conversation peers get the change, handed
+        to the broker before publish returns.
+        """
+        with mock.patch.object(subscribers, "get_gateway",
+                               return_value=self.gateway), \
+                self.assertNumQueries(1):
+            subscribers.ProfileChangeSubscriber().publish([self.event])
+
+        self.assertEqual(self.gateway.pending, [])
+        self.assertEqual(self.other.poll(0), 1)
+        self.assertEqual(self.received, {self.user.id: [self.event],
+                                         self.peer.id: [self.event],
+                                         self.outsider.id: []})
+
+    def test_broker_failure_is_raised(self):
+        """
+        A broker failure reaches the relay, which keeps its cursor.
+        """
+        with mock.patch.object(subscribers, "get_gateway",
+                               return_value=self.gateway), \
+                mock.patch.object(self.broker, "publish",
+                                  side_effect=ConnectionError("broker down")):
+            with self.assertRaises(ConnectionError):
+                subscribers.ProfileChangeSubscriber().publish([self.event])
+
+    @override_settings(GATEWAY={})
+    def test_requires_broker(self):
+        """
+        Without a broker the subscriber cannot reach anyone and refuses to
+        start.
+        """
+        with self.assertRaises(ImproperlyConfigured):
+            subscribers.ProfileChangeSubscriber()
+
+
+class MessageSearchTests(TestCase):
+    """
+    Tests for searching the messages of the caller's conversations.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        """
+        Creates a conversation of the user and one the user is not in.
+        """
+        cls.user, cls.peer, cls.outsider = seed_users(3)
+        cls.conversation = services.create_conversation(cls.user, [cls.peer.id])
+        cls.meet, cls.closed, _ = services.post_messages(
+            cls.conversation, cls.peer,
+            ["Meet at the station", "The station is closed, station two",
+             "lunch tomorrow?"])
+        other = services.create_conversation(cls.outsider, [cls.peer.id])
+        services.send_message(other, cls.outsider, "station secret")
+
+    def setUp(self):
+        """
+        Starts every test with an index built from the database.
+        """
+        search.index.clear()
+
+    def search(self, **params):
+        """
+        Search as the user and return the decoded response.
+        """
+        response = client.get(reverse("message_search"), params,
+                              HTTP_AUTHORIZATION=auth_header(self.user))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return json.loads(response.content.decode('utf-8'))
+
+    def test_ranked_and_scoped(self):
+        """
+        Only the user's conversations are searched, best match first.
+        """
+        page = self.search(q="STATION")
+
+        self.assertEqual([message["id"] for message in page["results"]],
+                         [self.closed.pk, self.meet.pk])
+        self.assertGreater(page["results"][0]["rank"], page["results"][1]["rank"])
+        self.assertIsNone(page["next"])
+
+    def test_every_word_must_match(self):
+        """
+        A message matches only if it contains all the words.
+        """
+        page = self.search(q="closed station")
+
+        self.assertEqual([message["id"] for message in page["results"]],
+                         [self.closed.pk])
+
+    def test_keyset_pages(self):
+        """
+        Pages follow the cursor without repeating results.
+        """
+        first = self.search(q="station", limit=1)
+        second = self.search(q="station", limit=1, cursor=first["next"])
+
+        self.assertEqual([first["results"][0]["id"], second["results"][0]["id"]],
+                         [self.closed.pk, self.meet.pk])
+
+    def test_indexes_new_messages(self):
+        """
+        Messages posted after the index was built are found.
+        """
+        self.search(q="station")
+        message = services.send_message(self.conversation, self.user, "station")
+
+        page = self.search(q="station")
+
+        self.assertEqual(page["results"][0]["id"], message.pk)
+        if connection.vendor != "postgresql":
+            self.assertTrue(search.index.built)
+
+    @unittest.skipIf(connection.vendor == "postgresql",
+                     "PostgreSQL searches its own index")
+    def test_stale_postings_are_ignored(self):
+        """
+        Postings of messages that are not in the database are ignored and
+        dropped from the index.
+        """
+        self.search(q="station")
+        search.index.add([Message(pk=10 ** 9, conversation=self.conversation,
+                                  body="station closed")])
+
+        self.assertEqual(len(self.search(q="station")["results"]), 2)
+        self.assertNotIn(10 ** 9, search.index.documents)
+        self.assertNotIn(10 ** 9, search.index.postings["closed"])
+
+    def test_failure_query_without_words(self):
+        """
+        Tests the failure case when the query has no words.
+        """
+        response = client.get(reverse("message_search"), {"q": " ?! "},
+                              HTTP_AUTHORIZATION=auth_header(self.user))
+
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+
+class ChatAdminTests(TestCase):
+    """
+    Tests for the keyset-paginated membership and message admins.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        """
+        Creates a superuser and a conversation with three messages.
+        """
+        cls.admin = UserFactory(is_staff=True, is_superuser=True)
+        cls.conversation = services.create_conversation(cls.admin, [])
+        cls.messages = services.post_messages(cls.conversation, cls.admin,
+                                              ["one", "two", "three"])
+
+    def setUp(self):
+        """
+        Logs the superuser in.
+        """
+        self.client.force_login(self.admin)
+
+    def test_message_pages(self):
+        """
+        Messages are listed newest first by keyset, without OFFSET.
+        """
+        url = reverse("admin:chats_message_changelist")
+        with mock.patch.object(MessageAdmin, "list_per_page", 2), \
+                CaptureQueriesContext(connection) as queries:
+            first = self.client.get(url).context["cl"]
+            second = self.client.get(url, {"cursor": first.next_cursor}).context["cl"]
+
+        self.assertNotIn("OFFSET", " ".join(q["sql"] for q in queries).upper())
+        self.assertEqual(list(first.result_list), self.messages[:0:-1])
+        self.assertEqual(list(second.result_list), self.messages[:1])
+        self.assertEqual(first.result_count, 3)
+
+    def test_related_rows_by_id(self):
+        """
+        Change forms pick users and conversations by id, not from a list.
+        """
+        for url in (reverse("admin:chats_message_change",
+                            args=[self.messages[0].pk]),
+                    reverse("admin:chats_membership_change", args=[
+                        self.conversation.memberships.get().pk])):
+            response = self.client.get(url)
+
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            self.assertContains(response, "vForeignKeyRawIdAdminField", count=2)
+            self.assertNotContains(response, "<select")
@@ -0,0 +1,16 @@
+from django.urls import path
+from .views import (
+    ConversationMessagesView,
+    ConversationReadView,
+    InboxView,
+    MessageSearchView,
+)
+
+urlpatterns = [
+    path('conversations/', InboxView.as_view(), name="inbox"),
+    path('conversations/<int:pk>/messages/', ConversationMessagesView.as_view(),
+         name="conversation_messages"),
+    path('conversations/<int:pk>/read/', ConversationReadView.as_view(),
+         name="conversation_read"),
+    path('messages/search/', MessageSearchView.as_view(), name="message_search"),
+]
@@ -0,0 +1,183 @@
+from drf_yasg import openapi
+from drf_yasg.utils import swagger_auto_schema
+from rest_framework import status
+from rest_framework.views import APIView
+from rest_framework.response import Response
+from rest_framework.permissions import IsAuthenticated
+from django.http import Http404
+from .models import Conversation
+from .serializers import (
+    ConversationSerializer,
+    InboxEntrySerializer,
+    MessageSerializer,
+    SearchResultSerializer,
+)
+from . import search, services
+
+DEFAULT_LIMIT = 50
+MAX_LIMIT = 200
+
+
+def get_conversation(request, pk):
+    """
+    Returns the conversation if the requesting user is a member of it.
+    """
+    conversation = Conversation.objects.filter(
+        pk=pk, memberships__user=request.user).first()
+    if conversation is None:
+        raise Http404
+    return conversation
+
+
+def get_page_params(request, decode_cursor=services.decode_cursor):
+    """
+    Parses the `limit` and `cursor` query parameters of a keyset-paginated
+    list. Raises ValueError if either is malformed.
+    """
+    limit = int(request.query_params.get("limit", DEFAULT_LIMIT))
+    if limit < 1:
+        raise ValueError("limit must be positive")
+    cursor = request.query_params.get("cursor")
+    return min(limit, MAX_LIMIT), decode_cursor(cursor) if cursor else None
+
+
+class InboxView(APIView):
+    """
+    Lists the user's conversations with unread counts and creates new ones.
+    """
+
+    permission_classes = [IsAuthenticated]
+
+    @swagger_auto_schema(responses={200: InboxEntrySerializer(many=True)})
+    def get(self, request, format=None):
+        """
+        Retrieve a page of the inbox, most recently active first.
+        """
+        try:
+            limit, cursor = get_page_params(request)
+        except ValueError:
+            return Response({"detail": "Invalid limit or cursor."},
+                            status=status.HTTP_400_BAD_REQUEST)
+
+        memberships = services.inbox(request.user, cursor=cursor, limit=limit)
+        next_cursor = None
+        if len(memberships) == limit:
+            last = memberships[-1]
+            next_cursor = services.encode_cursor(last.last_message_at, last.id)
+        return Response({
+            "results": InboxEntrySerializer(memberships, many=True).data,
+            "next": next_cursor,
+        })
+
+    @swagger_auto_schema(request_body=ConversationSerializer,
+                         responses={201: ConversationSerializer})
+    def post(self, request, format=None):
+        """
+        Create a new conversation.
+        """
+        serializer = ConversationSerializer(data=request.data)
+        if serializer.is_valid():
+            conversation = services.create_conversation(
+                request.user, serializer.validated_data["members"],
+                title=serializer.validated_data["title"])
+            return Response(ConversationSerializer(conversation).data,
+                            status=status.HTTP_201_CREATED)
+        return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+
+
+class ConversationMessagesView(APIView):
+    """
+    Reads the history of a conversation and posts messages to it.
+    """
+
+    permission_classes = [IsAuthenticated]
+
+    @swagger_auto_schema(responses={200: MessageSerializer(many=True)})
+    def get(self, request, pk, format=None):
+        """
+        Retrieve a page of the history, newest first.
+        """
+        conversation = get_conversation(request, pk)
+        try:
+            limit, cursor = get_page_params(request)
+        except ValueError:
+            return Response({"detail": "Invalid limit or cursor."},
+                            status=status.HTTP_400_BAD_REQUEST)
+
+        messages = services.history(conversation, cursor=cursor, limit=limit)
+        next_cursor = None
+        if len(messages) == limit:
+            last = messages[-1]
+            next_cursor = services.encode_cursor(last.created_at, last.id)
+        return Response({
+            "results": MessageSerializer(messages, many=True).data,
+            "next": next_cursor,
+        })
+
+    @swagger_auto_schema(request_body=MessageSerializer,
+                         responses={201: MessageSerializer})
+    def post(self, request, pk, format=None):
+        """
+        Send a message to the conversation.
+        """
+        conversation = get_conversation(request, pk)
+        serializer = MessageSerializer(data=request.data)
+        if serializer.is_valid():
+            message = services.send_message(
+                conversation, request.user, serializer.validated_data["body"])
+            services.publish_message(message)
+            return Response(MessageSerializer(message).data,
+                            status=status.HTTP_201_CREATED)
+        return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+
+
+class ConversationReadView(APIView):
+    """
+    Marks a conversation as read.
+    """
+
+    permission_classes = [IsAuthenticated]
+
+    def post(self, request, pk, format=None):
+        """
+        Reset the unread counter of the conversation for the user.
+        """
+        if not services.mark_read(request.user, pk):
+            raise Http404
+        return Response(status=status.HTTP_204_NO_CONTENT)
+
+
+class MessageSearchView(APIView):
+    """
+    Searches the messages of the user's conversations.
+    """
+
+    permission_classes = [IsAuthenticated]
+
+    @swagger_auto_schema(
+        manual_parameters=[openapi.Parameter(
+            "q", openapi.IN_QUERY, type=openapi.TYPE_STRING, required=True,
+            description="Words that must all occur in the message.")],
+        responses={200: SearchResultSerializer(many=True)})
+    def get(self, request, format=None):
+        """
+        Retrieve a page of matching messages, best ranked first.
+        """
+        query = request.query_params.get("q", "")
+        try:
+            limit, cursor = get_page_params(request, search.decode_cursor)
+        except ValueError:
+            return Response({"detail": "Invalid limit or cursor."},
+                            status=status.HTTP_400_BAD_REQUEST)
+        if not search.terms_of(query):
+            return Response({"detail": "The query has no words."},
+                            status=status.HTTP_400_BAD_REQUEST)
+
+        messages = search.search(request.user, query, cursor=cursor, limit=limit)
+        next_cursor = None
+        if len(messages) == limit:
+            next_cursor = search.encode_cursor(messages[-1])
+        return Response({
+            "results": SearchResultSerializer(messages, many=True).data,
+            "next": next_cursor,
+        })
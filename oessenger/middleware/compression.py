@@ -0,0 +1,371 @@
+import gzip
+import hashlib
+import threading
+import time
+import zlib
+from collections import OrderedDict
+from django.conf import settings
+from django.utils.cache import patch_vary_headers
+
+try:
+    import brotli
+except ImportError:  # optional, brotli responses are disabled without it
+    brotli = None
+
+try:
+    import zstandard
+except ImportError:  # optional, zstd responses are disabled without it
+    zstandard = None
+
+DEFAULTS = {
+    # responses smaller than this are sent as is
+    "MIN_SIZE": 512,
+    "LEVELS": {"zstd": 3, "br": 4, "gzip": 6},
+    # compressed bodies of these paths are kept and reused while unchanged
+    "CACHEABLE_PATHS": ["/api/swagger", "/api/redoc"],
+    "CACHE_MAX_BYTES": 8 * 1024 * 1024,
+    # never compressed, they echo secrets next to attacker-controlled input
+    "EXCLUDE_PATHS": ["/api/token/"],
+}
+
+
+def get_setting(name):
+    """
+    Returns a compression setting, falling back to the defaults.
+    """
+    return getattr(settings, "COMPRESSION", {}).get(name, DEFAULTS[name])
+
+
+class GzipCodec:
+    """
+    gzip, always available.
+    """
+
+    name = "gzip"
+
+    def __init__(self, level):
+        self.level = level
+
+    def compress(self, data):
+        return gzip.compress(data, compresslevel=self.level, mtime=0)
+
+    def compressor(self):
+        return GzipStream(self.level)
+
+
+class GzipStream:
+    """
+    Incremental gzip compressor flushing after every chunk.
+    """
+
+    def __init__(self, level):
+        self.compressobj = zlib.compressobj(level, zlib.DEFLATED, 31)
+
+    def compress(self, chunk):
+        return (self.compressobj.compress(chunk)
+                + self.compressobj.flush(zlib.Z_SYNC_FLUSH))
+
+    def finish(self):
+        return self.compressobj.flush()
+
+
+class BrotliCodec:
+    """
+    Brotli, if the `brotli` package is installed.
+    """
+
+    name = "br"
+
+    def __init__(self, level):
+        self.level = level
+
+    def compress(self, data):
+        return brotli.compress(data, quality=self.level)
+
+    def compressor(self):
+        return BrotliStream(self.level)
+
+
+class BrotliStream:
+    """
+    Incremental brotli compressor flushing after every chunk.
+    """
+
+    def __init__(self, level):
+        self.compressobj = brotli.Compressor(quality=level)
+
+    def compress(self, chunk):
+        return self.compressobj.process(chunk) + self.compressobj.flush()
+
+    def finish(self):
+        return self.compressobj.finish()
+
+
+class ZstdCodec:
+    """
+    Zstandard, if the `zstandard` package is installed.
+    """
+
+    name = "zstd"
+
+    def __init__(self, level):
+        self.context = zstandard.ZstdCompressor(level=level)
+
+    def compress(self, data):
+        return self.context.compress(data)
+
+    def compressor(self):
+        return ZstdStream(self.context)
+
+
+class ZstdStream:
+    """
+    Incremental zstd compressor flushing after every chunk.
+    """
+
+    def __init__(self, context):
+        self.compressobj = context.compressobj()
+
+    def compress(self, chunk):
+        return (self.compressobj.compress(chunk)
+                + self.compressobj.flush(zstandard.COMPRESSOBJ_FLUSH_BLOCK))
+
+    def finish(self):
+        return self.compressobj.flush()
+
+
+def available_codecs(levels):
+    """
+    Returns the usable codecs, most preferred first.
+    """
+    codecs = []
+    if zstandard is not None:
+        codecs.append(ZstdCodec(levels["zstd"]))
+    if brotli is not None:
+        codecs.append(BrotliCodec(levels["br"]))
+    codecs.append(GzipCodec(levels["gzip"]))
+    return codecs
+
+
+def parse_accept_encoding(header):
+    """
+    Maps every coding of an Accept-Encoding header to its quality value.
+    """
+    accepted = {}
+    for part in header.split(","):
+        coding, *params = [piece.strip() for piece in part.split(";")]
+        if not coding:
+            continue
+        quality = 1.0
+        for param in params:
+            if param.startswith("q="):
+                try:
+                    quality = float(param[2:])
+                except ValueError:
+                    quality = 0.0
+        accepted[coding.lower()] = quality
+    return accepted
+
+
+class CompressedCache:
+    """
+    A byte-bounded LRU of compressed bodies keyed by content digest and
+    coding, so an unchanged body is compressed once per coding.
+    """
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.size = 0
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            value = self.entries.get(key)
+            if value is not None:
+                self.entries.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        with self.lock:
+            if key in self.entries:
+                return
+            self.entries[key] = value
+            self.size += len(value)
+            while self.size > self.max_bytes:
+                _, evicted = self.entries.popitem(last=False)
+                self.size -= len(evicted)
+
+
+class CompressionMetrics:
+    """
+    Counters of compressed responses per coding.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        self.codings = {}
+
+    def add(self, coding, bytes_in, bytes_out, seconds, cached=False):
+        with self.lock:
+            counters = self.codings.setdefault(coding, {
+                "responses": 0, "cache_hits": 0, "bytes_in": 0,
+                "bytes_out": 0, "seconds": 0.0})
+            counters["responses"] += 1
+            counters["cache_hits"] += int(cached)
+            counters["bytes_in"] += bytes_in
+            counters["bytes_out"] += bytes_out
+            counters["seconds"] += seconds
+
+    def snapshot(self):
+        with self.lock:
+            codings = {coding: dict(counters)
+                       for coding, counters in self.codings.items()}
+        for counters in codings.values():
+            counters["bytes_saved"] = counters["bytes_in"] - counters["bytes_out"]
+        return codings
+
+
+metrics = CompressionMetrics()
+cache = CompressedCache(get_setting("CACHE_MAX_BYTES"))
+
+
+class CompressionMiddleware:
+    """
+    Compresses responses with the best coding both sides support: zstd,
+    then brotli, then gzip. Streaming responses are compressed chunk by
+    chunk, and bodies of cacheable paths are compressed once and reused.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.codecs = available_codecs(
+            {**DEFAULTS["LEVELS"], **get_setting("LEVELS")})
+        self.min_size = get_setting("MIN_SIZE")
+        self.cacheable_paths = tuple(get_setting("CACHEABLE_PATHS"))
+        self.exclude_paths = tuple(get_setting("EXCLUDE_PATHS"))
+
+    def __call__(self, request):
+        response = self.get_response(request)
+        if request.path.startswith(self.exclude_paths):
+            return response
+        if not response.streaming and len(response.content) < self.min_size:
+            return response
+        if response.has_header("Content-Encoding"):
+            return response
+
+        patch_vary_headers(response, ("Accept-Encoding",))
+        codec = self.choose_codec(request.META.get("HTTP_ACCEPT_ENCODING", ""))
+        if codec is None:
+            return response
+
+        if response.streaming:
+            self.compress_stream(response, codec)
+        elif not self.compress_content(request, response, codec):
+            return response
+
+        # a strong ETag of the identity body only weakly matches the encoded
+        # body, see RFC 9110 Section 8.8.1
+        etag = response.get("ETag")
+        if etag and etag.startswith('"'):
+            response.headers["ETag"] = "W/" + etag
+        response.headers["Content-Encoding"] = codec.name
+        return response
+
+    def choose_codec(self, header):
+        """
+        Returns the codec with the highest quality value for the client,
+        ties going to the server's preference.
+        """
+        accepted = parse_accept_encoding(header)
+        best, best_quality = None, 0.0
+        for codec in self.codecs:
+            quality = accepted.get(codec.name, accepted.get("*", 0.0))
+            if quality > best_quality:
+                best, best_quality = codec, quality
+        return best
+
+    def compress_content(self, request, response, codec):
+        """
+        Compresses a regular response in place. Returns False if compressing
+        would not make it smaller.
+        """
+        content = response.content
+        key = None
+        if request.method == "GET" and request.path.startswith(self.cacheable_paths):
+            key = (hashlib.sha256(content).digest(), codec.name)
+            compressed = cache.get(key)
+            if compressed is not None:
+                metrics.add(codec.name, len(content), len(compressed), 0.0,
+                            cached=True)
+                self.set_content(response, compressed)
+                return True
+
+        start = time.perf_counter()
+        compressed = codec.compress(content)
+        elapsed = time.perf_counter() - start
+        if len(compressed) >= len(content):
+            return False
+        if key is not None:
+            cache.set(key, compressed)
+        metrics.add(codec.name, len(content), len(compressed), elapsed)
+        self.set_content(response, compressed)
+        return True
+
+    def set_content(self, response, compressed):
+        response.content = compressed
+        response.headers["Content-Length"] = str(len(compressed))
+
+    def compress_stream(self, response, codec):
+        """
+        Wraps the streaming content so every chunk is compressed and flushed
+        as it is produced.
+        """
+        original = response.streaming_content
+        stream = CountingStream(codec)
+        if response.is_async:
+            async def compressed():
+                async for chunk in original:
+                    yield stream.compress(chunk)
+                yield stream.finish()
+        else:
+            def compressed():
+                for chunk in original:
+                    yield stream.compress(chunk)
+                yield stream.finish()
+        response.streaming_content = compressed()
+        # the compressed size is unknown until the stream ends
+        del response.headers["Content-Length"]
+
+
+class CountingStream:
+    """
+    Compresses a stream and records it in the metrics once it ends.
+    """
+
+    def __init__(self, codec):
+        self.name = codec.name
+        self.compressor = codec.compressor()
+        self.bytes_in = self.bytes_out = 0
+        self.seconds = 0.0
+
+    def compress(self, chunk):
+        start = time.perf_counter()
+        data = self.compressor.compress(chunk)
+        self.record(start, chunk, data)
+        return data
+
+    def finish(self):
+        start = time.perf_counter()
+        data = self.compressor.finish()
+        self.record(start, b"", data)
+        metrics.add(self.name, self.bytes_in, self.bytes_out, self.seconds)
+        return data
+
+    def record(self, start, chunk, data):
+        self.seconds += time.perf_counter() - start
+        self.bytes_in += len(chunk)
+        self.bytes_out += len(data)
@@ -0,0 +1,201 @@
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+from datetime import timedelta
+from django.conf import settings
+from django.http import HttpResponse, JsonResponse
+
+HIT, WAIT, RUN = "hit", "wait", "run"
+UNSAFE_METHODS = ("POST", "PUT", "PATCH", "DELETE")
+
+DEFAULTS = {
+    "HEADER": "Idempotency-Key",
+    "MAX_ENTRIES": 10_000,
+    "TTL": timedelta(hours=24),
+    "WAIT_TIMEOUT": 10,
+    "MAX_BODY_SIZE": 256 * 1024,
+}
+
+
+def get_setting(name):
+    """
+    Returns an idempotency setting, falling back to the defaults.
+    """
+    return getattr(settings, "IDEMPOTENCY", {}).get(name, DEFAULTS[name])
+
+
+class StoredResponse:
+    """
+    A snapshot of a response that can be replayed.
+    """
+
+    def __init__(self, fingerprint, response, cost, expires_at):
+        self.fingerprint = fingerprint
+        self.status_code = response.status_code
+        self.content = response.content
+        self.headers = list(response.items())
+        self.cost = cost
+        self.expires_at = expires_at
+
+    def replay(self):
+        """
+        Builds a fresh response from the snapshot.
+        """
+        response = HttpResponse(self.content, status=self.status_code)
+        for header, value in self.headers:
+            response[header] = value
+        response["Idempotent-Replayed"] = "true"
+        return response
+
+
+class IdempotencyStore:
+    """
+    A bounded LRU of responses keyed by idempotency key, with a TTL.
+
+    It also tracks keys whose request is still running, so concurrent
+    duplicates wait for the first execution instead of repeating it.
+    """
+
+    def __init__(self, max_entries, ttl):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.entries = OrderedDict()
+        self.in_flight = {}
+        self.lock = threading.Lock()
+        self.reset_metrics()
+
+    def reset_metrics(self):
+        """
+        Zeroes the counters.
+        """
+        self.counters = {"requests": 0, "hits": 0, "collapsed": 0,
+                         "executions": 0, "saved_seconds": 0.0}
+
+    def begin(self, key):
+        """
+        Returns (HIT, entry) for a stored response, (WAIT, event) if the key is
+        being executed by another request, or (RUN, None) after claiming the
+        key for the caller.
+        """
+        now = time.monotonic()
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None and entry.expires_at <= now:
+                del self.entries[key]
+                entry = None
+            if entry is not None:
+                self.entries.move_to_end(key)
+                return HIT, entry
+            if key in self.in_flight:
+                return WAIT, self.in_flight[key]
+            self.in_flight[key] = threading.Event()
+            return RUN, None
+
+    def finish(self, key, entry=None):
+        """
+        Releases a claimed key, storing the entry if there is one, and wakes
+        up the requests waiting for it.
+        """
+        with self.lock:
+            if entry is not None:
+                self.entries[key] = entry
+                self.entries.move_to_end(key)
+                while len(self.entries) > self.max_entries:
+                    self.entries.popitem(last=False)
+            self.in_flight.pop(key).set()
+
+    def count(self, name, amount=1):
+        """
+        Increments a counter.
+        """
+        with self.lock:
+            self.counters[name] += amount
+
+    def metrics(self):
+        """
+        Returns the counters, the hit rate and the current size.
+        """
+        with self.lock:
+            metrics = dict(self.counters)
+            metrics["entries"] = len(self.entries)
+        replays = metrics["hits"] + metrics["collapsed"]
+        metrics["hit_rate"] = (
+            replays / metrics["requests"] if metrics["requests"] else 0.0)
+        return metrics
+
+
+store = IdempotencyStore(max_entries=get_setting("MAX_ENTRIES"),
+                         ttl=get_setting("TTL").total_seconds())
+
+
+class IdempotencyKeyMiddleware:
+    """
+    Replays the stored response for unsafe requests that repeat an
+    idempotency key, and collapses concurrent duplicates into a single
+    execution. Keys are scoped to the method, path and credentials.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.header = get_setting("HEADER")
+        self.wait_timeout = get_setting("WAIT_TIMEOUT")
+        self.max_body_size = get_setting("MAX_BODY_SIZE")
+
+    def __call__(self, request):
+        key = request.headers.get(self.header)
+        if not key or request.method not in UNSAFE_METHODS:
+            return self.get_response(request)
+
+        scope = hashlib.sha256("\n".join([
+            request.method, request.path,
+            request.headers.get("Authorization", ""), key,
+        ]).encode()).hexdigest()
+        fingerprint = hashlib.sha256(request.body).hexdigest()
+        store.count("requests")
+
+        waited = False
+        while True:
+            state, value = store.begin(scope)
+            if state == HIT:
+                return self.replay(value, fingerprint, waited)
+            if state == RUN:
+                break
+            waited = True
+            if not value.wait(self.wait_timeout):
+                return JsonResponse(
+                    {"detail": "A request with this idempotency key is "
+                               "still in progress."}, status=409)
+
+        entry = None
+        try:
+            start = time.perf_counter()
+            response = self.get_response(request)
+            store.count("executions")
+            if self.is_storable(response):
+                entry = StoredResponse(
+                    fingerprint, response, time.perf_counter() - start,
+                    time.monotonic() + store.ttl)
+        finally:
+            store.finish(scope, entry)
+        return response
+
+    def replay(self, entry, fingerprint, waited):
+        """
+        Returns the stored response, unless the key is reused for a different
+        request body.
+        """
+        if entry.fingerprint != fingerprint:
+            return JsonResponse(
+                {"detail": "This idempotency key was used for a different "
+                           "request."}, status=422)
+        store.count("collapsed" if waited else "hits")
+        store.count("saved_seconds", entry.cost)
+        return entry.replay()
+
+    def is_storable(self, response):
+        """
+        Server errors are not stored so that a retry can succeed.
+        """
+        return (response.status_code < 500 and not response.streaming
+                and len(response.content) <= self.max_body_size)
@@ -0,0 +1,216 @@
+import contextlib
+import logging
+import os
+import random
+import re
+import sys
+import threading
+import time
+from collections import Counter
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from rest_framework.exceptions import AuthenticationFailed
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.exceptions import InvalidToken
+
+logger = logging.getLogger(__name__)
+
+DEFAULTS = {
+    "ENABLED": False,
+    # staff requests sending this header are profiled
+    "HEADER": "X-Profile",
+    # the fraction of all other requests profiled at random
+    "SAMPLE_RATE": 0.0,
+    # only requests under these paths are profiled
+    "PATHS": ["/api/"],
+    # seconds between two stack samples
+    "INTERVAL": 0.001,
+    "DIRECTORY": "profiles",
+    # the oldest profiles are deleted beyond this many
+    "MAX_FILES": 500,
+}
+
+
+def get_setting(name):
+    """
+    Returns a profiling setting, falling back to the defaults.
+    """
+    return getattr(settings, "PROFILING", {}).get(name, DEFAULTS[name])
+
+
+class StackSampler:
+    """
+    Samples the stack of one thread from a background thread.
+
+    Unlike a deterministic profiler it adds no cost to the calls of the
+    profiled thread, which only pays for the GIL switches of the sampler.
+    Stacks are counted in the folded format of flamegraph.pl and speedscope:
+    frames root first, joined by ";".
+    """
+
+    def __init__(self, thread_id, interval):
+        self.thread_id = thread_id
+        self.interval = interval
+        self.stacks = Counter()
+        self.labels = {}
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self.run, daemon=True)
+
+    def start(self):
+        """
+        Starts sampling.
+        """
+        self.thread.start()
+
+    def stop(self):
+        """
+        Stops sampling and waits for the sampler thread.
+        """
+        self.stopped.set()
+        self.thread.join()
+
+    def run(self):
+        """
+        Takes a sample every interval until stopped.
+        """
+        while not self.stopped.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            frames = []
+            while frame is not None:
+                frames.append(self.label(frame.f_code))
+                frame = frame.f_back
+            if frames:
+                self.stacks[";".join(reversed(frames))] += 1
+
+    def label(self, code):
+        """
+        Returns the frame label of a code object, as function@module:line.
+        """
+        label = self.labels.get(code)
+        if label is None:
+            label = f"{code.co_name}@{module_path(code.co_filename)}" \
+                    f":{code.co_firstlineno}"
+            self.labels[code] = label
+        return label
+
+    def folded(self):
+        """
+        Returns the samples as folded stacks, one "stack count" per line.
+        """
+        return "".join(f"{stack} {count}\n"
+                       for stack, count in self.stacks.most_common())
+
+
+def module_path(filename):
+    """
+    Shortens a source path to its path below the longest matching sys.path
+    entry, e.g. django/core/handlers/base.py.
+    """
+    best = ""
+    for entry in sys.path:
+        if entry and filename.startswith(entry) and len(entry) > len(best):
+            best = entry
+    return filename[len(best):].lstrip(os.sep) if best else filename
+
+
+class ProfileWriter:
+    """
+    Writes profiles to a directory, keeping only the newest MAX_FILES.
+    """
+
+    def __init__(self, directory, max_files):
+        self.directory = directory
+        self.max_files = max_files
+        self.lock = threading.Lock()
+
+    def write(self, request, elapsed, folded):
+        """
+        Writes one profile and returns its file name.
+        """
+        seconds, nanoseconds = divmod(time.time_ns(), 10 ** 9)
+        slug = re.sub(r"\W+", "-", request.path).strip("-") or "root"
+        name = (f"{time.strftime('%Y%m%dT%H%M%S', time.gmtime(seconds))}"
+                f".{nanoseconds:09d}-{request.method}-{slug}"
+                f"-{elapsed * 1000:.0f}ms.folded")
+        with self.lock:
+            os.makedirs(self.directory, exist_ok=True)
+            with open(os.path.join(self.directory, name), "w") as file:
+                file.write(folded)
+            self.rotate()
+        return name
+
+    def rotate(self):
+        """
+        Deletes the oldest profiles beyond the limit. Names sort by time.
+        Other processes rotate the same directory, so a profile may already
+        be gone.
+        """
+        names = sorted(name for name in os.listdir(self.directory)
+                       if name.endswith(".folded"))
+        for name in names[:max(0, len(names) - self.max_files)]:
+            with contextlib.suppress(FileNotFoundError):
+                os.remove(os.path.join(self.directory, name))
+
+
+class ProfilingMiddleware:
+    """
+    Profiles single requests with a stack sampler, when a staff user asks
+    for it with the profiling header or when picked by the sample rate.
+
+    Disabled, the middleware removes itself from the stack at startup.
+    Responses profiled on request carry the file name in X-Profile-Id,
+    unless the profile could not be written.
+    """
+
+    def __init__(self, get_response):
+        if not get_setting("ENABLED"):
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        self.header = "HTTP_" + get_setting("HEADER").upper().replace("-", "_")
+        self.sample_rate = get_setting("SAMPLE_RATE")
+        self.paths = tuple(get_setting("PATHS"))
+        self.interval = get_setting("INTERVAL")
+        self.writer = ProfileWriter(str(get_setting("DIRECTORY")),
+                                    get_setting("MAX_FILES"))
+        self.authentication = JWTAuthentication()
+
+    def __call__(self, request):
+        if not self.should_profile(request):
+            return self.get_response(request)
+
+        sampler = StackSampler(threading.get_ident(), self.interval)
+        start = time.perf_counter()
+        sampler.start()
+        try:
+            response = self.get_response(request)
+        finally:
+            sampler.stop()
+        try:
+            name = self.writer.write(request, time.perf_counter() - start,
+                                     sampler.folded())
+        except OSError:  # a full or unwritable directory never fails the request
+            logger.exception("Could not write the profile of %s", request.path)
+            return response
+        if self.header in request.META:
+            response["X-Profile-Id"] = name
+        return response
+
+    def should_profile(self, request):
+        """
+        Returns whether the request is to be profiled.
+        """
+        if not request.path.startswith(self.paths):
+            return False
+        if self.header in request.META:
+            return self.is_staff(request)
+        return random.random() < self.sample_rate
+
+    def is_staff(self, request):
+        """
+        Returns whether the request carries the access token of a staff user.
+        """
+        try:
+            result = self.authentication.authenticate(request)
+        except (AuthenticationFailed, InvalidToken):
+            return False
+        return result is not None and result[0].is_staff
@@ -0,0 +1,27 @@
+from django.test.runner import DiscoverRunner
+from django.test.utils import override_settings
+
+
+class TestRunner(DiscoverRunner):
+    """
+    The test runner, hashing passwords with a fast hasher.
+
+    Real hashers are slow on purpose and dominated the suite's runtime, as
+    signups, logins and password updates all hash.
+    """
+
+    def setup_test_environment(self, **kwargs):
+        """
+        Switches to the fast password hasher.
+        """
+        super().setup_test_environment(**kwargs)
+        self.hashers = override_settings(PASSWORD_HASHERS=[
+            "django.contrib.auth.hashers.MD5PasswordHasher"])
+        self.hashers.enable()
+
+    def teardown_test_environment(self, **kwargs):
+        """
+        Restores the configured password hashers.
+        """
+        self.hashers.disable()
+        super().teardown_test_environment(**kwargs)
@@ -49,15 +49,28 @@ INSTALLED_APPS = [
 
     'rest_framework',
     'drf_yasg',
-    'users'
+    'users',
+    'chats',
 ]
 
 AUTH_USER_MODEL = 'users.User'
 
 REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': (
-        'rest_framework_simplejwt.authentication.JWTAuthentication',
-    )
+        'users.authentication.PresenceJWTAuthentication',
+    ),
+    # JSON stays the default, MessagePack is served on request
+    'DEFAULT_RENDERER_CLASSES': (
+        'rest_framework.renderers.JSONRenderer',
+        'rest_framework.renderers.BrowsableAPIRenderer',
+        'oessenger.wire.MessagePackRenderer',
+    ),
+    'DEFAULT_PARSER_CLASSES': (
+        'rest_framework.parsers.JSONParser',
+        'rest_framework.parsers.FormParser',
+        'rest_framework.parsers.MultiPartParser',
+        'oessenger.wire.MessagePackParser',
+    ),
 }
 
 SWAGGER_SETTINGS = {
@@ -80,12 +93,91 @@ SIMPLE_JWT = {
     "USER_ID_CLAIM": "user_id",
     "USER_AUTHENTICATION_RULE": "rest_framework_simplejwt.authentication."
                                 "default_user_authentication_rule",
+
+    # refresh tokens are single use, see users.tokens
+    "ROTATE_REFRESH_TOKENS": True,
+    "TOKEN_OBTAIN_SERIALIZER": "users.serializers.RecordedTokenObtainPairSerializer",
+    "TOKEN_REFRESH_SERIALIZER": "users.serializers.RotatingTokenRefreshSerializer",
+}
+
+# Users seen within this threshold are reported as online
+PRESENCE_IDLE_THRESHOLD = timedelta(minutes=5)
+# How far back the in-memory presence index remembers activity
+PRESENCE_WINDOW_MINUTES = 60
+
+# Responses to retried unsafe requests carrying an Idempotency-Key header are
+# replayed from an in-process LRU store
+IDEMPOTENCY = {
+    'HEADER': 'Idempotency-Key',
+    'MAX_ENTRIES': 10_000,
+    'TTL': timedelta(hours=24),
+    'WAIT_TIMEOUT': 10,
+    'MAX_BODY_SIZE': 256 * 1024,
+}
+
+# Real-time gateway, nodes exchange messages through the broker at
+# BROKER_URL (redis://...) or only serve their own connections without one
+GATEWAY = {
+    'BROKER_URL': env('GATEWAY_BROKER_URL', default=None),
+    'NODE_ID': None,  # defaults to hostname:pid
+    'BATCH_SIZE': 100,
+    'FLUSH_INTERVAL': 0.005,
+}
+
+# Outbox of profile changes, see users/outbox.py. Each subscriber gets every
+# change at least once, in order apart from changes committed late, from
+# `manage.py relay_outbox`. Ids skipped while uncommitted are read again for
+# GAP_TIMEOUT. Changes are pushed to connected sessions only through a
+# gateway broker
+OUTBOX = {
+    'BATCH_SIZE': 500,
+    'POLL_INTERVAL': 1,
+    'SETTLE_DELAY': timedelta(seconds=1),
+    'GAP_TIMEOUT': timedelta(minutes=5),
+    'RETENTION': timedelta(days=7),
+    'SUBSCRIBERS': {},
+}
+if GATEWAY['BROKER_URL']:
+    OUTBOX['SUBSCRIBERS']['gateway'] = {
+        'CLASS': 'chats.gateway.subscribers.ProfileChangeSubscriber'}
+if env('OUTBOX_WEBHOOK_URL', default=None):
+    OUTBOX['SUBSCRIBERS']['webhook'] = {
+        'CLASS': 'users.outbox.WebhookSubscriber',
+        'OPTIONS': {'url': env('OUTBOX_WEBHOOK_URL'),
+                    'secret': env('OUTBOX_WEBHOOK_SECRET', default='')},
+    }
+
+# Response compression, zstd and brotli are used when their packages are
+# installed, gzip otherwise
+COMPRESSION = {
+    'MIN_SIZE': 512,
+    'LEVELS': {'zstd': 3, 'br': 4, 'gzip': 6},
+    'CACHEABLE_PATHS': ['/api/swagger', '/api/redoc'],
+    'CACHE_MAX_BYTES': 8 * 1024 * 1024,
+    'EXCLUDE_PATHS': ['/api/token/'],
+}
+
+# Request profiling, off unless PROFILING_ENABLED is set. Staff requests
+# with the X-Profile header, and SAMPLE_RATE of the others, are sampled into
+# flame graph stacks under DIRECTORY
+PROFILING = {
+    'ENABLED': env.bool('PROFILING_ENABLED', default=False),
+    'HEADER': 'X-Profile',
+    'SAMPLE_RATE': env.float('PROFILING_SAMPLE_RATE', default=0.0),
+    'PATHS': ['/api/'],
+    'INTERVAL': 0.001,
+    'DIRECTORY': env('PROFILING_DIRECTORY', default=str(BASE_DIR / 'profiles')),
+    'MAX_FILES': 500,
 }
 
 MIDDLEWARE = [
     'django.middleware.security.SecurityMiddleware',
+    'oessenger.middleware.profiling.ProfilingMiddleware',
+    'oessenger.middleware.compression.CompressionMiddleware',
+    'django.middleware.http.ConditionalGetMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
+    'oessenger.middleware.idempotency.IdempotencyKeyMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
@@ -118,6 +210,11 @@ WSGI_APPLICATION = 'oessenger.wsgi.application'
 
 DATABASES = {'default': dj_database_url.config(default=env('DATABASE_URL'))}
 
+# Testing
+# https://docs.djangoproject.com/en/4.2/topics/testing/advanced/#defining-a-test-runner
+
+TEST_RUNNER = 'oessenger.runner.TestRunner'
+
 # Password validation
 # https://docs.djangoproject.com/en/4.2/ref/settings/#auth-password-validators
 
@@ -155,6 +252,9 @@ USE_TZ = True
 
 STATIC_URL = 'static/'
 
+# Where the message_partitions command exports archived message partitions
+MESSAGE_ARCHIVE_DIR = env('MESSAGE_ARCHIVE_DIR', default=str(BASE_DIR / 'archive'))
+
 # Default primary key field type
 # https://docs.djangoproject.com/en/4.2/ref/settings/#default-auto-field
 
@@ -0,0 +1,562 @@
+import gzip
+import json
+import os
+import tempfile
+import threading
+import time
+import unittest
+import msgpack
+from unittest import mock
+from django.core.exceptions import MiddlewareNotUsed
+from django.http import HttpResponse, StreamingHttpResponse
+from django.test import RequestFactory, TestCase, Client, override_settings
+from django.urls import reverse
+from django.forms.models import model_to_dict
+from rest_framework import status
+from rest_framework_simplejwt.tokens import RefreshToken
+from users.models import User
+from users.factories import UserFactory
+from . import wire
+from .middleware import compression, idempotency
+from .middleware.compression import CompressionMiddleware
+from .middleware.idempotency import HIT, RUN, WAIT, IdempotencyStore
+from .middleware.profiling import ProfileWriter, ProfilingMiddleware
+
+
+def omit(data, keys):
+    """
+    Remove specific keys from a dictionary.
+    """
+    for key in keys:
+        data.pop(key)
+    return data
+
+
+client = Client()
+
+
+class IdempotencyStoreTests(TestCase):
+    """
+    Tests for the bounded LRU/TTL store behind the idempotency middleware.
+    """
+
+    def test_lru_eviction(self):
+        """
+        The least recently used entry is evicted once the store is full.
+        """
+        store = IdempotencyStore(max_entries=2, ttl=60)
+        for key in ("a", "b", "c"):
+            self.assertEqual(store.begin(key), (RUN, None))
+            store.finish(key, self.entry(expires_at=float("inf")))
+
+        self.assertEqual(list(store.entries), ["b", "c"])
+
+    def test_expired_entries_are_not_replayed(self):
+        """
+        Entries past their TTL are dropped on lookup.
+        """
+        store = IdempotencyStore(max_entries=2, ttl=60)
+        store.begin("a")
+        store.finish("a", self.entry(expires_at=0))
+
+        self.assertEqual(store.begin("a"), (RUN, None))
+
+    def test_concurrent_duplicates_wait(self):
+        """
+        A duplicate arriving while the first request runs waits for its result.
+        """
+        store = IdempotencyStore(max_entries=2, ttl=60)
+        store.begin("a")
+        state, event = store.begin("a")
+        self.assertEqual(state, WAIT)
+
+        entry = self.entry(expires_at=float("inf"))
+        threading.Timer(0.05, store.finish, args=("a", entry)).start()
+
+        self.assertTrue(event.wait(5))
+        self.assertEqual(store.begin("a"), (HIT, entry))
+
+    def entry(self, expires_at):
+        """
+        Build a stored response expiring at the given monotonic time.
+        """
+        return idempotency.StoredResponse(
+            "fingerprint", idempotency.HttpResponse(b"ok"), 0.1, expires_at)
+
+
+class IdempotencyKeyMiddlewareTests(TestCase):
+    """
+    Tests for replaying retried signups through the idempotency middleware.
+    """
+
+    def setUp(self):
+        """
+        Starts every test with an empty store.
+        """
+        idempotency.store.entries.clear()
+        idempotency.store.reset_metrics()
+
+    def test_replayed_signup(self):
+        """
+        A retried signup returns the first response and creates one user.
+        """
+        fake_user = omit(model_to_dict(UserFactory.build()), ["id"])
+
+        first = client.post(reverse("user"), data=fake_user,
+                            HTTP_IDEMPOTENCY_KEY="signup-1")
+        second = client.post(reverse("user"), data=fake_user,
+                             HTTP_IDEMPOTENCY_KEY="signup-1")
+
+        self.assertEqual(first.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(second.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(second.content, first.content)
+        self.assertEqual(second["Idempotent-Replayed"], "true")
+        self.assertEqual(User.objects.filter(
+            username=fake_user["username"]).count(), 1)
+
+        metrics = idempotency.store.metrics()
+        self.assertEqual(metrics["requests"], 2)
+        self.assertEqual(metrics["hits"], 1)
+        self.assertEqual(metrics["executions"], 1)
+        self.assertEqual(metrics["hit_rate"], 0.5)
+        self.assertGreater(metrics["saved_seconds"], 0)
+
+    def test_failure_key_reused_with_different_body(self):
+        """
+        Tests the failure case when a key is reused for another request.
+        """
+        client.post(reverse("user"),
+                    data=omit(model_to_dict(UserFactory.build()), ["id"]),
+                    HTTP_IDEMPOTENCY_KEY="signup-2")
+        response = client.post(
+            reverse("user"),
+            data=omit(model_to_dict(UserFactory.build()), ["id"]),
+            HTTP_IDEMPOTENCY_KEY="signup-2")
+
+        self.assertEqual(response.status_code,
+                         status.HTTP_422_UNPROCESSABLE_ENTITY)
+
+    def test_requests_without_key_are_not_stored(self):
+        """
+        Requests without the header go straight through.
+        """
+        client.post(reverse("user"),
+                    data=omit(model_to_dict(UserFactory.build()), ["id"]))
+
+        self.assertEqual(len(idempotency.store.entries), 0)
+        self.assertEqual(idempotency.store.metrics()["requests"], 0)
+
+
+class MetricsViewTests(TestCase):
+    """
+    Tests for the staff-only metrics endpoint.
+    """
+
+    def test_success(self):
+        """
+        Staff users can read the metrics.
+        """
+        staff_user = UserFactory(is_staff=True)
+        refresh = RefreshToken.for_user(staff_user)
+
+        response = client.get(
+            reverse("metrics"),
+            HTTP_AUTHORIZATION='Bearer ' + str(refresh.access_token))  # type: ignore
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        response_data = json.loads(response.content.decode('utf-8'))
+        self.assertIn("hit_rate", response_data["idempotency"])
+
+    def test_failure_not_staff(self):
+        """
+        Tests the failure case when the user is not staff.
+        """
+        refresh = RefreshToken.for_user(UserFactory())
+
+        response = client.get(
+            reverse("metrics"),
+            HTTP_AUTHORIZATION='Bearer ' + str(refresh.access_token))  # type: ignore
+
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+
+
+class WireFormatTests(TestCase):
+    """
+    Tests for negotiating MessagePack alongside the default JSON.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        """
+        Creates a user and its authorization header.
+        """
+        cls.fake_user = UserFactory()
+        refresh = RefreshToken.for_user(cls.fake_user)
+        cls.authorization = 'Bearer ' + str(refresh.access_token)  # type: ignore
+
+    def test_json_is_default(self):
+        """
+        Clients that do not ask for a format get JSON.
+        """
+        response = client.get(reverse("user"), HTTP_AUTHORIZATION=self.authorization)
+
+        self.assertEqual(response["Content-Type"], "application/json")
+
+    def test_msgpack_response(self):
+        """
+        The MessagePack body carries the same data as the JSON one.
+        """
+        json_response = client.get(reverse("user"),
+                                   HTTP_AUTHORIZATION=self.authorization)
+        response = client.get(reverse("user"),
+                              HTTP_AUTHORIZATION=self.authorization,
+                              HTTP_ACCEPT="application/msgpack")
+
+        self.assertEqual(response["Content-Type"], "application/msgpack")
+        self.assertEqual(wire.decode(response.content, wire.MSGPACK),
+                         json.loads(json_response.content.decode('utf-8')))
+
+    def test_msgpack_request(self):
+        """
+        Request bodies can be sent as MessagePack.
+        """
+        response = client.patch(
+            reverse("user"),
+            data=wire.encode({"bio": "packed"}, wire.MSGPACK),
+            HTTP_AUTHORIZATION=self.authorization,
+            content_type="application/msgpack",
+        )
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(User.objects.get(pk=self.fake_user.pk).bio, "packed")
+
+    def test_failure_malformed_msgpack(self):
+        """
+        Tests the failure case when the body is not valid MessagePack.
+        """
+        response = client.patch(
+            reverse("user"),
+            data=b"\xc1",
+            HTTP_AUTHORIZATION=self.authorization,
+            content_type="application/msgpack",
+        )
+
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_failure_malformed_table(self):
+        """
+        Tests the failure case when a well-formed body holds a table that
+        is not [field_names, rows].
+        """
+        for table in (5, [["id"]], [[1], [[1]]], [["id"], [[1, 2]]],
+                      [["id"], 7]):
+            response = client.post(
+                reverse("user"),
+                data=msgpack.packb(msgpack.ExtType(
+                    wire.TABLE_EXT_TYPE, msgpack.packb(table))),
+                content_type="application/msgpack",
+            )
+
+            self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_columns_round_trip(self):
+        """
+        Schema-indexed tables decode back to the original records.
+        """
+        data = {"results": [{"id": 1, "body": "a"}, {"id": 2, "body": "b"}],
+                "mixed": [{"id": 1}, {"body": "b"}], "next": None}
+
+        encoded = wire.encode(data, wire.MSGPACK_COLUMNS)
+
+        self.assertLess(len(encoded), len(wire.encode(data, wire.MSGPACK)))
+        self.assertEqual(wire.decode(encoded, wire.MSGPACK_COLUMNS), data)
+
+    def test_negotiate_subprotocol(self):
+        """
+        The most compact offered subprotocol wins, JSON is the fallback.
+        """
+        self.assertEqual(
+            wire.negotiate_subprotocol(["oessenger.json", "oessenger.msgpack"]),
+            ("oessenger.msgpack", wire.MSGPACK))
+        self.assertEqual(wire.negotiate_subprotocol([]), (None, wire.JSON))
+
+
+class CompressionMiddlewareTests(TestCase):
+    """
+    Tests for negotiating and applying response compression.
+    """
+
+    def setUp(self):
+        """
+        Starts every test with empty metrics and compressed cache.
+        """
+        compression.metrics.reset()
+        compression.cache.entries.clear()
+        compression.cache.size = 0
+        self.schema_url = reverse("schema-json", kwargs={"format": ".json"})
+
+    def middleware(self, response):
+        """
+        Build the middleware around a view returning the given response.
+        """
+        return CompressionMiddleware(lambda request: response)
+
+    def test_gzip_response(self):
+        """
+        A gzip-only client gets a gzipped body identical once decompressed.
+        """
+        plain = client.get(self.schema_url)
+        response = client.get(self.schema_url, HTTP_ACCEPT_ENCODING="gzip")
+
+        self.assertEqual(response["Content-Encoding"], "gzip")
+        self.assertIn("Accept-Encoding", response["Vary"])
+        self.assertEqual(gzip.decompress(response.content), plain.content)
+        self.assertLess(len(response.content), len(plain.content))
+
+    def test_cacheable_body_is_compressed_once(self):
+        """
+        An unchanged schema reuses its compressed variant.
+        """
+        first = client.get(self.schema_url, HTTP_ACCEPT_ENCODING="gzip")
+        second = client.get(self.schema_url, HTTP_ACCEPT_ENCODING="gzip")
+
+        self.assertEqual(first.content, second.content)
+        counters = compression.metrics.snapshot()["gzip"]
+        self.assertEqual(counters["responses"], 2)
+        self.assertEqual(counters["cache_hits"], 1)
+        self.assertGreater(counters["bytes_saved"], 0)
+
+    def test_small_responses_are_not_compressed(self):
+        """
+        Bodies under the size threshold are sent as is.
+        """
+        request = RequestFactory().get("/", HTTP_ACCEPT_ENCODING="gzip")
+
+        response = self.middleware(HttpResponse(b"x" * 100))(request)
+
+        self.assertFalse(response.has_header("Content-Encoding"))
+
+    def test_excluded_paths_are_not_compressed(self):
+        """
+        Token responses are never compressed.
+        """
+        request = RequestFactory().post("/api/token/", HTTP_ACCEPT_ENCODING="gzip")
+
+        response = self.middleware(HttpResponse(b"x" * 1000))(request)
+
+        self.assertFalse(response.has_header("Content-Encoding"))
+
+    def test_streaming_response(self):
+        """
+        Streaming bodies are compressed chunk by chunk.
+        """
+        request = RequestFactory().get("/", HTTP_ACCEPT_ENCODING="gzip")
+        chunks = [b"chunk %d " % i * 50 for i in range(10)]
+
+        response = self.middleware(StreamingHttpResponse(iter(chunks)))(request)
+
+        self.assertEqual(response["Content-Encoding"], "gzip")
+        self.assertEqual(gzip.decompress(b"".join(response.streaming_content)),
+                         b"".join(chunks))
+        self.assertEqual(compression.metrics.snapshot()["gzip"]["bytes_in"],
+                         sum(map(len, chunks)))
+
+    def test_quality_values(self):
+        """
+        The client's quality values win over the server's preference.
+        """
+        middleware = self.middleware(None)
+
+        self.assertEqual(middleware.choose_codec("gzip, br;q=0.5, zstd;q=0.1").name,
+                         "gzip")
+        self.assertIsNone(middleware.choose_codec("gzip;q=0, identity"))
+        self.assertIsNone(middleware.choose_codec(""))
+
+    @unittest.skipUnless(compression.zstandard, "zstandard is not installed")
+    def test_zstd_preferred(self):
+        """
+        zstd is picked when the client accepts everything equally.
+        """
+        response = client.get(self.schema_url,
+                              HTTP_ACCEPT_ENCODING="gzip, deflate, br, zstd")
+
+        self.assertEqual(response["Content-Encoding"], "zstd")
+
+    @unittest.skipUnless(compression.brotli, "brotli is not installed")
+    def test_brotli_streaming(self):
+        """
+        Brotli streams decode back to the original body.
+        """
+        request = RequestFactory().get("/", HTTP_ACCEPT_ENCODING="br")
+        chunks = [b"chunk %d " % i * 50 for i in range(10)]
+
+        response = self.middleware(StreamingHttpResponse(iter(chunks)))(request)
+
+        self.assertEqual(
+            compression.brotli.decompress(b"".join(response.streaming_content)),
+            b"".join(chunks))
+
+
+class ConditionalGetTests(TestCase):
+    """
+    Tests for answering revalidations with 304 Not Modified.
+    """
+
+    def test_not_modified(self):
+        """
+        A request repeating the ETag gets an empty 304.
+        """
+        url = reverse("schema-json", kwargs={"format": ".json"})
+        etag = client.get(url)["ETag"]
+
+        response = client.get(url, HTTP_IF_NONE_MATCH=etag)
+
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+        self.assertEqual(response.content, b"")
+
+
+def busy_view(request):
+    """
+    A view spinning long enough to be sampled a few times.
+    """
+    deadline = time.perf_counter() + 0.05
+    while time.perf_counter() < deadline:
+        pass
+    return HttpResponse("done")
+
+
+class ProfilingMiddlewareTests(TestCase):
+    """
+    Tests for the opt-in request profiler.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        """
+        Creates a staff and a regular user.
+        """
+        cls.staff = UserFactory(is_staff=True)
+        cls.user = UserFactory()
+
+    def setUp(self):
+        """
+        Profiles every test into its own directory.
+        """
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.directory = directory.name
+        settings = override_settings(PROFILING={
+            "ENABLED": True, "SAMPLE_RATE": 0.0, "DIRECTORY": self.directory})
+        settings.enable()
+        self.addCleanup(settings.disable)
+
+    def request(self, user=None, **extra):
+        """
+        Builds an API request, authenticated as the user if given.
+        """
+        if user is not None:
+            token = RefreshToken.for_user(user).access_token
+            extra["HTTP_AUTHORIZATION"] = f"Bearer {token}"
+        return RequestFactory().get("/api/user/", **extra)
+
+    def test_disabled(self):
+        """
+        Disabled, the middleware drops out of the stack.
+        """
+        with override_settings(PROFILING={"ENABLED": False}):
+            with self.assertRaises(MiddlewareNotUsed):
+                ProfilingMiddleware(busy_view)
+
+    def test_staff_header(self):
+        """
+        A staff request with the header is written as folded stacks.
+        """
+        response = ProfilingMiddleware(busy_view)(
+            self.request(self.staff, HTTP_X_PROFILE="1"))
+
+        name = response["X-Profile-Id"]
+        self.assertEqual(os.listdir(self.directory), [name])
+        with open(os.path.join(self.directory, name)) as file:
+            lines = file.read().splitlines()
+        self.assertTrue(lines)
+        for line in lines:
+            stack, count = line.rsplit(" ", 1)
+            self.assertGreater(int(count), 0)
+        self.assertTrue(any("busy_view@" in line for line in lines))
+
+    def test_header_needs_staff(self):
+        """
+        The header is ignored for anonymous and non-staff requests.
+        """
+        middleware = ProfilingMiddleware(busy_view)
+
+        for user in (None, self.user):
+            response = middleware(self.request(user, HTTP_X_PROFILE="1"))
+            self.assertNotIn("X-Profile-Id", response)
+        self.assertEqual(os.listdir(self.directory), [])
+
+    def test_sample_rate(self):
+        """
+        Sampled requests are profiled without revealing it.
+        """
+        with override_settings(PROFILING={
+                "ENABLED": True, "SAMPLE_RATE": 1.0, "DIRECTORY": self.directory}):
+            middleware = ProfilingMiddleware(busy_view)
+        response = middleware(self.request())
+
+        self.assertNotIn("X-Profile-Id", response)
+        self.assertEqual(len(os.listdir(self.directory)), 1)
+
+    def test_other_paths(self):
+        """
+        Requests outside the profiled paths are left alone.
+        """
+        middleware = ProfilingMiddleware(busy_view)
+        request = RequestFactory().get("/admin/", HTTP_X_PROFILE="1")
+        request.META["HTTP_AUTHORIZATION"] = self.request(
+            self.staff).META["HTTP_AUTHORIZATION"]
+
+        self.assertNotIn("X-Profile-Id", middleware(request))
+
+    def test_rotation(self):
+        """
+        Only the newest profiles are kept.
+        """
+        writer = ProfileWriter(self.directory, max_files=3)
+        names = [writer.write(self.request(), 0.01, "a;b 1\n") for _ in range(5)]
+
+        self.assertEqual(sorted(os.listdir(self.directory)), names[-3:])
+
+    def test_rotation_race(self):
+        """
+        Profiles already deleted by another process are skipped.
+        """
+        writer = ProfileWriter(self.directory, max_files=1)
+        names = [writer.write(self.request(), 0.01, "a;b 1\n") for _ in range(2)]
+        remove = os.remove
+
+        def remove_twice(path):
+            remove(path)
+            remove(path)
+
+        with mock.patch("os.remove", side_effect=remove_twice):
+            name = writer.write(self.request(), 0.01, "a;b 1\n")
+
+        self.assertNotIn(names[-1], os.listdir(self.directory))
+        self.assertEqual(os.listdir(self.directory), [name])
+
+    def test_failure_unwritable_directory(self):
+        """
+        Tests the failure case when the profile cannot be written, the
+        request still succeeds.
+        """
+        path = os.path.join(self.directory, "not-a-directory")
+        open(path, "w").close()
+        with override_settings(PROFILING={"ENABLED": True, "DIRECTORY": path}):
+            middleware = ProfilingMiddleware(busy_view)
+
+        with self.assertLogs("oessenger.middleware.profiling", "ERROR"):
+            response = middleware(self.request(self.staff, HTTP_X_PROFILE="1"))
+
+        self.assertEqual(response.status_code, 200)
+        self.assertNotIn("X-Profile-Id", response)
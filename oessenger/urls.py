@@ -3,6 +3,7 @@ from django.urls import include, path
 from rest_framework import permissions
 from drf_yasg.views import get_schema_view
 from drf_yasg import openapi
+from .views import MetricsView
 
 SchemaView = get_schema_view(
     openapi.Info(
@@ -26,5 +27,8 @@ urlpatterns = [
     path('api/redoc/', SchemaView.with_ui('redoc', cache_timeout=0),
          name='schema-redoc'),
 
+    path('api/metrics/', MetricsView.as_view(), name='metrics'),
+
     path('api/', include('users.urls')),
+    path('api/', include('chats.urls')),
 ]
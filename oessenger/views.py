@@ -0,0 +1,21 @@
+from rest_framework.views import APIView
+from rest_framework.response import Response
+from rest_framework.permissions import IsAdminUser
+from .middleware import compression, idempotency
+
+
+class MetricsView(APIView):
+    """
+    Exposes in-process counters of the middleware stack to staff users.
+    """
+
+    permission_classes = [IsAdminUser]
+
+    def get(self, request, format=None):
+        """
+        Retrieve the metrics of this process.
+        """
+        return Response({
+            "idempotency": idempotency.store.metrics(),
+            "compression": compression.metrics.snapshot(),
+        })
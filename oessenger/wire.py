@@ -0,0 +1,154 @@
+"""
+Wire formats shared by the REST endpoints and WebSocket frames.
+
+JSON stays the default. Clients that send `Accept: application/msgpack` get
+MessagePack bodies, which are smaller and faster to parse on mobile, and may
+send MessagePack request bodies with the same content type.
+
+With `Accept: application/msgpack; layout=columns` lists of records are
+additionally sent schema-indexed: the field names once, then one array of
+values per record, wrapped in MessagePack extension type 1 holding
+`[field_names, rows]`.
+"""
+import json
+import msgpack
+from rest_framework.exceptions import ParseError
+from rest_framework.parsers import BaseParser
+from rest_framework.renderers import BaseRenderer
+from rest_framework.utils.encoders import JSONEncoder
+
+JSON = "json"
+MSGPACK = "msgpack"
+MSGPACK_COLUMNS = "msgpack-columns"
+
+TABLE_EXT_TYPE = 1
+
+# WebSocket subprotocol name of each wire format, in order of preference
+SUBPROTOCOLS = {
+    "oessenger.msgpack.columns": MSGPACK_COLUMNS,
+    "oessenger.msgpack": MSGPACK,
+    "oessenger.json": JSON,
+}
+
+
+class Table:
+    """
+    A list of records sharing the same fields.
+    """
+
+    def __init__(self, fields, rows):
+        self.fields = fields
+        self.rows = rows
+
+
+def to_tables(data):
+    """
+    Recursively replaces lists of records with identical fields by tables.
+    """
+    if isinstance(data, dict):
+        return {key: to_tables(value) for key, value in data.items()}
+    if isinstance(data, list):
+        items = [to_tables(item) for item in data]
+        if items and all(isinstance(item, dict) for item in items):
+            fields = list(items[0])
+            if all(list(item) == fields for item in items):
+                return Table(fields, [list(item.values()) for item in items])
+        return items
+    return data
+
+
+def pack_default(value):
+    """
+    Packs tables as extension types and everything else like the JSON
+    renderer would (datetimes, decimals, uuids...).
+    """
+    if isinstance(value, Table):
+        return msgpack.ExtType(TABLE_EXT_TYPE, msgpack.packb(
+            [value.fields, value.rows], default=pack_default))
+    return JSONEncoder().default(value)
+
+
+def unpack_ext(code, data):
+    """
+    Expands tables back into lists of dicts. Raises ValueError if a table
+    is not `[field_names, rows]` with rows as long as the field names.
+    """
+    if code == TABLE_EXT_TYPE:
+        table = msgpack.unpackb(data, raw=False, ext_hook=unpack_ext)
+        if not (isinstance(table, list) and len(table) == 2
+                and isinstance(table[0], list) and isinstance(table[1], list)):
+            raise ValueError("a table must be [field_names, rows]")
+        fields, rows = table
+        if not all(isinstance(field, str) for field in fields):
+            raise ValueError("table field names must be strings")
+        if not all(isinstance(row, list) and len(row) == len(fields)
+                   for row in rows):
+            raise ValueError("table rows must be lists as long as the fields")
+        return [dict(zip(fields, row)) for row in rows]
+    return msgpack.ExtType(code, data)
+
+
+def encode(data, wire_format=JSON):
+    """
+    Encodes data for the wire. JSON gives text, MessagePack gives bytes.
+    """
+    if wire_format == MSGPACK_COLUMNS:
+        return msgpack.packb(to_tables(data), default=pack_default)
+    if wire_format == MSGPACK:
+        return msgpack.packb(data, default=pack_default)
+    return json.dumps(data, cls=JSONEncoder, separators=(",", ":"))
+
+
+def decode(data, wire_format=JSON):
+    """
+    Decodes data encoded by `encode`.
+    """
+    if wire_format in (MSGPACK, MSGPACK_COLUMNS):
+        return msgpack.unpackb(data, raw=False, ext_hook=unpack_ext)
+    return json.loads(data)
+
+
+def negotiate_subprotocol(subprotocols):
+    """
+    Returns the preferred supported (subprotocol, wire format) pair offered
+    by a WebSocket client, falling back to JSON without a subprotocol.
+    """
+    for subprotocol, wire_format in SUBPROTOCOLS.items():
+        if subprotocol in subprotocols:
+            return subprotocol, wire_format
+    return None, JSON
+
+
+class MessagePackRenderer(BaseRenderer):
+    """
+    Renderer which serializes to MessagePack, optionally schema-indexed.
+    """
+
+    media_type = "application/msgpack"
+    format = "msgpack"
+    charset = None
+    render_style = "binary"
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b""
+        params = (accepted_media_type or "").replace(" ", "").split(";")[1:]
+        if "layout=columns" in params:
+            return encode(data, MSGPACK_COLUMNS)
+        return encode(data, MSGPACK)
+
+
+class MessagePackParser(BaseParser):
+    """
+    Parses MessagePack-serialized data.
+    """
+
+    media_type = "application/msgpack"
+
+    def parse(self, stream, media_type=None, parser_context=None):
+        try:
+            return decode(stream.read(), MSGPACK)
+        except (TypeError, ValueError, msgpack.exceptions.ExtraData,
+                msgpack.exceptions.FormatError,
+                msgpack.exceptions.StackError) as exc:
+            raise ParseError(f"MessagePack parse error - {exc}")
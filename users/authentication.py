@@ -0,0 +1,14 @@
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from . import presence
+
+
+class PresenceJWTAuthentication(JWTAuthentication):
+    """
+    JWT authentication that records the user's activity for presence.
+    """
+
+    def authenticate(self, request):
+        result = super().authenticate(request)
+        if result is not None:
+            presence.touch(result[0])
+        return result
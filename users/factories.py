@@ -1,25 +1,48 @@
-from pytz import utc
+from datetime import datetime, timezone
+from functools import lru_cache
 import factory
+from django.contrib.auth.hashers import make_password
 from factory.django import DjangoModelFactory
 from .models import User
 
+# the raw password of every generated user
+PASSWORD = "s3cret-pass"
+
+
+@lru_cache(maxsize=None)
+def hashed_password():
+    """
+    Hash PASSWORD once, hashing is deliberately slow.
+    """
+    return make_password(PASSWORD)
+
 
 class UserFactory(DjangoModelFactory):
     """
     A configuration class for the UserFactory factory class.
+
+    Fields come from a sequence rather than Faker, so generated users are
+    unique without a lookup before the insert and the same on every run.
     """
     class Meta:
         """
         Configuration options for the UserFactory factory class.
         """
         model = User
-        django_get_or_create = ('username', 'email',)
-
-    username = factory.Faker('user_name')
-    password = factory.Faker('password')
-    email = factory.Faker('email')
-    first_name = factory.Faker('first_name')
-    last_name = factory.Faker('last_name')
-    bio = factory.Faker('paragraph')
-    picture_path = factory.Faker('file_path')
-    last_login = factory.Faker('date_time_this_decade', tzinfo=utc)
+
+    username = factory.Sequence(lambda n: f"user{n}")
+    password = factory.LazyFunction(hashed_password)
+    email = factory.Sequence(lambda n: f"user{n}@example.com")
+    first_name = factory.Sequence(lambda n: f"First{n}")
+    last_name = factory.Sequence(lambda n: f"Last{n}")
+    bio = factory.LazyAttribute(lambda user: f"The bio of {user.username}.")
+    picture_path = factory.LazyAttribute(
+        lambda user: f"pictures/{user.username}.png")
+    last_login = datetime(2024, 1, 1, tzinfo=timezone.utc)
+
+
+def seed_users(count, **kwargs):
+    """
+    Insert count generated users in a single query and return them.
+    """
+    return User.objects.bulk_create(UserFactory.build_batch(count, **kwargs))
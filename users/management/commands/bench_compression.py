@@ -0,0 +1,75 @@
+import statistics
+import time
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+from drf_yasg import openapi
+from drf_yasg.codecs import OpenAPICodecJson
+from drf_yasg.generators import OpenAPISchemaGenerator
+from chats.models import Message
+from chats.serializers import MessageSerializer
+from oessenger import wire
+from oessenger.middleware.compression import DEFAULTS, available_codecs
+
+
+class Command(BaseCommand):
+    """
+    Reports bytes saved and compression time of every available coding for
+    history pages of growing size and for the API schema.
+    """
+
+    help = "Benchmark response compression per coding and response size."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--runs", type=int, default=10)
+
+    def handle(self, *args, **options):
+        payloads = [(f"{count} messages", self.history_page(count))
+                    for count in (5, 50, 500, 5000)]
+        payloads.append(("API schema", self.schema()))
+
+        codecs = available_codecs(DEFAULTS["LEVELS"])
+        for label, body in payloads:
+            for codec in codecs:
+                compressed = codec.compress(body)
+                seconds = self.measure(lambda: codec.compress(body), options["runs"])
+                self.stdout.write(
+                    f"{label:>14} {len(body):>9} B {codec.name:>5}: "
+                    f"{len(compressed):>8} B, "
+                    f"saved {1 - len(compressed) / len(body):6.1%}, "
+                    f"{seconds * 1000:8.3f} ms, "
+                    f"{len(body) / seconds / 1e6:7.1f} MB/s")
+
+    def history_page(self, count):
+        """
+        Returns a JSON history page of `count` messages.
+        """
+        now = timezone.now()
+        messages = [
+            Message(id=1_000_000 + i, conversation_id=42, sender_id=7 + i % 3,
+                    created_at=now, body=f"message number {i}, see you at {i % 24}h")
+            for i in range(count)
+        ]
+        return wire.encode({
+            "results": MessageSerializer(messages, many=True).data,
+            "next": "1700000000000000.1000000",
+        }).encode()
+
+    def schema(self):
+        """
+        Returns the OpenAPI schema served at /api/swagger.json.
+        """
+        generator = OpenAPISchemaGenerator(
+            openapi.Info(title="Oessenger API", default_version="v1"))
+        return OpenAPICodecJson(validators=[]).encode(
+            generator.get_schema(request=None, public=True))
+
+    def measure(self, func, runs):
+        """
+        Returns the median run time of `func` in seconds.
+        """
+        timings = []
+        for _ in range(runs):
+            start = time.perf_counter()
+            func()
+            timings.append(time.perf_counter() - start)
+        return statistics.median(timings)
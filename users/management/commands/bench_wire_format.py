@@ -0,0 +1,64 @@
+import statistics
+import time
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+from chats.models import Message
+from chats.serializers import MessageSerializer
+from oessenger import wire
+from users.factories import UserFactory
+from users.serializers import UserSerializer
+
+
+class Command(BaseCommand):
+    """
+    Compares payload size and encode/decode time of the wire formats for
+    profile lists and message batches. Nothing is written to the database.
+    """
+
+    help = "Benchmark JSON against MessagePack for typical payloads."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--profiles", type=int, default=500)
+        parser.add_argument("--messages", type=int, default=1000)
+        parser.add_argument("--runs", type=int, default=20)
+
+    def handle(self, *args, **options):
+        now = timezone.now()
+        profiles = UserSerializer([
+            UserFactory.build(id=i, last_activity=now, date_joined=now)
+            for i in range(options["profiles"])
+        ], many=True).data
+        messages = MessageSerializer([
+            Message(id=i, conversation_id=1, sender_id=i % 7, created_at=now,
+                    body="see you at the station in ten minutes")
+            for i in range(options["messages"])
+        ], many=True).data
+
+        for label, payload in (("profile", profiles[0]),
+                               (f"{len(profiles)} profiles", profiles),
+                               (f"{len(messages)} messages", messages)):
+            for wire_format in (wire.JSON, wire.MSGPACK, wire.MSGPACK_COLUMNS):
+                self.report(label, wire_format, payload, options["runs"])
+
+    def report(self, label, wire_format, payload, runs):
+        """
+        Prints the encoded size and the median encode and decode times.
+        """
+        encoded = wire.encode(payload, wire_format)
+        size = len(encoded.encode() if isinstance(encoded, str) else encoded)
+        encode_ms = self.measure(lambda: wire.encode(payload, wire_format), runs)
+        decode_ms = self.measure(lambda: wire.decode(encoded, wire_format), runs)
+        self.stdout.write(
+            f"{label:>16} {wire_format:>15}: {size:>9} bytes, "
+            f"encode {encode_ms:.3f} ms, decode {decode_ms:.3f} ms")
+
+    def measure(self, func, runs):
+        """
+        Returns the median run time of `func` in milliseconds.
+        """
+        timings = []
+        for _ in range(runs):
+            start = time.perf_counter()
+            func()
+            timings.append((time.perf_counter() - start) * 1000)
+        return statistics.median(timings)
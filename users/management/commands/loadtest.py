@@ -0,0 +1,307 @@
+import http.client
+import json
+import math
+import random
+import threading
+import time
+import uuid
+from collections import defaultdict
+from urllib.parse import urlsplit
+from django.core.management.base import BaseCommand, CommandError
+
+PASSWORD = "l0ad-test-pass"
+
+
+def percentile(sorted_values, fraction):
+    """
+    Returns the nearest-rank percentile of an already sorted list.
+    """
+    index = max(0, int(round(fraction * len(sorted_values) + 0.5)) - 1)
+    return sorted_values[min(index, len(sorted_values) - 1)]
+
+
+class Stats:
+    """
+    Latencies and failures per endpoint, shared by every client thread.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.latencies = defaultdict(list)
+        self.errors = defaultdict(int)
+        self.statuses = defaultdict(lambda: defaultdict(int))
+
+    def add(self, endpoint, status, seconds):
+        """
+        Records one request. Statuses of 400 and above and transport errors,
+        recorded with status 0, count as errors.
+        """
+        with self.lock:
+            self.latencies[endpoint].append(seconds)
+            self.statuses[endpoint][status] += 1
+            if not 200 <= status < 400:
+                self.errors[endpoint] += 1
+
+    def summary(self, duration):
+        """
+        Returns a row per endpoint with throughput, error rate and latency
+        percentiles in milliseconds.
+        """
+        rows = []
+        with self.lock:
+            for endpoint in sorted(self.latencies):
+                latencies = sorted(self.latencies[endpoint])
+                rows.append({
+                    "endpoint": endpoint,
+                    "requests": len(latencies),
+                    "rps": len(latencies) / duration,
+                    "error_rate": self.errors[endpoint] / len(latencies),
+                    "statuses": dict(self.statuses[endpoint]),
+                    **{name: percentile(latencies, fraction) * 1000
+                       for name, fraction in (("p50", 0.5), ("p90", 0.9),
+                                              ("p99", 0.99), ("max", 1))},
+                })
+        return rows
+
+
+class HttpClient:
+    """
+    One virtual client with its own keep-alive connection.
+    """
+
+    def __init__(self, base_url, stats, timeout):
+        parts = urlsplit(base_url)
+        self.host, self.port = parts.hostname, parts.port
+        self.prefix = parts.path.rstrip("/")
+        self.stats = stats
+        self.timeout = timeout
+        self.connection = None
+
+    def request(self, endpoint, method, path, data=None, token=None):
+        """
+        Sends a JSON request, records it under `endpoint` and returns the
+        status and decoded body. Transport errors give status 0.
+        """
+        headers = {"Content-Type": "application/json"}
+        if token:
+            headers["Authorization"] = f"Bearer {token}"
+        body = json.dumps(data) if data is not None else None
+        start = time.perf_counter()
+        try:
+            if self.connection is None:
+                self.connection = http.client.HTTPConnection(
+                    self.host, self.port, timeout=self.timeout)
+            self.connection.request(method, self.prefix + path, body, headers)
+            response = self.connection.getresponse()
+            status, content = response.status, response.read()
+        except (OSError, http.client.HTTPException):
+            self.close()
+            status, content = 0, b""
+        self.stats.add(endpoint, status, time.perf_counter() - start)
+        try:
+            return status, json.loads(content) if content else None
+        except ValueError:
+            return status, None
+
+    def close(self):
+        """
+        Drops the connection, the next request opens a new one.
+        """
+        if self.connection is not None:
+            self.connection.close()
+            self.connection = None
+
+
+class VirtualUser(threading.Thread):
+    """
+    Logs in, then loops over the workload mix until the deadline, pausing
+    for a random think time between requests.
+    """
+
+    def __init__(self, client, username, mix, options, deadline):
+        super().__init__(daemon=True)
+        self.client = client
+        self.username = username
+        self.mix = mix
+        self.options = options
+        self.deadline = deadline
+        self.rng = random.Random(username)
+        self.access = self.refresh = None
+        self.refreshed_at = 0.0
+
+    def login(self):
+        """
+        Obtains a token pair.
+        """
+        status, data = self.client.request(
+            "POST /api/token/", "POST", "/api/token/",
+            {"username": self.username, "password": PASSWORD})
+        if status == 200:
+            self.access, self.refresh = data["access"], data["refresh"]
+            self.refreshed_at = time.monotonic()
+
+    def refresh_token(self):
+        """
+        Rotates the refresh token, logging in again if it was rejected.
+        """
+        status, data = self.client.request(
+            "POST /api/token/refresh/", "POST", "/api/token/refresh/",
+            {"refresh": self.refresh})
+        if status == 200:
+            self.access, self.refresh = data["access"], data["refresh"]
+            self.refreshed_at = time.monotonic()
+        else:
+            self.login()
+
+    def get_profile(self):
+        """
+        Reads the profile.
+        """
+        self.client.request("GET /api/user/", "GET", "/api/user/",
+                            token=self.access)
+
+    def patch_profile(self):
+        """
+        Updates the bio.
+        """
+        self.client.request("PATCH /api/user/", "PATCH", "/api/user/",
+                            {"bio": f"status {self.rng.randrange(1000)}"},
+                            token=self.access)
+
+    def run(self):
+        """
+        Runs the session of this user.
+        """
+        actions = [self.login, self.get_profile, self.patch_profile]
+        self.login()
+        while time.monotonic() < self.deadline:
+            if self.access is None:
+                self.login()
+            elif (time.monotonic() - self.refreshed_at
+                  >= self.options["refresh_interval"]):
+                self.refresh_token()
+            else:
+                self.rng.choices(actions, self.mix)[0]()
+            think = self.options["think"]
+            if think:
+                time.sleep(self.rng.expovariate(1 / think))
+        self.client.close()
+
+
+def signup(client, username):
+    """
+    Creates a user through the API and returns whether it succeeded.
+    """
+    status, _ = client.request("POST /api/user/", "POST", "/api/user/", {
+        "username": username, "email": f"{username}@example.com",
+        "first_name": "Load", "password": PASSWORD})
+    return status == 201
+
+
+class Command(BaseCommand):
+    """
+    Runs a chat workload mix against a running oessenger node over HTTP.
+
+    Virtual users are signed up before the measured run. During the run
+    each of them logs in, refreshes its token every --refresh-interval
+    seconds and otherwise picks a login, profile GET or profile PATCH by
+    the --mix weights, while a separate thread signs up new users at
+    --signup-rate per second.
+    """
+
+    help = "Load test the API and report throughput, latency and errors."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--url", default="http://127.0.0.1:8000",
+                            help="Base URL of the node under test.")
+        parser.add_argument("--clients", type=int, default=20,
+                            help="Concurrent virtual users.")
+        parser.add_argument("--duration", type=float, default=30,
+                            help="Seconds to run the mix for.")
+        parser.add_argument("--mix", default="1,8,2",
+                            help="Weights of login, profile GET and PATCH.")
+        parser.add_argument("--refresh-interval", type=float, default=10,
+                            help="Seconds between token refreshes per user.")
+        parser.add_argument("--signup-rate", type=float, default=1,
+                            help="Signups per second, 0 disables them.")
+        parser.add_argument("--think", type=float, default=0.05,
+                            help="Mean pause between a user's requests.")
+        parser.add_argument("--timeout", type=float, default=10)
+        parser.add_argument("--json", action="store_true",
+                            help="Print the report as JSON.")
+
+    def handle(self, *args, **options):
+        mix = self.parse_mix(options["mix"])
+        run_id = uuid.uuid4().hex[:8]
+        setup_stats, stats = Stats(), Stats()
+
+        usernames = [f"load-{run_id}-{i}" for i in range(options["clients"])]
+        client = HttpClient(options["url"], setup_stats, options["timeout"])
+        usernames = [name for name in usernames if signup(client, name)]
+        client.close()
+        if not usernames:
+            self.stderr.write("Could not sign up any virtual user.")
+            return
+
+        start = time.monotonic()
+        deadline = start + options["duration"]
+        threads = [
+            VirtualUser(HttpClient(options["url"], stats, options["timeout"]),
+                        name, mix, options, deadline)
+            for name in usernames
+        ]
+        if options["signup_rate"] > 0:
+            threads.append(threading.Thread(target=self.sign_up_at_rate, daemon=True,
+                                            args=(options, stats, run_id, deadline)))
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.monotonic() - start
+        rows = stats.summary(elapsed)
+
+        if options["json"]:
+            self.stdout.write(json.dumps(rows, indent=2))
+            return
+        self.stdout.write(
+            f"{len(usernames)} clients for {options['duration']:g}s "
+            f"against {options['url']}")
+        self.stdout.write(
+            f"{'endpoint':<26}{'requests':>9}{'req/s':>9}{'errors':>8}"
+            f"{'p50 ms':>9}{'p90 ms':>9}{'p99 ms':>9}{'max ms':>9}")
+        for row in rows:
+            self.stdout.write(
+                f"{row['endpoint']:<26}{row['requests']:>9}{row['rps']:>9.1f}"
+                f"{row['error_rate']:>8.1%}{row['p50']:>9.1f}{row['p90']:>9.1f}"
+                f"{row['p99']:>9.1f}{row['max']:>9.1f}")
+        total = sum(row["requests"] for row in rows)
+        self.stdout.write(f"total {total} requests, {total / elapsed:.1f} req/s")
+
+    def parse_mix(self, value):
+        """
+        Returns the --mix weights, three non-negative numbers not all zero.
+        """
+        try:
+            mix = [float(weight) for weight in value.split(",")]
+        except ValueError:
+            mix = []
+        if (len(mix) != 3 or not all(math.isfinite(weight) and weight >= 0
+                                     for weight in mix) or not any(mix)):
+            raise CommandError(
+                f"--mix takes three non-negative weights for login, profile GET "
+                f"and PATCH, not all zero, got {value!r}.")
+        return mix
+
+    def sign_up_at_rate(self, options, stats, run_id, deadline):
+        """
+        Signs new users up at a steady rate until the deadline.
+        """
+        client = HttpClient(options["url"], stats, options["timeout"])
+        interval = 1 / options["signup_rate"]
+        next_at, count = time.monotonic(), 0
+        while next_at < deadline:
+            time.sleep(max(0, next_at - time.monotonic()))
+            signup(client, f"signup-{run_id}-{count}")
+            count += 1
+            next_at += interval
+        client.close()
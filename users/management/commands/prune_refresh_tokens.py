@@ -0,0 +1,25 @@
+import time
+from django.core.management.base import BaseCommand
+from users import tokens
+
+
+class Command(BaseCommand):
+    """
+    Deletes expired refresh token records in small batches. Meant to run
+    from cron, or continuously as a worker with --interval.
+    """
+
+    help = "Prune expired refresh token records."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=5000)
+        parser.add_argument("--interval", type=int, default=0,
+                            help="keep running, pruning every N seconds")
+
+    def handle(self, *args, **options):
+        while True:
+            pruned = tokens.prune_expired(batch_size=options["batch_size"])
+            self.stdout.write(f"pruned {pruned} expired refresh tokens")
+            if not options["interval"]:
+                return
+            time.sleep(options["interval"])
@@ -0,0 +1,39 @@
+import time
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+from users import outbox
+
+
+class Command(BaseCommand):
+    """
+    Publishes profile changes from the outbox to the subscribers configured
+    in settings.OUTBOX until it is drained, then prunes what all of them
+    received once it is older than the retention. Meant to run from cron,
+    or continuously as a worker with --follow.
+    """
+
+    help = "Relay profile changes from the outbox to its subscribers."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--follow", action="store_true",
+                            help="keep running, polling the outbox")
+
+    def handle(self, *args, **options):
+        relay = outbox.get_relay()
+        config = getattr(settings, "OUTBOX", {})
+        relayed = 0
+        while True:
+            delivered = relay.relay()
+            relayed += delivered
+            for name, error in relay.errors.items():
+                self.stderr.write(f"subscriber {name} failed: {error!r}")
+            if delivered and not relay.errors:
+                continue
+
+            if config.get("RETENTION"):
+                relay.prune(timezone.now() - config["RETENTION"])
+            if not options["follow"]:
+                self.stdout.write(f"relayed {relayed} profile changes")
+                return
+            time.sleep(config.get("POLL_INTERVAL", 1))
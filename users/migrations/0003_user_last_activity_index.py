@@ -0,0 +1,19 @@
+# Generated by Django 4.2.7 on 2026-10-19 16:31
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0002_alter_user_bio_alter_user_email_and_more'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='user',
+            name='last_activity',
+            field=models.DateTimeField(db_index=True, default=django.utils.timezone.now, verbose_name='last_activity'),
+        ),
+    ]
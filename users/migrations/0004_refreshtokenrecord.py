@@ -0,0 +1,27 @@
+# Generated by Django 4.2.7 on 2026-10-19 16:39
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0003_user_last_activity_index'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RefreshTokenRecord',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('token_hash', models.BinaryField(max_length=32, unique=True, verbose_name='token hash')),
+                ('family', models.UUIDField(db_index=True, verbose_name='family')),
+                ('expires_at', models.DateTimeField(db_index=True, verbose_name='expires at')),
+                ('used_at', models.DateTimeField(blank=True, null=True, verbose_name='used at')),
+                ('revoked', models.BooleanField(default=False, verbose_name='revoked')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='refresh_tokens', to=settings.AUTH_USER_MODEL)),
+            ],
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 4.2.7 on 2026-10-19 17:37
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0006_profilechange_outboxcursor'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='outboxcursor',
+            name='gaps',
+            field=models.JSONField(default=list, verbose_name='gaps'),
+        ),
+    ]
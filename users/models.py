@@ -1,5 +1,6 @@
 from django.contrib.auth.models import AbstractUser
 from django.db import models
+from django.db.models.functions import Lower
 from django.utils.translation import gettext_lazy as _
 from django.utils import timezone
 
@@ -11,13 +12,84 @@ class User(AbstractUser):
 
     # override
     first_name = models.CharField(_("first name"), max_length=150)
-    email = models.EmailField(_("email address"), unique=True)
+    # unique regardless of case, see Meta.constraints
+    email = models.EmailField(_("email address"))
 
     # new fields
     bio = models.TextField(_("bio"), blank=True)
     picture_path = models.CharField(
         _("picture path"), max_length=255, blank=True)
-    last_activity = models.DateTimeField(_("last_activity"), default=timezone.now)
+    last_activity = models.DateTimeField(
+        _("last_activity"), default=timezone.now, db_index=True)
+
+    class Meta(AbstractUser.Meta):
+        """
+        Metadata options for the User model.
+        """
+        constraints = [
+            models.UniqueConstraint(Lower("email"),
+                                    name="users_user_email_ci_unique"),
+        ]
 
     def __str__(self):
         return f"User: {self.username}"
+
+
+class RefreshTokenRecord(models.Model):
+    """
+    An issued refresh token, stored by the hash of its id.
+
+    Tokens issued from the same login share a family. Presenting a token that
+    was already rotated revokes the whole family, as it means either the
+    client or an attacker holds a stolen copy.
+    """
+
+    token_hash = models.BinaryField(_("token hash"), max_length=32, unique=True)
+    family = models.UUIDField(_("family"), db_index=True)
+    user = models.ForeignKey(User, on_delete=models.CASCADE,
+                             related_name="refresh_tokens")
+    expires_at = models.DateTimeField(_("expires at"), db_index=True)
+    used_at = models.DateTimeField(_("used at"), null=True, blank=True)
+    revoked = models.BooleanField(_("revoked"), default=False)
+
+    def __str__(self):
+        return f"RefreshTokenRecord: {self.family} of {self.user_id}"
+
+
+class ProfileChange(models.Model):
+    """
+    An outbox row for a change to a user's public profile.
+
+    Rows are written in the transaction that changes the user, and their id
+    is the sequence consumers resume from.
+    """
+
+    CREATED = "created"
+    UPDATED = "updated"
+    KIND_CHOICES = [(CREATED, _("created")), (UPDATED, _("updated"))]
+
+    user = models.ForeignKey(User, on_delete=models.CASCADE,
+                             related_name="profile_changes")
+    kind = models.CharField(_("kind"), max_length=16, choices=KIND_CHOICES)
+    # the new values of the changed profile fields
+    fields = models.JSONField(_("fields"))
+    created_at = models.DateTimeField(_("created at"), default=timezone.now,
+                                      db_index=True)
+
+    def __str__(self):
+        return f"ProfileChange: {self.pk} of {self.user_id}"
+
+
+class OutboxCursor(models.Model):
+    """
+    The id of the last profile change the relay delivered to a subscriber,
+    and the ids below it that were not committed yet when it moved past.
+    """
+
+    subscriber = models.CharField(_("subscriber"), max_length=64, unique=True)
+    position = models.BigIntegerField(_("position"), default=0)
+    gaps = models.JSONField(_("gaps"), default=list)
+    updated_at = models.DateTimeField(_("updated at"), auto_now=True)
+
+    def __str__(self):
+        return f"OutboxCursor: {self.subscriber} at {self.position}"
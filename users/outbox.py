@@ -0,0 +1,200 @@
+import hashlib
+import hmac
+import json
+import urllib.request
+from datetime import timedelta
+from django.conf import settings
+from django.db.models import Q
+from django.utils import timezone
+from django.utils.module_loading import import_string
+from .models import OutboxCursor, ProfileChange
+
+# the profile fields whose changes are published
+TRACKED_FIELDS = ("first_name", "picture_path", "bio")
+SIGNATURE_HEADER = "X-Oessenger-Signature"
+# how long a skipped id is waited for by default, a transaction open for
+# longer is assumed to have rolled back
+GAP_TIMEOUT = timedelta(minutes=5)
+# the most skipped ids a consumer keeps waiting for
+MAX_GAPS = 100
+
+
+def record(user, fields, kind=ProfileChange.UPDATED):
+    """
+    Adds a change of the user to the outbox if any of the given fields is
+    tracked. Must run in the transaction that saves the user.
+    """
+    changed = {field: getattr(user, field)
+               for field in TRACKED_FIELDS if field in fields}
+    if not changed:
+        return None
+    return ProfileChange.objects.create(user=user, kind=kind, fields=changed)
+
+
+def changes_after(position, limit, settle_delay=None, gaps=()):
+    """
+    Returns up to `limit` changes following the given sequence position,
+    and those of the `gaps`, ids below it that were not visible yet.
+
+    Ids are allocated before commit, so a change can become visible after
+    a later one. Only changes older than `settle_delay` are returned, which
+    gives most such transactions time to commit before a consumer moves
+    past; the rest are caught up through the gaps, see `advance`.
+    """
+    changes = ProfileChange.objects.filter(Q(pk__gt=position) | Q(pk__in=gaps))
+    if settle_delay:
+        changes = changes.filter(created_at__lte=timezone.now() - settle_delay)
+    return list(changes.order_by("pk")[:limit])
+
+
+def advance(position, gaps, changes, gap_timeout=GAP_TIMEOUT):
+    """
+    Returns the position and gaps to read from once `changes` are consumed.
+
+    The ids skipped below the new position become gaps, unless a change
+    following them is older than `gap_timeout`; their transactions started
+    before it and are assumed to have rolled back. Gaps are dropped once
+    they are found or time out the same way. A consumer starting from 0
+    takes the first change it reads as the start of the sequence.
+    """
+    seen = {change.pk for change in changes}
+    gaps = {gap for gap in gaps if gap not in seen}
+    horizon = timezone.now() - gap_timeout
+    previous = position
+    for change in changes:
+        if change.pk <= position:
+            continue
+        if previous and change.created_at > horizon:
+            gaps.update(range(max(previous + 1, change.pk - MAX_GAPS), change.pk))
+        previous = change.pk
+
+    if gaps:
+        expired = ProfileChange.objects.filter(
+            created_at__lte=horizon).order_by("-created_at").values_list(
+                "pk", flat=True).first()
+        gaps = {gap for gap in gaps if expired is None or gap > expired}
+    return previous, sorted(gaps)[-MAX_GAPS:]
+
+
+def settle_delay():
+    """
+    Returns the configured settle delay of the outbox.
+    """
+    return getattr(settings, "OUTBOX", {}).get("SETTLE_DELAY")
+
+
+def gap_timeout():
+    """
+    Returns the configured time skipped ids are waited for.
+    """
+    return getattr(settings, "OUTBOX", {}).get("GAP_TIMEOUT", GAP_TIMEOUT)
+
+
+def event(change):
+    """
+    Returns the published form of a change.
+    """
+    return {
+        "seq": change.pk,
+        "type": f"profile.{change.kind}",
+        "user": change.user_id,
+        "fields": change.fields,
+        "at": change.created_at.isoformat(),
+    }
+
+
+class WebhookSubscriber:
+    """
+    Posts batches of events as JSON to a URL, signed with HMAC-SHA256 of
+    the body when a secret is set.
+    """
+
+    def __init__(self, url, secret="", timeout=10):
+        self.url = url
+        self.secret = secret.encode()
+        self.timeout = timeout
+
+    def publish(self, events):
+        """
+        Posts the events. Failures raise, so the batch is delivered again.
+        """
+        body = json.dumps({"events": events}).encode()
+        request = urllib.request.Request(self.url, data=body, method="POST")
+        request.add_header("Content-Type", "application/json")
+        if self.secret:
+            request.add_header(SIGNATURE_HEADER, hmac.new(
+                self.secret, body, hashlib.sha256).hexdigest())
+        with urllib.request.urlopen(request, timeout=self.timeout):
+            pass
+
+
+class Relay:
+    """
+    Delivers the outbox to subscribers in order, at least once. Changes
+    committed late follow once visible, out of order.
+
+    Each subscriber has its own cursor, advanced only after its publish
+    returned, so a failing subscriber neither loses changes nor holds the
+    others back.
+    """
+
+    def __init__(self, subscribers, batch_size=500, settle_delay=None,
+                 gap_timeout=GAP_TIMEOUT):
+        self.subscribers = subscribers
+        self.batch_size = batch_size
+        self.settle_delay = settle_delay
+        self.gap_timeout = gap_timeout
+        self.errors = {}
+
+    def relay(self):
+        """
+        Publishes one batch to every subscriber and returns the number of
+        events delivered. Subscribers that failed are left in `errors`.
+        """
+        delivered, self.errors = 0, {}
+        for name, subscriber in self.subscribers.items():
+            cursor, _ = OutboxCursor.objects.get_or_create(subscriber=name)
+            changes = changes_after(cursor.position, self.batch_size,
+                                    self.settle_delay, cursor.gaps)
+            if not changes:
+                continue
+            try:
+                subscriber.publish([event(change) for change in changes])
+            except Exception as exc:  # retried from the same cursor next time
+                self.errors[name] = exc
+                continue
+            position, gaps = advance(cursor.position, cursor.gaps, changes,
+                                     self.gap_timeout)
+            OutboxCursor.objects.filter(pk=cursor.pk).update(
+                position=position, gaps=gaps, updated_at=timezone.now())
+            delivered += len(changes)
+        return delivered
+
+    def prune(self, before):
+        """
+        Deletes changes older than `before` that every subscriber received.
+        """
+        positions = list(OutboxCursor.objects.filter(
+            subscriber__in=list(self.subscribers)).values_list("position",
+                                                               flat=True))
+        if len(positions) < len(self.subscribers):
+            return 0
+        changes = ProfileChange.objects.filter(created_at__lt=before)
+        if positions:
+            changes = changes.filter(pk__lte=min(positions))
+        deleted, _ = changes.delete()
+        return deleted
+
+
+def get_relay():
+    """
+    Builds the relay with the subscribers configured in settings.OUTBOX.
+    """
+    options = getattr(settings, "OUTBOX", {})
+    subscribers = {
+        name: import_string(subscriber["CLASS"])(**subscriber.get("OPTIONS", {}))
+        for name, subscriber in options.get("SUBSCRIBERS", {}).items()
+    }
+    return Relay(subscribers, batch_size=options.get("BATCH_SIZE", 500),
+                 settle_delay=options.get("SETTLE_DELAY"),
+                 gap_timeout=options.get("GAP_TIMEOUT", GAP_TIMEOUT))
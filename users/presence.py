@@ -0,0 +1,100 @@
+import threading
+import time
+from datetime import timedelta
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.utils import timezone
+
+
+class PresenceIndex:
+    """
+    In-memory index of recently active users.
+
+    Activity is kept in a ring buffer of per-minute sets, so recording a hit
+    and answering "who of these is online" never touch the database and old
+    minutes are dropped by simply overwriting their slot.
+    """
+
+    def __init__(self, window_minutes=60):
+        self.size = window_minutes
+        self.minutes = [-1] * window_minutes
+        self.members = [set() for _ in range(window_minutes)]
+        self.lock = threading.Lock()
+
+    def touch(self, user_id, at=None):
+        """
+        Records activity for the user. Returns True if this is the user's
+        first hit within the current minute.
+        """
+        minute = int((time.time() if at is None else at) // 60)
+        slot = minute % self.size
+        with self.lock:
+            if self.minutes[slot] != minute:
+                self.minutes[slot] = minute
+                self.members[slot] = set()
+            if user_id in self.members[slot]:
+                return False
+            self.members[slot].add(user_id)
+            return True
+
+    def online(self, user_ids, idle_seconds, now=None):
+        """
+        Returns the subset of `user_ids` seen within the last `idle_seconds`,
+        at minute granularity. Only as far back as the window reaches.
+        """
+        now = time.time() if now is None else now
+        current = int(now // 60)
+        oldest = max(int((now - idle_seconds) // 60), current - self.size + 1)
+        with self.lock:
+            recent = [self.members[minute % self.size]
+                      for minute in range(oldest, current + 1)
+                      if self.minutes[minute % self.size] == minute]
+        return {user_id for user_id in user_ids
+                if any(user_id in members for members in recent)}
+
+    def clear(self):
+        """
+        Forgets all recorded activity.
+        """
+        with self.lock:
+            self.minutes = [-1] * self.size
+            self.members = [set() for _ in range(self.size)]
+
+
+index = PresenceIndex(
+    window_minutes=getattr(settings, "PRESENCE_WINDOW_MINUTES", 60))
+
+
+def get_idle_threshold():
+    """
+    Returns the configured idle threshold as a timedelta.
+    """
+    return getattr(settings, "PRESENCE_IDLE_THRESHOLD", timedelta(minutes=5))
+
+
+def touch(user):
+    """
+    Records activity for an authenticated user. `last_activity` is written at
+    most once per minute per process, and only if it actually moved forward.
+    """
+    if index.touch(user.id):
+        now = timezone.now()
+        get_user_model().objects.filter(
+            pk=user.pk, last_activity__lt=now - timedelta(minutes=1)).update(
+                last_activity=now)
+
+
+def online_status(user_ids, idle=None):
+    """
+    Maps every user id to whether the user is online. The in-memory index
+    answers first and the indexed `last_activity` column covers users this
+    process has not seen, in a single query.
+    """
+    idle = idle or get_idle_threshold()
+    online = index.online(user_ids, idle.total_seconds())
+    unknown = set(user_ids) - online
+    if unknown:
+        online |= set(get_user_model().objects.filter(
+            id__in=unknown, last_activity__gte=timezone.now() - idle,
+        ).values_list("id", flat=True))
+    return {user_id: user_id in online for user_id in user_ids}
@@ -1,8 +1,23 @@
 from rest_framework import serializers
+from rest_framework_simplejwt.serializers import (
+    TokenObtainPairSerializer,
+    TokenRefreshSerializer,
+)
 from django.contrib.auth import get_user_model
+from django.contrib.auth.validators import UnicodeUsernameValidator
+from django.db import IntegrityError, transaction
+from django.db.models import Q
+from django.db.models.functions import Lower
+from .models import ProfileChange
+from . import outbox, tokens
 
 User = get_user_model()
 
+UNIQUE_ERRORS = {
+    'username': "A user with that username already exists.",
+    'email': "A user with that email address already exists.",
+}
+
 
 class UserSerializer(serializers.ModelSerializer):
     """
@@ -23,33 +38,149 @@ class UserSerializer(serializers.ModelSerializer):
             'last_activity': {'read_only': True},
             'date_joined': {'read_only': True},
             'password': {'write_only': True},
+            # uniqueness is checked by `validate` instead of a query per field
+            'username': {'validators': [UnicodeUsernameValidator()]},
         }
 
+    def validate(self, attrs):
+        """
+        Checks username and email uniqueness with a single query. Emails are
+        compared case-insensitively, matching the functional unique index.
+        """
+        lookup = Q()
+        if 'username' in attrs:
+            lookup |= Q(username=attrs['username'])
+        if 'email' in attrs:
+            lookup |= Q(email_lower=attrs['email'].lower())
+        if not lookup:
+            return attrs
+
+        queryset = User.objects.annotate(email_lower=Lower('email')).filter(lookup)
+        if self.instance is not None:
+            queryset = queryset.exclude(pk=self.instance.pk)
+        errors = {}
+        for username, email_lower in queryset.values_list('username',
+                                                          'email_lower')[:2]:
+            if username == attrs.get('username'):
+                errors['username'] = [UNIQUE_ERRORS['username']]
+            if email_lower == attrs.get('email', '').lower():
+                errors['email'] = [UNIQUE_ERRORS['email']]
+        if errors:
+            raise serializers.ValidationError(errors)
+        return attrs
+
+    def save_unique(self, user, **kwargs):
+        """
+        Saves the user, turning a unique constraint violation caused by a
+        concurrent request into the same validation error `validate` gives.
+        """
+        try:
+            with transaction.atomic():
+                user.save(**kwargs)
+        except IntegrityError as exc:
+            # the first line names the constraint, never the offending values
+            message = str(exc).splitlines()[0].lower()
+            fields = [field for field in UNIQUE_ERRORS if field in message]
+            if not fields:
+                raise
+            raise serializers.ValidationError(
+                {field: [UNIQUE_ERRORS[field]] for field in fields})
+
     def create(self, validated_data):
         """
-        Creates a new user instance.
+        Creates a new user instance, adding its profile to the outbox in the
+        same transaction.
         """
         password = validated_data.pop('password')
         user = User(**validated_data)
         user.set_password(password)
-        user.save()
+        with transaction.atomic():
+            self.save_unique(user)
+            outbox.record(user, outbox.TRACKED_FIELDS, kind=ProfileChange.CREATED)
         return user
 
     def update(self, instance, validated_data):
         """
-        Updates an existing user instance.
+        Updates an existing user instance, writing only the columns whose
+        value changed and skipping the write entirely if none did. Profile
+        changes go to the outbox in the same transaction.
         """
-        instance.username = validated_data.get('username', instance.username)
-        instance.email = validated_data.get('email', instance.email)
-        instance.first_name = validated_data.get('first_name', instance.first_name)
-        instance.last_name = validated_data.get('last_name', instance.last_name)
-        instance.bio = validated_data.get('bio', instance.bio)
-        instance.picture_path = validated_data.get(
-            'picture_path', instance.picture_path)
-        password = validated_data.get('password')
+        password = validated_data.pop('password', None)
+        update_fields = []
+        for field, value in validated_data.items():
+            if getattr(instance, field) != value:
+                setattr(instance, field, value)
+                update_fields.append(field)
 
         if password is not None:
             instance.set_password(password)
+            update_fields.append('password')
 
-        instance.save()
+        if update_fields:
+            with transaction.atomic():
+                self.save_unique(instance, update_fields=update_fields)
+                outbox.record(instance, update_fields)
         return instance
+
+
+class PresenceQuerySerializer(serializers.Serializer):
+    """
+    Serializer class for validating a bulk presence query.
+    """
+
+    ids = serializers.ListField(
+        child=serializers.IntegerField(), allow_empty=False, max_length=1000)
+    idle = serializers.IntegerField(
+        min_value=1, max_value=24 * 60 * 60, required=False,
+        help_text="Idle threshold in seconds.")
+
+
+class ProfileChangeSerializer(serializers.ModelSerializer):
+    """
+    Serializer class for reading the outbox of profile changes.
+    """
+
+    seq = serializers.IntegerField(source='id')
+
+    class Meta:
+        """
+        Metadata options for the ProfileChangeSerializer class.
+        """
+        model = ProfileChange
+        fields = ['seq', 'user', 'kind', 'fields', 'created_at']
+
+
+class ChangesQuerySerializer(serializers.Serializer):
+    """
+    Serializer class for validating a read of the profile change stream.
+    """
+
+    after = serializers.IntegerField(
+        min_value=0, default=0,
+        help_text="Sequence number of the last change already seen.")
+    gaps = serializers.ListField(
+        child=serializers.IntegerField(min_value=1), max_length=100, default=list,
+        help_text="Sequence numbers below `after` still to read.")
+    limit = serializers.IntegerField(min_value=1, max_value=1000, default=100)
+
+
+class RecordedTokenObtainPairSerializer(TokenObtainPairSerializer):
+    """
+    Serializer class for logging in. The issued refresh token starts a new
+    family in the refresh token store.
+    """
+
+    @classmethod
+    def get_token(cls, user):
+        return tokens.record(super().get_token(user), user.pk)
+
+
+class RotatingTokenRefreshSerializer(TokenRefreshSerializer):
+    """
+    Serializer class for refreshing. Every refresh token can be used once
+    and is replaced by a new one of the same family.
+    """
+
+    def validate(self, attrs):
+        refresh = tokens.rotate(self.token_class(attrs["refresh"]))
+        return {"access": str(refresh.access_token), "refresh": str(refresh)}
@@ -1,11 +1,28 @@
+import hashlib
+import hmac
+import io
 import json
-from django.test import TestCase, Client
+import unittest
+from unittest import mock
+from datetime import timedelta
+from django.db import DatabaseError, connection
+from concurrent.futures import ThreadPoolExecutor
+from django.core.management import CommandError, call_command
+from django.test import LiveServerTestCase, TestCase, TransactionTestCase, Client
+from django.test import override_settings
+from django.test.utils import CaptureQueriesContext
 from django.urls import reverse
 from django.forms.models import model_to_dict
 from rest_framework import status
+from rest_framework.exceptions import ValidationError
 from rest_framework_simplejwt.tokens import RefreshToken
-from .models import User
-from .factories import UserFactory
+from django.utils import timezone
+from .admin import UserAdmin
+from .models import OutboxCursor, ProfileChange, RefreshTokenRecord, User
+from .factories import PASSWORD, UserFactory, seed_users
+from .presence import PresenceIndex
+from .serializers import UserSerializer
+from . import outbox, presence, tokens
 
 
 def omit(data, keys):
@@ -27,12 +44,6 @@ class UserPostViewTests(TestCase):
     successful creation, repeated username or email, and missing required fields.
     """
 
-    def setUp(self):
-        """
-        Deletes all existing user objects before each test method is run.
-        """
-        User.objects.all().delete()
-
     def test_success_with_required_attrs_only(self):
         """
         Test method for successful user creation.
@@ -142,16 +153,96 @@ class UserPostViewTests(TestCase):
         self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
 
 
-class UserDeleteViewTests(TestCase):
+class SignupUniquenessTests(TestCase):
     """
-    A test class for testing the functionality of deleting a user.
+    Tests for the combined, case-insensitive uniqueness check at signup.
     """
 
-    def setUp(self):
+    def test_single_query(self):
+        """
+        Username and email are checked with one query.
+        """
+        fake_user = omit(model_to_dict(UserFactory.build()), ["id"])
+        serializer = UserSerializer(data=fake_user)
+
+        with self.assertNumQueries(1):
+            self.assertTrue(serializer.is_valid())
+
+    def test_failure_with_email_in_other_case(self):
+        """
+        Test method for user creation with an email differing only in case.
+        """
+        fake_user = UserFactory()
+        repeated_email_fake_user = omit(model_to_dict(
+            UserFactory.build(email=fake_user.email.upper())), ["id"])
+
+        response = client.post(reverse("user"), data=repeated_email_fake_user)
+
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        response_data = json.loads(response.content.decode('utf-8'))
+        self.assertEqual(list(response_data), ["email"])
+
+    def test_failure_with_both_repeated(self):
+        """
+        Both errors are reported when username and email belong to others.
+        """
+        first, second = UserFactory(), UserFactory()
+        fake_user = omit(model_to_dict(UserFactory.build(
+            username=first.username, email=second.email)), ["id"])
+
+        response = client.post(reverse("user"), data=fake_user)
+
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        response_data = json.loads(response.content.decode('utf-8'))
+        self.assertCountEqual(list(response_data), ["username", "email"])
+
+    def test_constraint_violation_is_a_validation_error(self):
         """
-        Deletes all existing user objects before each test method is run.
+        A duplicate inserted after validation is reported, not raised.
         """
-        User.objects.all().delete()
+        fake_user = omit(model_to_dict(UserFactory.build()), ["id"])
+        serializer = UserSerializer(data=fake_user)
+        self.assertTrue(serializer.is_valid())
+        UserFactory(username=fake_user["username"])
+
+        with self.assertRaises(ValidationError) as context:
+            serializer.save()
+
+        self.assertEqual(list(context.exception.detail), ["username"])
+
+
+@unittest.skipIf(connection.vendor == "sqlite",
+                 "the in-memory SQLite test database cannot take parallel writes")
+class ConcurrentSignupTests(TransactionTestCase):
+    """
+    Fires identical signups in parallel.
+    """
+
+    def test_one_signup_wins(self):
+        """
+        Exactly one of the parallel duplicates is created, the others get 400.
+        """
+        fake_user = omit(model_to_dict(UserFactory.build()), ["id"])
+
+        def signup(_):
+            try:
+                return Client().post(reverse("user"), data=fake_user).status_code
+            finally:
+                connection.close()
+
+        with ThreadPoolExecutor(max_workers=4) as executor:
+            codes = list(executor.map(signup, range(8)))
+
+        self.assertEqual(codes.count(status.HTTP_201_CREATED), 1)
+        self.assertEqual(codes.count(status.HTTP_400_BAD_REQUEST), 7)
+        self.assertEqual(User.objects.filter(
+            username=fake_user["username"]).count(), 1)
+
+
+class UserDeleteViewTests(TestCase):
+    """
+    A test class for testing the functionality of deleting a user.
+    """
 
     def test_success(self):
         """
@@ -193,12 +284,6 @@ class UserGetViewTests(TestCase):
     A test case class for testing the successful retrieval of user data.
     """
 
-    def setUp(self):
-        """
-        Deletes all existing user objects before each test method is run.
-        """
-        User.objects.all().delete()
-
     def test_success(self):
         """
         Test the successful scenario of retrieving user data.
@@ -251,28 +336,25 @@ class UserPutViewTests(TestCase):
     A test case class for testing the successful updating of user data.
     """
 
-    def setUp(self):
+    @classmethod
+    def setUpTestData(cls):
         """
-        Deletes all existing user objects before each test method is run.
+        Creates the user to update, another user and an authorization header.
         """
-        User.objects.all().delete()
+        cls.fake_user, cls.existing_user = UserFactory(), UserFactory()
+        refresh = RefreshToken.for_user(cls.fake_user)
+        cls.authorization = 'Bearer ' + str(refresh.access_token)  # type: ignore
 
     def test_success(self):
         """
         A method that tests the success case of updating a user's information.
         """
-        fake_user = UserFactory()
-        user_instance = User(id=fake_user.id,  # type: ignore
-                             username=fake_user.username,
-                             email=fake_user.email,
-                             password=fake_user.password)
-        refresh = RefreshToken.for_user(user_instance)
         updated_fake_user = model_to_dict(UserFactory.build())
 
         response = client.put(
             reverse("user"),
             data=updated_fake_user,
-            HTTP_AUTHORIZATION='Bearer ' + str(refresh.access_token),  # type: ignore
+            HTTP_AUTHORIZATION=self.authorization,
             content_type="application/json",
         )
 
@@ -290,7 +372,7 @@ class UserPutViewTests(TestCase):
                          updated_fake_user["picture_path"])
 
         # check db
-        user = User.objects.get(id=fake_user.id)  # type: ignore
+        user = User.objects.get(id=self.fake_user.id)  # type: ignore
         self.assertEqual(user.username, updated_fake_user["username"])
         self.assertEqual(user.email, updated_fake_user["email"])
         self.assertEqual(user.first_name, updated_fake_user["first_name"])
@@ -302,21 +384,13 @@ class UserPutViewTests(TestCase):
         """
         Tests the failure case when updating user with existing username.
         """
-        existing_user = UserFactory()
-
-        fake_user = UserFactory()
-        user_instance = User(id=fake_user.id,  # type: ignore
-                             username=fake_user.username,
-                             email=fake_user.email,
-                             password=fake_user.password)
-        refresh = RefreshToken.for_user(user_instance)
         updated_fake_user = model_to_dict(
-            UserFactory.build(username=existing_user.username))
+            UserFactory.build(username=self.existing_user.username))
 
         response = client.put(
             reverse("user"),
             data=updated_fake_user,
-            HTTP_AUTHORIZATION='Bearer ' + str(refresh.access_token),  # type: ignore
+            HTTP_AUTHORIZATION=self.authorization,
             content_type="application/json",
         )
 
@@ -326,21 +400,13 @@ class UserPutViewTests(TestCase):
         """
         Tests the failure case when updating user with existing email.
         """
-        existing_user = UserFactory()
-
-        fake_user = UserFactory()
-        user_instance = User(id=fake_user.id,  # type: ignore
-                             username=fake_user.username,
-                             email=fake_user.email,
-                             password=fake_user.password)
-        refresh = RefreshToken.for_user(user_instance)
         updated_fake_user = model_to_dict(
-            UserFactory.build(email=existing_user.email))
+            UserFactory.build(email=self.existing_user.email))
 
         response = client.put(
             reverse("user"),
             data=updated_fake_user,
-            HTTP_AUTHORIZATION='Bearer ' + str(refresh.access_token),  # type: ignore
+            HTTP_AUTHORIZATION=self.authorization,
             content_type="application/json",
         )
 
@@ -381,28 +447,25 @@ class UsePatchViewTests(TestCase):
     A test case class for testing the successful updating of user data.
     """
 
-    def setUp(self):
+    @classmethod
+    def setUpTestData(cls):
         """
-        Deletes all existing user objects before each test method is run.
+        Creates the user to update, another user and an authorization header.
         """
-        User.objects.all().delete()
+        cls.fake_user, cls.existing_user = UserFactory(), UserFactory()
+        refresh = RefreshToken.for_user(cls.fake_user)
+        cls.authorization = 'Bearer ' + str(refresh.access_token)  # type: ignore
 
     def test_success_update_username(self):
         """
         Tests the success case of updating a username.
         """
-        fake_user = UserFactory()
-        user_instance = User(id=fake_user.id,  # type: ignore
-                             username=fake_user.username,
-                             email=fake_user.email,
-                             password=fake_user.password)
-        refresh = RefreshToken.for_user(user_instance)
         updated_fake_user = {"username": "updated_username"}
 
         response = client.patch(
             reverse("user"),
             data=updated_fake_user,
-            HTTP_AUTHORIZATION='Bearer ' + str(refresh.access_token),  # type: ignore
+            HTTP_AUTHORIZATION=self.authorization,
             content_type="application/json",
         )
 
@@ -412,40 +475,32 @@ class UsePatchViewTests(TestCase):
         response_data = json.loads(response.content.decode('utf-8'))
         self.assertIsInstance(response_data["id"], int)
         self.assertEqual(response_data["username"], updated_fake_user["username"])
-        self.assertEqual(response_data["first_name"], fake_user.first_name)
-        self.assertEqual(response_data["email"], fake_user.email)
-        self.assertEqual(response_data["last_name"], fake_user.last_name)
-        self.assertEqual(response_data["bio"], fake_user.bio)
+        self.assertEqual(response_data["first_name"], self.fake_user.first_name)
+        self.assertEqual(response_data["email"], self.fake_user.email)
+        self.assertEqual(response_data["last_name"], self.fake_user.last_name)
+        self.assertEqual(response_data["bio"], self.fake_user.bio)
         self.assertEqual(response_data["picture_path"],
-                         fake_user.picture_path)
+                         self.fake_user.picture_path)
 
         # check db
-        user = User.objects.get(id=fake_user.id)  # type: ignore
+        user = User.objects.get(id=self.fake_user.id)  # type: ignore
         self.assertEqual(user.username, updated_fake_user["username"])
-        self.assertEqual(user.email, fake_user.email)
-        self.assertEqual(user.first_name, fake_user.first_name)
-        self.assertEqual(user.last_name, fake_user.last_name)
-        self.assertEqual(user.bio, fake_user.bio)
-        self.assertEqual(user.picture_path, fake_user.picture_path)
+        self.assertEqual(user.email, self.fake_user.email)
+        self.assertEqual(user.first_name, self.fake_user.first_name)
+        self.assertEqual(user.last_name, self.fake_user.last_name)
+        self.assertEqual(user.bio, self.fake_user.bio)
+        self.assertEqual(user.picture_path, self.fake_user.picture_path)
 
     def test_failure_repeated_username(self):
         """
         Tests the failure case when updating user with existing username.
         """
-        existing_user = UserFactory()
-
-        fake_user = UserFactory()
-        user_instance = User(id=fake_user.id,  # type: ignore
-                             username=fake_user.username,
-                             email=fake_user.email,
-                             password=fake_user.password)
-        refresh = RefreshToken.for_user(user_instance)
-        updated_fake_user = {"username": existing_user.username}
+        updated_fake_user = {"username": self.existing_user.username}
 
         response = client.patch(
             reverse("user"),
             data=updated_fake_user,
-            HTTP_AUTHORIZATION='Bearer ' + str(refresh.access_token),  # type: ignore
+            HTTP_AUTHORIZATION=self.authorization,
             content_type="application/json",
         )
 
@@ -455,20 +510,12 @@ class UsePatchViewTests(TestCase):
         """
         Tests the failure case when updating user with existing email.
         """
-        existing_user = UserFactory()
-
-        fake_user = UserFactory()
-        user_instance = User(id=fake_user.id,  # type: ignore
-                             username=fake_user.username,
-                             email=fake_user.email,
-                             password=fake_user.password)
-        refresh = RefreshToken.for_user(user_instance)
-        updated_fake_user = {"email": existing_user.email}
+        updated_fake_user = {"email": self.existing_user.email}
 
         response = client.patch(
             reverse("user"),
             data=updated_fake_user,
-            HTTP_AUTHORIZATION='Bearer ' + str(refresh.access_token),  # type: ignore
+            HTTP_AUTHORIZATION=self.authorization,
             content_type="application/json",
         )
 
@@ -502,3 +549,652 @@ class UsePatchViewTests(TestCase):
         )
 
         self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+
+
+class UserPatchQueryTests(TestCase):
+    """
+    Tests asserting the SQL emitted by partial updates.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        """
+        Creates a user and its authorization header.
+        """
+        cls.fake_user = UserFactory()
+        refresh = RefreshToken.for_user(cls.fake_user)
+        cls.authorization = 'Bearer ' + str(refresh.access_token)  # type: ignore
+
+    def patch(self, data):
+        """
+        Patch the user and return the UPDATE statements run by the serializer.
+        """
+        with CaptureQueriesContext(connection) as queries:
+            response = client.patch(
+                reverse("user"),
+                data=data,
+                HTTP_AUTHORIZATION=self.authorization,
+                content_type="application/json",
+            )
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return [query["sql"] for query in queries
+                if query["sql"].startswith('UPDATE "users_user"')
+                and '"last_activity"' not in query["sql"]]
+
+    def test_only_changed_columns_are_written(self):
+        """
+        Patching the bio updates the bio column only.
+        """
+        updates = self.patch({"bio": "new bio", "email": self.fake_user.email})
+
+        self.assertEqual(len(updates), 1)
+        self.assertIn('SET "bio" = ', updates[0])
+        for column in ("email", "username", "password", "first_name"):
+            self.assertNotIn(f'"{column}" =', updates[0])
+        self.assertEqual(User.objects.get(pk=self.fake_user.pk).bio, "new bio")
+
+    def test_unchanged_values_skip_the_write(self):
+        """
+        Patching with the current values does not write at all.
+        """
+        updates = self.patch({"bio": self.fake_user.bio,
+                              "username": self.fake_user.username})
+
+        self.assertEqual(updates, [])
+
+    def test_password_is_hashed_only_when_supplied(self):
+        """
+        The password column is written only when a password is sent.
+        """
+        self.assertNotIn('"password"', self.patch({"bio": "x"})[0])
+
+        updates = self.patch({"password": "an0ther-pass"})
+
+        self.assertEqual(len(updates), 1)
+        self.assertIn('SET "password" = ', updates[0])
+        self.assertTrue(User.objects.get(pk=self.fake_user.pk).check_password(
+            "an0ther-pass"))
+
+
+class PresenceIndexTests(TestCase):
+    """
+    Tests for the in-memory, minute-bucketed presence index.
+    """
+
+    def test_online_within_threshold(self):
+        """
+        Users touched within the idle threshold are online.
+        """
+        index = PresenceIndex(window_minutes=10)
+        index.touch(1, at=600)
+        index.touch(2, at=600 + 4 * 60)
+
+        self.assertEqual(index.online([1, 2, 3], 5 * 60, now=600 + 4 * 60), {1, 2})
+        self.assertEqual(index.online([1, 2, 3], 60, now=600 + 4 * 60), {2})
+
+    def test_ring_buffer_overwrites_old_minutes(self):
+        """
+        Activity older than the window is forgotten when its slot is reused.
+        """
+        index = PresenceIndex(window_minutes=10)
+        index.touch(1, at=0)
+        index.touch(2, at=10 * 60)
+
+        self.assertEqual(index.online([1, 2], 60 * 60, now=10 * 60), {2})
+
+    def test_touch_reports_first_hit_per_minute(self):
+        """
+        Only the first hit within a minute is reported as new.
+        """
+        index = PresenceIndex(window_minutes=10)
+
+        self.assertTrue(index.touch(1, at=60))
+        self.assertFalse(index.touch(1, at=90))
+        self.assertTrue(index.touch(1, at=120))
+
+
+class PresenceViewTests(TestCase):
+    """
+    Tests for the bulk "who is online" endpoint.
+    """
+
+    def setUp(self):
+        """
+        Starts every test with an empty presence index.
+        """
+        presence.index.clear()
+
+    def test_success(self):
+        """
+        Recently active users are online, idle and unknown users are not.
+        """
+        fake_user = UserFactory()
+        active_user = UserFactory()
+        idle_user = UserFactory(
+            last_activity=timezone.now() - timedelta(hours=1))
+        presence.index.touch(active_user.id)  # type: ignore
+        ids = [active_user.id, idle_user.id, 0]  # type: ignore
+        refresh = RefreshToken.for_user(fake_user)
+
+        response = client.post(
+            reverse("user_presence"),
+            data={"ids": ids},
+            HTTP_AUTHORIZATION='Bearer ' + str(refresh.access_token),  # type: ignore
+            content_type="application/json",
+        )
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        response_data = json.loads(response.content.decode('utf-8'))
+        self.assertEqual(response_data["online"], {
+            str(active_user.id): True,  # type: ignore
+            str(idle_user.id): False,  # type: ignore
+            "0": False,
+        })
+
+    def test_success_with_idle_threshold(self):
+        """
+        A larger idle threshold is answered from the last_activity column.
+        """
+        fake_user = UserFactory()
+        idle_user = UserFactory(
+            last_activity=timezone.now() - timedelta(minutes=30))
+        refresh = RefreshToken.for_user(fake_user)
+
+        response = client.post(
+            reverse("user_presence"),
+            data={"ids": [idle_user.id], "idle": 3600},  # type: ignore
+            HTTP_AUTHORIZATION='Bearer ' + str(refresh.access_token),  # type: ignore
+            content_type="application/json",
+        )
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        response_data = json.loads(response.content.decode('utf-8'))
+        self.assertEqual(response_data["online"], {str(idle_user.id): True})
+
+    def test_requests_mark_user_online(self):
+        """
+        Any authenticated request marks the caller as online.
+        """
+        fake_user = UserFactory()
+        refresh = RefreshToken.for_user(fake_user)
+
+        client.get(
+            reverse("user"),
+            HTTP_AUTHORIZATION='Bearer ' + str(refresh.access_token))  # type: ignore
+
+        self.assertEqual(presence.online_status([fake_user.id]),  # type: ignore
+                         {fake_user.id: True})  # type: ignore
+
+    def test_failure_no_token(self):
+        """
+        Tests the failure case when no token is provided.
+        """
+        response = client.post(reverse("user_presence"), data={"ids": [1]},
+                               content_type="application/json")
+
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+
+
+class TokenRotationTests(TestCase):
+    """
+    Tests for single-use refresh tokens and family-based reuse detection.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        """
+        Creates a user.
+        """
+        cls.fake_user = UserFactory()
+
+    def setUp(self):
+        """
+        Logs the user in.
+        """
+        response = client.post(reverse("token_obtain_pair"), data={
+            "username": self.fake_user.username, "password": PASSWORD})
+        self.refresh = json.loads(response.content.decode('utf-8'))["refresh"]
+
+    def refresh_token(self, token):
+        """
+        Post the given refresh token to the refresh endpoint.
+        """
+        return client.post(reverse("token_refresh"), data={"refresh": token})
+
+    def test_login_records_token(self):
+        """
+        Logging in stores the refresh token by its hash.
+        """
+        record = RefreshTokenRecord.objects.get(user=self.fake_user)
+        self.assertIsNone(record.used_at)
+        self.assertFalse(record.revoked)
+
+    def test_refresh_rotates(self):
+        """
+        Refreshing returns a new refresh token of the same family.
+        """
+        with CaptureQueriesContext(connection) as queries:
+            response = self.refresh_token(self.refresh)
+
+        # consume the old token and record the new, in one transaction (a
+        # savepoint inside the test's own)
+        statements = [query["sql"].split()[0] for query in queries]
+        self.assertEqual([verb for verb in statements
+                          if verb not in ("SAVEPOINT", "RELEASE")],
+                         ["UPDATE", "INSERT"])
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        response_data = json.loads(response.content.decode('utf-8'))
+        self.assertNotEqual(response_data["refresh"], self.refresh)
+        self.assertIn("access", response_data)
+        self.assertEqual(RefreshTokenRecord.objects.values("family").distinct()
+                         .count(), 1)
+        self.assertEqual(self.refresh_token(response_data["refresh"]).status_code,
+                         status.HTTP_200_OK)
+
+    def test_failure_reused_token_revokes_family(self):
+        """
+        Tests the failure case when a rotated token is presented again.
+        """
+        successor = json.loads(self.refresh_token(self.refresh).content.decode(
+            'utf-8'))["refresh"]
+
+        response = self.refresh_token(self.refresh)
+
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+        self.assertEqual(self.refresh_token(successor).status_code,
+                         status.HTTP_401_UNAUTHORIZED)
+        self.assertTrue(all(RefreshTokenRecord.objects.values_list(
+            "revoked", flat=True)))
+
+    def test_failed_successor_keeps_token(self):
+        """
+        If the successor cannot be recorded the token is not consumed, so
+        the client's retry is not taken for reuse.
+        """
+        with mock.patch.object(RefreshTokenRecord.objects, "create",
+                               side_effect=DatabaseError("disk full")):
+            with self.assertRaises(DatabaseError):
+                self.refresh_token(self.refresh)
+
+        response = self.refresh_token(self.refresh)
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertFalse(RefreshTokenRecord.objects.filter(revoked=True).exists())
+
+    def test_failure_unrecorded_token(self):
+        """
+        Tests the failure case when the token was never recorded.
+        """
+        response = self.refresh_token(str(RefreshToken.for_user(self.fake_user)))
+
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+
+    def test_prune_expired(self):
+        """
+        Expired records are deleted in batches, live ones are kept.
+        """
+        for _ in range(5):
+            tokens.record(RefreshToken.for_user(self.fake_user), self.fake_user.pk)
+        RefreshTokenRecord.objects.exclude(
+            pk=RefreshTokenRecord.objects.order_by("pk").first().pk,  # type: ignore
+        ).update(expires_at=timezone.now() - timedelta(seconds=1))
+
+        self.assertEqual(tokens.prune_expired(batch_size=2), 5)
+        self.assertEqual(RefreshTokenRecord.objects.count(), 1)
+
+
+class UserAdminTests(TestCase):
+    """
+    Tests for the keyset-paginated user changelist.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        """
+        Creates a superuser and a few more users.
+        """
+        cls.admin = UserFactory(username="root", is_staff=True, is_superuser=True)
+        cls.users = seed_users(3)
+
+    def setUp(self):
+        """
+        Logs the superuser in.
+        """
+        self.client.force_login(self.admin)
+        self.url = reverse("admin:users_user_changelist")
+
+    def page(self, **params):
+        """
+        Fetch a changelist page with a page size of two.
+        """
+        with mock.patch.object(UserAdmin, "list_per_page", 2), \
+                CaptureQueriesContext(connection) as queries:
+            response = self.client.get(self.url, params)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        sql = " ".join(query["sql"] for query in queries)
+        self.assertNotIn("OFFSET", sql.upper())
+        return response.context["cl"]
+
+    def test_keyset_pages(self):
+        """
+        Pages follow the cursor, newest first, without OFFSET.
+        """
+        first = self.page()
+        self.assertEqual(list(first.result_list), self.users[:0:-1])
+        self.assertEqual(first.result_count, 4)
+
+        second = self.page(cursor=first.next_cursor)
+        self.assertEqual(list(second.result_list), [self.users[0], self.admin])
+        self.assertIsNone(second.next_page_url)
+
+    def test_search(self):
+        """
+        Searching matches a username prefix or an exact email in any case.
+        """
+        cl = self.page(q="user")
+        self.assertEqual(cl.result_count, 3)
+        cl = self.page(q="user", cursor=cl.next_cursor)
+        self.assertEqual(list(cl.result_list), [self.users[0]])
+        self.assertEqual(cl.first_page_url, "?q=user")
+
+        cl = self.page(q=self.users[1].email.upper())
+        self.assertEqual(list(cl.result_list), [self.users[1]])
+
+        cl = self.page(q="ser")
+        self.assertEqual(list(cl.result_list), [])
+
+    def test_failure_invalid_cursor(self):
+        """
+        Tests the failure case when the cursor is not a primary key.
+        """
+        response = self.client.get(self.url, {"cursor": "x"})
+
+        self.assertEqual(response.status_code, status.HTTP_302_FOUND)
+        self.assertIn("e=1", response["Location"])
+
+
+class LoadTestCommandTests(LiveServerTestCase):
+    """
+    Runs the load generator briefly against a live server.
+    """
+
+    def test_reports_every_endpoint(self):
+        """
+        Every endpoint of the mix is exercised and none fails.
+
+        The live server shares one SQLite connection between its request
+        threads, so a single client without background signups keeps the
+        requests sequential. The mix leaves out random logins, which would
+        reset the refresh timer, so the token is refreshed on schedule.
+        """
+        out = io.StringIO()
+        call_command("loadtest", url=self.live_server_url, clients=1, duration=1,
+                     mix="0,1,1", refresh_interval=0.3, signup_rate=0, think=0.01,
+                     json=True, stdout=out)
+
+        rows = {row["endpoint"]: row for row in json.loads(out.getvalue())}
+        self.assertCountEqual(rows, [
+            "POST /api/token/", "POST /api/token/refresh/", "GET /api/user/",
+            "PATCH /api/user/"])
+        for row in rows.values():
+            self.assertEqual(set(row["statuses"]), {"200"}, row)
+            self.assertEqual(row["error_rate"], 0, row)
+            self.assertLessEqual(row["p50"], row["p99"])
+
+    @unittest.skipIf(connection.vendor == "sqlite",
+                     "the live server shares one SQLite connection between threads")
+    def test_concurrent_clients(self):
+        """
+        Several clients and the signup thread run concurrently, every client
+        logs in at least once and every request succeeds.
+        """
+        out = io.StringIO()
+        call_command("loadtest", url=self.live_server_url, clients=3,
+                     duration=1.5, refresh_interval=0.3, signup_rate=4,
+                     think=0.01, json=True, stdout=out)
+
+        rows = {row["endpoint"]: row for row in json.loads(out.getvalue())}
+        self.assertCountEqual(rows, [
+            "POST /api/token/", "POST /api/token/refresh/", "GET /api/user/",
+            "PATCH /api/user/", "POST /api/user/"])
+        self.assertGreaterEqual(rows["POST /api/token/"]["statuses"]["200"], 3)
+        self.assertGreaterEqual(rows["POST /api/user/"]["statuses"]["201"], 2)
+        for row in rows.values():
+            self.assertEqual(sum(row["statuses"].values()), row["requests"], row)
+            self.assertLessEqual(set(row["statuses"]), {"200", "201"}, row)
+            self.assertEqual(row["error_rate"], 0, row)
+
+    def test_invalid_mix(self):
+        """
+        A mix other than three non-negative weights, not all zero, is refused
+        before any request is sent.
+        """
+        for mix in ["1,8", "1,8,2,1", "1,-1,2", "0,0,0", "1,x,2", "nan,1,1"]:
+            with self.subTest(mix=mix), self.assertRaises(CommandError):
+                call_command("loadtest", url="http://127.0.0.1:9", mix=mix,
+                             stdout=io.StringIO())
+
+
+class ListSubscriber:
+    """
+    An outbox subscriber keeping what it is sent, or failing when told to.
+    """
+
+    def __init__(self, fail=False):
+        self.events = []
+        self.fail = fail
+
+    def publish(self, events):
+        """
+        Keeps the events.
+        """
+        if self.fail:
+            raise ConnectionError("subscriber is down")
+        self.events.extend(events)
+
+
+class OutboxTests(TestCase):
+    """
+    Tests for recording profile changes and relaying them to subscribers.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        """
+        Creates a user and its authorization header.
+        """
+        cls.fake_user = UserFactory()
+        refresh = RefreshToken.for_user(cls.fake_user)
+        cls.authorization = 'Bearer ' + str(refresh.access_token)  # type: ignore
+
+    def patch(self, data):
+        """
+        Patch the user.
+        """
+        response = client.patch(reverse("user"), data=data,
+                                HTTP_AUTHORIZATION=self.authorization,
+                                content_type="application/json")
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+    def test_signup_records_profile(self):
+        """
+        A signup adds the new profile to the outbox.
+        """
+        fake_user = omit(model_to_dict(UserFactory.build()), ["id"])
+
+        client.post(reverse("user"), data=fake_user)
+
+        change = ProfileChange.objects.get()
+        self.assertEqual(change.kind, ProfileChange.CREATED)
+        self.assertEqual(change.user.username, fake_user["username"])
+        self.assertEqual(change.fields, {
+            field: fake_user[field] for field in outbox.TRACKED_FIELDS})
+
+    def test_update_records_tracked_fields_only(self):
+        """
+        Only changed, tracked fields are recorded, unchanged ones are not.
+        """
+        self.patch({"bio": "new bio", "last_name": "Other"})
+        self.patch({"bio": "new bio"})
+        self.patch({"last_name": "Again"})
+
+        change = ProfileChange.objects.get()
+        self.assertEqual((change.kind, change.fields),
+                         (ProfileChange.UPDATED, {"bio": "new bio"}))
+
+    def test_failure_outbox_write_rolls_back_update(self):
+        """
+        Tests the failure case when the outbox write fails with the update.
+        """
+        serializer = UserSerializer(self.fake_user, data={"bio": "lost"},
+                                    partial=True)
+        self.assertTrue(serializer.is_valid())
+
+        with mock.patch.object(outbox, "record", side_effect=DatabaseError), \
+                self.assertRaises(DatabaseError):
+            serializer.save()
+
+        self.assertNotEqual(User.objects.get(pk=self.fake_user.pk).bio, "lost")
+
+    def test_relay_resumes_from_cursor(self):
+        """
+        Each subscriber gets every change once, in order, and a failing one
+        neither loses changes nor holds the others back.
+        """
+        working, failing = ListSubscriber(), ListSubscriber(fail=True)
+        relay = outbox.Relay({"working": working, "failing": failing},
+                             batch_size=2)
+        for bio in ("a", "b", "c"):
+            self.patch({"bio": bio})
+
+        self.assertEqual(relay.relay(), 2)
+        self.assertEqual(relay.relay(), 1)
+        self.assertEqual(relay.relay(), 0)
+        self.assertEqual([event["fields"]["bio"] for event in working.events],
+                         ["a", "b", "c"])
+        self.assertEqual(list(relay.errors), ["failing"])
+        self.assertEqual(OutboxCursor.objects.get(subscriber="failing").position, 0)
+
+        failing.fail = False
+        while relay.relay():
+            pass
+        self.assertEqual(failing.events, working.events)
+        self.assertEqual(relay.prune(timezone.now()), 3)
+
+    def test_late_commit_is_relayed(self):
+        """
+        A change committed after a later one was relayed still follows, and
+        the gap it left is closed.
+        """
+        working = ListSubscriber()
+        relay = outbox.Relay({"working": working})
+        for bio in ("a", "b", "c"):
+            self.patch({"bio": bio})
+        late = ProfileChange.objects.order_by("pk")[1]
+        late_id = late.pk
+        late.delete()
+
+        self.assertEqual(relay.relay(), 2)
+        cursor = OutboxCursor.objects.get()
+        self.assertEqual(cursor.gaps, [late_id])
+        late.pk = late_id
+        late.save()
+        self.assertEqual(relay.relay(), 1)
+        self.assertEqual(relay.relay(), 0)
+
+        self.assertEqual([event["fields"]["bio"] for event in working.events],
+                         ["a", "c", "b"])
+        self.assertEqual(OutboxCursor.objects.get().gaps, [])
+
+    def test_old_gaps_are_given_up(self):
+        """
+        Ids skipped before a change older than the gap timeout are not
+        waited for, their transactions rolled back.
+        """
+        relay = outbox.Relay({"working": ListSubscriber()},
+                             gap_timeout=timedelta(minutes=5))
+        for bio in ("a", "b", "c", "d"):
+            self.patch({"bio": bio})
+        changes = list(ProfileChange.objects.order_by("pk"))
+        ProfileChange.objects.filter(pk__in=[changes[0].pk, changes[2].pk]).delete()
+        ProfileChange.objects.filter(pk=changes[1].pk).update(
+            created_at=timezone.now() - timedelta(minutes=10))
+
+        self.assertEqual(relay.relay(), 2)
+        self.assertEqual(OutboxCursor.objects.get().gaps, [changes[2].pk])
+
+    def test_webhook_is_signed(self):
+        """
+        Webhook batches carry an HMAC of the body.
+        """
+        subscriber = outbox.WebhookSubscriber("http://hooks.example.com/", "key")
+
+        with mock.patch("urllib.request.urlopen") as urlopen:
+            subscriber.publish([{"seq": 1}])
+
+        request = urlopen.call_args.args[0]
+        self.assertEqual(json.loads(request.data), {"events": [{"seq": 1}]})
+        self.assertEqual(request.get_header(outbox.SIGNATURE_HEADER.capitalize()),
+                         hmac.new(b"key", request.data, hashlib.sha256).hexdigest())
+
+    @override_settings(OUTBOX={"SETTLE_DELAY": None})
+    def test_changes_view_pages_by_sequence(self):
+        """
+        Services read the stream from their last sequence number.
+        """
+        staff = UserFactory(is_staff=True)
+        authorization = 'Bearer ' + str(RefreshToken.for_user(staff).access_token)
+        for bio in ("a", "b", "c"):
+            self.patch({"bio": bio})
+
+        response = client.get(reverse("user_changes"), {"limit": 2},
+                              HTTP_AUTHORIZATION=authorization)
+        page = json.loads(response.content.decode('utf-8'))
+        response = client.get(reverse("user_changes"), {"after": page["next"]},
+                              HTTP_AUTHORIZATION=authorization)
+        rest = json.loads(response.content.decode('utf-8'))
+
+        self.assertEqual([change["fields"]["bio"]
+                          for change in page["results"] + rest["results"]],
+                         ["a", "b", "c"])
+        self.assertEqual(rest["next"], rest["results"][-1]["seq"])
+        self.assertEqual(rest["gaps"], [])
+
+    @override_settings(OUTBOX={"SETTLE_DELAY": None})
+    def test_changes_view_reads_gaps(self):
+        """
+        Services are told the ids skipped below the cursor and read them
+        back once committed.
+        """
+        staff = UserFactory(is_staff=True)
+        authorization = 'Bearer ' + str(RefreshToken.for_user(staff).access_token)
+        for bio in ("a", "b", "c"):
+            self.patch({"bio": bio})
+        late = ProfileChange.objects.order_by("pk")[1]
+        late_id = late.pk
+        late.delete()
+
+        response = client.get(reverse("user_changes"),
+                              HTTP_AUTHORIZATION=authorization)
+        page = json.loads(response.content.decode('utf-8'))
+        late.pk = late_id
+        late.save()
+        response = client.get(reverse("user_changes"),
+                              {"after": page["next"], "gaps": page["gaps"]},
+                              HTTP_AUTHORIZATION=authorization)
+        rest = json.loads(response.content.decode('utf-8'))
+
+        self.assertEqual(page["gaps"], [late_id])
+        self.assertEqual([change["fields"]["bio"] for change in rest["results"]],
+                         ["b"])
+        self.assertEqual((rest["next"], rest["gaps"]), (page["next"], []))
+
+    def test_failure_changes_view_not_staff(self):
+        """
+        Tests the failure case when the caller is not staff.
+        """
+        response = client.get(reverse("user_changes"),
+                              HTTP_AUTHORIZATION=self.authorization)
+
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
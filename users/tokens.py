@@ -0,0 +1,79 @@
+import hashlib
+import uuid
+from datetime import datetime, timezone as dt_timezone
+from django.db import transaction
+from django.utils import timezone
+from rest_framework_simplejwt.exceptions import TokenError
+from rest_framework_simplejwt.settings import api_settings
+from .models import RefreshTokenRecord
+
+FAMILY_CLAIM = "family"
+
+
+def hash_jti(jti):
+    """
+    Returns the stored digest of a token id.
+    """
+    return hashlib.sha256(jti.encode()).digest()
+
+
+def expiry_of(token):
+    """
+    Returns the expiry claim of a token as a datetime.
+    """
+    return datetime.fromtimestamp(token["exp"], tz=dt_timezone.utc)
+
+
+def record(token, user_id, family=None):
+    """
+    Starts a new family (or continues `family`) with the given refresh token.
+    """
+    family = family or uuid.uuid4()
+    token[FAMILY_CLAIM] = family.hex
+    RefreshTokenRecord.objects.create(
+        token_hash=hash_jti(token["jti"]), family=family, user_id=user_id,
+        expires_at=expiry_of(token))
+    return token
+
+
+def rotate(token):
+    """
+    Consumes a valid refresh token and turns it into its successor in place.
+
+    The happy path is one UPDATE on the unique token hash and one INSERT,
+    in one transaction, so a token is never consumed without a successor.
+    Reusing a consumed token revokes its family and raises TokenError.
+    """
+    token_hash = hash_jti(token["jti"])
+    with transaction.atomic():
+        consumed = RefreshTokenRecord.objects.filter(
+            token_hash=token_hash, used_at__isnull=True, revoked=False,
+        ).update(used_at=timezone.now())
+        if consumed:
+            token.set_jti()
+            token.set_exp()
+            token.set_iat()
+            return record(token, token[api_settings.USER_ID_CLAIM],
+                          family=uuid.UUID(token[FAMILY_CLAIM]))
+
+    family = token.get(FAMILY_CLAIM)
+    if family is not None:
+        RefreshTokenRecord.objects.filter(family=family).update(revoked=True)
+    raise TokenError("Token is invalid or has already been used")
+
+
+def prune_expired(batch_size=5000):
+    """
+    Deletes expired records in batches of primary keys, so every DELETE is
+    short and never locks a large part of the table. Returns the total.
+    """
+    now = timezone.now()
+    total = 0
+    while True:
+        batch = list(RefreshTokenRecord.objects.filter(
+            expires_at__lt=now).values_list("pk", flat=True)[:batch_size])
+        if not batch:
+            return total
+        total += RefreshTokenRecord.objects.filter(pk__in=batch).delete()[0]
+        if len(batch) < batch_size:
+            return total
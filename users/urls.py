@@ -3,11 +3,13 @@ from rest_framework_simplejwt.views import (
     TokenObtainPairView,
     TokenRefreshView,
 )
-from .views import UserView
+from .views import PresenceView, ProfileChangesView, UserView
 
 urlpatterns = [
     path('token/', TokenObtainPairView.as_view(), name='token_obtain_pair'),
     path('token/refresh/', TokenRefreshView.as_view(), name='token_refresh'),
 
     path('user/', UserView.as_view(), name="user"),
+    path('user/presence/', PresenceView.as_view(), name="user_presence"),
+    path('user/changes/', ProfileChangesView.as_view(), name="user_changes"),
 ]
@@ -1,10 +1,17 @@
+from datetime import timedelta
 from drf_yasg.utils import swagger_auto_schema
 from rest_framework import status
 from rest_framework.views import APIView
 from rest_framework.response import Response
-from rest_framework.permissions import IsAuthenticated
+from rest_framework.permissions import IsAdminUser, IsAuthenticated
 from django.contrib.auth import get_user_model
-from .serializers import UserSerializer
+from .serializers import (
+    ChangesQuerySerializer,
+    PresenceQuerySerializer,
+    ProfileChangeSerializer,
+    UserSerializer,
+)
+from . import outbox, presence
 
 User = get_user_model()
 
@@ -89,3 +96,54 @@ class UserView(APIView):
         user = self.get_object()
         user.delete()  # type: ignore
         return Response(status=status.HTTP_204_NO_CONTENT)
+
+
+class PresenceView(APIView):
+    """
+    A view answering which of many users are online.
+    """
+
+    permission_classes = [IsAuthenticated]
+
+    @swagger_auto_schema(request_body=PresenceQuerySerializer)
+    def post(self, request, format=None):
+        """
+        Return the online status of every requested user id.
+        """
+        serializer = PresenceQuerySerializer(data=request.data)
+        if serializer.is_valid():
+            idle = serializer.validated_data.get("idle")
+            status_by_id = presence.online_status(
+                serializer.validated_data["ids"],
+                idle=timedelta(seconds=idle) if idle else None)
+            return Response({"online": status_by_id})
+        return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+
+
+class ProfileChangesView(APIView):
+    """
+    A view streaming profile changes to services, resumable by sequence.
+    """
+
+    permission_classes = [IsAdminUser]
+
+    @swagger_auto_schema(
+        query_serializer=ChangesQuerySerializer,
+        responses={200: ProfileChangeSerializer(many=True)},)
+    def get(self, request, format=None):
+        """
+        Return the changes following the `after` sequence number and those
+        of the `gaps`, with the cursor to pass as `after` and `gaps` next time.
+        """
+        query = ChangesQuerySerializer(data=request.query_params)
+        if not query.is_valid():
+            return Response(query.errors, status=status.HTTP_400_BAD_REQUEST)
+        after, gaps = query.validated_data["after"], query.validated_data["gaps"]
+        changes = outbox.changes_after(after, query.validated_data["limit"],
+                                       outbox.settle_delay(), gaps)
+        after, gaps = outbox.advance(after, gaps, changes, outbox.gap_timeout())
+        return Response({
+            "results": ProfileChangeSerializer(changes, many=True).data,
+            "next": after,
+            "gaps": gaps,
+        })